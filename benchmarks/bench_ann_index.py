@@ -0,0 +1,69 @@
+# ベクトル索引ベンチマーク: 総当たり(flat) vs IVF-flat の構築時間・検索レイテンシ・再現率
+#
+# 使い方:
+#   python benchmarks/bench_ann_index.py --n 100000 --n 1000000 --dim 384 --nprobe 8 --nprobe 32
+
+import argparse
+import time
+import numpy as np
+from myrdal.knowledge.embedding_index import EmbeddingIndex
+from myrdal.knowledge.ann_index import IVFFlatIndex
+
+
+def make_data(n, dim, n_clusters, seed=0):
+    # 文埋め込みに近い「クラスタ構造を持つ」データを生成する
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    data = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 100000):
+        end = min(n, start + 100000)
+        labels = rng.integers(0, n_clusters, size=end - start)
+        data[start:end] = centers[labels] + 0.5 * rng.normal(size=(end - start, dim)).astype(np.float32)
+    return data, rng
+
+
+def timed_queries(index, queries, top_k, **params):
+    results = []
+    start = time.perf_counter()
+    for q in queries:
+        results.append({nid for nid, _ in index.search(q, top_k=top_k, **params)})
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def run(n, dim, nprobes, n_queries, top_k):
+    data, rng = make_data(n, dim, n_clusters=max(16, n // 500))
+    ids = [f"n{i}" for i in range(n)]
+    queries = data[rng.choice(n, n_queries, replace=False)] + 0.1 * rng.normal(size=(n_queries, dim)).astype(np.float32)
+
+    start = time.perf_counter()
+    flat = EmbeddingIndex(dim=dim)
+    flat.add_many(ids, data)
+    flat_build = time.perf_counter() - start
+    truth, flat_ms = timed_queries(flat, queries, top_k)
+    print(f"n={n:>8} dim={dim} flat: build {flat_build:6.2f}s  query {flat_ms:8.3f}ms")
+
+    start = time.perf_counter()
+    ivf = IVFFlatIndex(dim=dim)
+    ivf.add_many(ids, data)
+    ivf_build = time.perf_counter() - start
+    print(f"n={n:>8} dim={dim} ivf : build {ivf_build:6.2f}s  nlist={len(ivf.centroids)}")
+    for nprobe in nprobes:
+        found, ms = timed_queries(ivf, queries, top_k, nprobe=nprobe)
+        recall = np.mean([len(a & b) / top_k for a, b in zip(truth, found)])
+        print(f"    nprobe={nprobe:>4}: query {ms:8.3f}ms  recall@{top_k}={recall:.3f}  speedup x{flat_ms / ms:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, action="append", help="ノード数（複数指定可）")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--nprobe", type=int, action="append")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+    for n in args.n or [100000, 1000000]:
+        run(n, args.dim, args.nprobe or [4, 8, 16, 32], args.queries, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# 永続化LongTermMemoryの起動ベンチマーク: n件を保存済みのストアを別プロセスで開き、最初の検索が返るまでの時間を測る
+#
+# 使い方:
+#   python benchmarks/bench_long_term_startup.py --n 1000000 --dim 384 --path /tmp/ltm_bench
+#
+# 文書の埋め込みはランダムベクトルを直接渡して投入する（埋め込みモデルの計算時間を含めないため）。
+# 検索もquery_embeddingsで行い、ストアを開く時間 + 索引の読み込み + 1回目の検索の合計を「初回検索までの時間」とする。
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from myrdal.memory.long_term import LongTermMemory
+
+
+def populate(path, n, dim, batch):
+    ltm = LongTermMemory(path=path)
+    existing = ltm.collection.count()
+    rng = np.random.default_rng(0)
+    batch = min(batch, ltm.client.get_max_batch_size())
+    start = time.perf_counter()
+    for i in range(existing, n, batch):
+        end = min(n, i + batch)
+        vecs = rng.normal(size=(end - i, dim)).astype(np.float32)
+        ltm.collection.add(
+            ids=[f"doc_{j}" for j in range(i, end)],
+            documents=[f"memory {j}" for j in range(i, end)],
+            metadatas=[{"n": j} for j in range(i, end)],
+            embeddings=vecs.tolist(),
+        )
+        if (end // batch) % 20 == 0:
+            print(f"  populated {end}/{n}", flush=True)
+    elapsed = time.perf_counter() - start
+    asyncio.run(ltm.close())
+    return existing, elapsed
+
+
+async def first_query(path, dim):
+    rng = np.random.default_rng(1)
+    query = rng.normal(size=dim).astype(np.float32).tolist()
+    start = time.perf_counter()
+    ltm = LongTermMemory(path=path)
+    opened = time.perf_counter()
+    await ltm._run(ltm.collection.query, query_embeddings=[query], n_results=5)
+    first = time.perf_counter()
+    await ltm._run(ltm.collection.query, query_embeddings=[query], n_results=5)
+    second = time.perf_counter()
+    await ltm.close()
+    return {"open_s": opened - start, "first_query_s": first - start, "warm_query_ms": (second - first) * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--path", default="ltm_bench")
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--measure", action="store_true", help="(内部用) 初回検索の計測のみ行う")
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(asyncio.run(first_query(args.path, args.dim))))
+        return
+
+    existing, elapsed = populate(args.path, args.n, args.dim, args.batch)
+    if args.n > existing:
+        print(f"populate: {args.n - existing} docs in {elapsed:.1f}s")
+    # 同一プロセスのクライアントキャッシュを避けるため、計測は新しいプロセスで行う
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--measure", "--path", args.path, "--dim", str(args.dim)],
+        check=True, capture_output=True, text=True,
+    )
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    print(f"n={args.n:>9} open={result['open_s']:.2f}s time_to_first_query={result['first_query_s']:.2f}s "
+          f"warm_query={result['warm_query_ms']:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
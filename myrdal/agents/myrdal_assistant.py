@@ -16,8 +16,11 @@ import json
 from pydantic import BaseModel
 
 class MyrdalAssistantAgent(AssistantAgent):
-    def __init__(self, *, agent_id: str, memory, memory_manager: MemoryManager, model_client: ChatCompletionClient, model=None, feature_names=None, tools=None, mcp_tools=None, system_message=None, stream=True,**kwargs):
+    def __init__(self, *, agent_id: str, memory=None, memory_manager: MemoryManager, model_client: ChatCompletionClient, model=None, feature_names=None, tools=None, mcp_tools=None, system_message=None, stream=True, knowledge_graph=None, **kwargs):
         # tools: 通常のツールリスト, mcp_tools: MCP経由のツールリスト
+        # memory省略時は関連度順に選別した記憶だけを文脈に加えるプロバイダを使う（knowledge_graphがあればそれも検索対象）
+        if memory is None:
+            memory = [memory_manager.get_memory_provider(agent_id, knowledge_graph=knowledge_graph)]
         all_tools = []
         if tools:
             all_tools.extend(tools)
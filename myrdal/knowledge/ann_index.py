@@ -0,0 +1,335 @@
+# 近似最近傍（ANN）索引: NumPyのみで実装したIVF-flat（転置ファイル + 総当たり再ランキング）
+
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from myrdal.knowledge.embedding_index import EmbeddingIndex, normalize, top_k_indices
+
+
+def spherical_kmeans(data: np.ndarray, n_clusters: int, iters: int = 8, seed: int = 0, chunk_size: int = 65536) -> np.ndarray:
+    """正規化済みベクトルに対する球面k-means。正規化済みの重心行列を返す。"""
+    rng = np.random.default_rng(seed)
+    n = data.shape[0]
+    n_clusters = min(n_clusters, n)
+    centroids = data[rng.choice(n, n_clusters, replace=False)].copy()
+    for _ in range(iters):
+        assign = assign_to_centroids(data, centroids, chunk_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        counts = np.bincount(assign, minlength=n_clusters)
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            # 空クラスタはランダムな点で再初期化
+            sums[empty] = data[rng.choice(n, len(empty), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+def assign_to_centroids(data: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+    """各ベクトルに最も近い重心の番号を返す（メモリ節約のためチャンク単位で計算）。"""
+    out = np.empty(data.shape[0], dtype=np.int32)
+    for start in range(0, data.shape[0], chunk_size):
+        out[start:start + chunk_size] = np.argmax(data[start:start + chunk_size] @ centroids.T, axis=1)
+    return out
+
+
+class IVFFlatIndex:
+    """
+    IVF-flat近似最近傍索引。
+    ベクトルを球面k-meansのnlist個のクラスタ（転置リスト）に振り分け、
+    検索時はクエリに近いnprobe個のリストのみを正確に採点する。
+    - nprobe: 大きいほど再現率が上がり遅くなる（nprobe=nlistで総当たりと一致）
+    - 件数がtrain_threshold未満の間は学習せず総当たりで検索する
+    - 削除はtombstone方式。tombstoneの割合がcompact_ratioを超えたら詰め直す
+    - 学習時の件数のretrain_factor倍まで増えたら重心を学習し直す
+    """
+
+    def __init__(
+        self,
+        dim: Optional[int] = None,
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        train_threshold: int = 4096,
+        retrain_factor: float = 4.0,
+        compact_ratio: float = 0.25,
+        kmeans_iters: int = 8,
+        seed: int = 0,
+        initial_capacity: int = 1024,
+    ):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_threshold = train_threshold
+        self.retrain_factor = retrain_factor
+        self.compact_ratio = compact_ratio
+        self.kmeans_iters = kmeans_iters
+        self.seed = seed
+        self._initial_capacity = max(1, initial_capacity)
+        self._matrix: Optional[np.ndarray] = None
+        self._alive: Optional[np.ndarray] = None
+        self._assign: Optional[np.ndarray] = None
+        self._size = 0  # 使用済み行数（tombstoneを含む）
+        self._n_deleted = 0
+        self.id_to_row: Dict[str, int] = {}
+        self.row_to_id: List[Optional[str]] = []
+        self.centroids: Optional[np.ndarray] = None
+        self._trained_size = 0
+        self._lists: List[List[int]] = []
+        self._list_arrays: List[Optional[np.ndarray]] = []
+
+    def __len__(self):
+        return self._size - self._n_deleted
+
+    def __contains__(self, node_id):
+        return node_id in self.id_to_row
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def _ensure_capacity(self, n: int):
+        if self._matrix is None:
+            capacity = max(self._initial_capacity, n)
+            self._matrix = np.empty((capacity, self.dim), dtype=np.float32)
+            self._alive = np.zeros(capacity, dtype=bool)
+            self._assign = np.full(capacity, -1, dtype=np.int32)
+            return
+        capacity = self._matrix.shape[0]
+        if n <= capacity:
+            return
+        while capacity < n:
+            capacity *= 2
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        assign = np.full(capacity, -1, dtype=np.int32)
+        assign[:self._size] = self._assign[:self._size]
+        self._matrix, self._alive, self._assign = matrix, alive, assign
+
+    def _check_dim(self, vec: np.ndarray):
+        if self.dim is None:
+            self.dim = vec.shape[-1]
+        elif vec.shape[-1] != self.dim:
+            raise ValueError(f"Embedding dimension mismatch: expected {self.dim}, got {vec.shape[-1]}")
+
+    def _append_rows(self, node_ids: List[str], mat: np.ndarray):
+        for node_id in node_ids:
+            if node_id in self.id_to_row:
+                self._tombstone(node_id)
+        self._ensure_capacity(self._size + len(node_ids))
+        start, end = self._size, self._size + len(node_ids)
+        self._matrix[start:end] = mat
+        self._alive[start:end] = True
+        for offset, node_id in enumerate(node_ids):
+            self.id_to_row[node_id] = start + offset
+            self.row_to_id.append(node_id)
+        self._size = end
+        if self.is_trained:
+            assign = assign_to_centroids(mat, self.centroids)
+            self._assign[start:end] = assign
+            for offset, list_no in enumerate(assign):
+                self._lists[list_no].append(start + offset)
+                self._list_arrays[list_no] = None
+        self._maybe_train()
+
+    def add(self, node_id: str, vector):
+        """ベクトルを追加する。既存IDの場合は古い行をtombstoneにして追加し直す。"""
+        vec = normalize(vector).reshape(1, -1)
+        self._check_dim(vec)
+        self._append_rows([node_id], vec)
+
+    def add_many(self, node_ids, vectors):
+        node_ids = list(node_ids)
+        if not node_ids:
+            return
+        mat = normalize(vectors).reshape(len(node_ids), -1)
+        self._check_dim(mat)
+        # 同一バッチ内の重複IDは後勝ち
+        last = {}
+        for i, node_id in enumerate(node_ids):
+            last[node_id] = i
+        if len(last) != len(node_ids):
+            node_ids, mat = list(last), mat[list(last.values())]
+        self._append_rows(node_ids, mat)
+
+    def _tombstone(self, node_id: str) -> bool:
+        row = self.id_to_row.pop(node_id, None)
+        if row is None:
+            return False
+        self._alive[row] = False
+        self.row_to_id[row] = None
+        self._n_deleted += 1
+        return True
+
+    def remove(self, node_id: str) -> bool:
+        removed = self._tombstone(node_id)
+        if removed and self._n_deleted > self.compact_ratio * max(self._size, self.train_threshold):
+            self.compact()
+        return removed
+
+    def get(self, node_id: str) -> Optional[np.ndarray]:
+        row = self.id_to_row.get(node_id)
+        if row is None:
+            return None
+        return self._matrix[row]
+
+    def compact(self):
+        """tombstone行を取り除き、行列と転置リストを詰め直す。"""
+        if self._matrix is None:
+            return
+        rows = np.flatnonzero(self._alive[:self._size])
+        n = len(rows)
+        self._matrix[:n] = self._matrix[rows]
+        self._assign[:n] = self._assign[rows]
+        self._alive[:n] = True
+        self._alive[n:] = False
+        self._assign[n:] = -1
+        self.row_to_id = [self.row_to_id[r] for r in rows]
+        self.id_to_row = {node_id: i for i, node_id in enumerate(self.row_to_id)}
+        self._size = n
+        self._n_deleted = 0
+        if self.is_trained:
+            self._rebuild_lists()
+
+    def _rebuild_lists(self):
+        assign = self._assign[:self._size]
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(len(self.centroids) + 1))
+        self._list_arrays = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+        self._lists = [arr.tolist() for arr in self._list_arrays]
+
+    def _maybe_train(self):
+        alive = len(self)
+        if not self.is_trained:
+            if alive >= self.train_threshold:
+                self.train()
+        elif alive > self.retrain_factor * self._trained_size:
+            self.train()
+
+    def train(self):
+        """現在の全ベクトルから重心を学習し、全行を転置リストへ振り分け直す。"""
+        if self._n_deleted:
+            self.compact()
+        data = self._matrix[:self._size]
+        if len(data) == 0:
+            return
+        nlist = self.nlist or max(1, int(2 * np.sqrt(len(data))))
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(data), nlist * 32)
+        sample = data[rng.choice(len(data), sample_size, replace=False)] if sample_size < len(data) else data
+        self.centroids = spherical_kmeans(sample, nlist, iters=self.kmeans_iters, seed=self.seed)
+        self._assign[:self._size] = assign_to_centroids(data, self.centroids)
+        self._trained_size = self._size
+        self._rebuild_lists()
+
+    def _list_rows(self, list_no: int) -> np.ndarray:
+        arr = self._list_arrays[list_no]
+        if arr is None:
+            arr = np.asarray(self._lists[list_no], dtype=np.int64)
+            self._list_arrays[list_no] = arr
+        return arr
+
+    def _score_rows(self, q: np.ndarray, rows: np.ndarray, top_k: int) -> List[Tuple[str, float]]:
+        scores = self._matrix[rows] @ q
+        return [(self.row_to_id[rows[i]], float(scores[i])) for i in top_k_indices(scores, top_k)]
+
+    def search(self, query_vec, top_k: int = 5, nprobe: Optional[int] = None, allowed=None) -> List[Tuple[str, float]]:
+        """
+        コサイン類似度の上位top_k件（近似）を(node_id, score)で返す。
+        allowed: 検索対象を限定するIDの集合。対象が少なければ総当たり、多ければ行のビットマップで
+        転置リストの候補を採点前に絞り込む（近似で件数が足りない場合は総当たりに切り替える）。
+        """
+        if len(self) == 0:
+            return []
+        q = normalize(query_vec).reshape(-1)
+        mask = None
+        if allowed is not None:
+            id_to_row = self.id_to_row
+            allowed_rows = np.fromiter((id_to_row[i] for i in allowed if i in id_to_row), dtype=np.int64)
+            if len(allowed_rows) == 0:
+                return []
+            if not self.is_trained or len(allowed_rows) <= max(top_k * 64, self._size // 16):
+                return self._score_rows(q, allowed_rows, top_k)
+            mask = np.zeros(self._size, dtype=bool)
+            mask[allowed_rows] = True
+        if not self.is_trained:
+            scores = self._matrix[:self._size] @ q
+            scores[~self._alive[:self._size]] = -np.inf
+            idx = top_k_indices(scores, min(top_k, len(self)))
+            return [(self.row_to_id[i], float(scores[i])) for i in idx]
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probe = top_k_indices(self.centroids @ q, nprobe)
+        rows = np.concatenate([self._list_rows(i) for i in probe])
+        rows = rows[self._alive[rows]] if mask is None else rows[mask[rows]]
+        if mask is not None and len(rows) < top_k:
+            return self._score_rows(q, allowed_rows, top_k)
+        if len(rows) == 0:
+            return []
+        return self._score_rows(q, rows, top_k)
+
+    def search_batch(self, query_vecs, top_k: int = 5, nprobe: Optional[int] = None) -> List[List[Tuple[str, float]]]:
+        return [self.search(q, top_k=top_k, nprobe=nprobe) for q in np.atleast_2d(query_vecs)]
+
+    def params(self) -> dict:
+        """再構築用のコンストラクタ引数"""
+        return {
+            "dim": self.dim, "nlist": self.nlist, "nprobe": self.nprobe,
+            "train_threshold": self.train_threshold, "retrain_factor": self.retrain_factor,
+            "compact_ratio": self.compact_ratio, "kmeans_iters": self.kmeans_iters, "seed": self.seed,
+        }
+
+    def state(self) -> dict:
+        """スナップショット保存用の状態（tombstoneを詰めてから出力する）"""
+        if self._n_deleted:
+            self.compact()
+        dim = self.dim or 0
+        arrays = {
+            "matrix": self._matrix[:self._size] if self._matrix is not None else np.empty((0, dim), dtype=np.float32),
+            "assign": self._assign[:self._size] if self._assign is not None else np.empty(0, dtype=np.int32),
+        }
+        if self.is_trained:
+            arrays["centroids"] = self.centroids
+        return {"arrays": arrays, "names": {"ids": list(self.row_to_id)}, "meta": {"trained_size": self._trained_size}}
+
+    @classmethod
+    def from_state(cls, state: dict, **params):
+        """state()の内容から索引を復元する。行列はコピーせずそのまま使う（mmapも可）。"""
+        index = cls(**params)
+        arrays = state["arrays"]
+        matrix = arrays["matrix"]
+        index.row_to_id = list(state["names"]["ids"])
+        index.id_to_row = {node_id: i for i, node_id in enumerate(index.row_to_id)}
+        index._size = len(index.row_to_id)
+        if index._size:
+            index.dim = matrix.shape[1]
+            index._matrix = matrix
+            index._alive = np.ones(index._size, dtype=bool)
+            index._assign = np.array(arrays["assign"], dtype=np.int32)
+        if "centroids" in arrays and index._size:
+            index.centroids = np.asarray(arrays["centroids"], dtype=np.float32)
+            index._trained_size = state.get("meta", {}).get("trained_size", index._size)
+            index._rebuild_lists()
+        return index
+
+
+# 構築時に選択可能な索引バックエンド
+INDEX_BACKENDS = {
+    "flat": EmbeddingIndex,
+    "ivf": IVFFlatIndex,
+}
+
+
+def backend_name(index) -> str:
+    for name, cls in INDEX_BACKENDS.items():
+        if type(index) is cls:
+            return name
+    raise ValueError(f"Unregistered index type: {type(index).__name__}")
+
+
+def make_index(backend="flat", **params):
+    """バックエンド名（またはインスタンス）からベクトル索引を生成する。"""
+    if not isinstance(backend, str):
+        return backend
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown index backend: {backend}")
+    return INDEX_BACKENDS[backend](**params)
@@ -0,0 +1,135 @@
+# auto_updateの非同期取り込みパイプライン
+# asyncio.Queue -> ワーカーがマイクロバッチにまとめる -> executorでencode -> イベントループ上で統合 -> 各Futureにノードを返す
+
+import asyncio
+from concurrent.futures import Executor
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from myrdal.knowledge.embedding_index import normalize
+
+
+class AsyncIngestor:
+    """
+    MultiLayerKnowledgeGraphへの非同期取り込み。
+    - submit()は待ち行列に積んでFutureを返すだけなので、呼び出し側のイベントループを塞がない
+    - ワーカーは最初の1件が届いてからmax_delay秒（またはbatch_size件）まで待ってまとめてencodeする
+    - encode（重い処理）はexecutor上で実行し、グラフへの統合は短時間で済むためイベントループ上で行う
+      （グラフの更新を1スレッドに限定し、検索側とのロックを不要にする）
+    executor=Noneならループ既定のThreadPoolExecutorを使う。ProcessPoolExecutorを使う場合はembedderがpickle可能であること。
+    """
+
+    def __init__(
+        self,
+        kg,
+        batch_size: int = 64,
+        max_delay: float = 0.01,
+        threshold: float = 0.95,
+        executor: Optional[Executor] = None,
+        max_pending: int = 0,
+    ):
+        self.kg = kg
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.threshold = threshold
+        self.executor = executor
+        self.max_pending = max_pending
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.items = 0
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def start(self):
+        """実行中のイベントループ上でワーカーを起動する（submit時に自動で呼ばれる）"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, content: str, node_type: str = "fact", relation: str = None, parent_id: str = None, **kwargs) -> "asyncio.Future":
+        """
+        取り込みを予約し、最終的なノードID（既存 or 新規）で完了するFutureを返す。
+        max_pending>0で待ち行列が満杯のときは空きが出るまで待つ（背圧）。
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        item = {"content": content, "node_type": node_type, "parent_id": parent_id, "relation": relation, "attrs": kwargs}
+        await self._queue.put((item, future))
+        return future
+
+    async def ingest(self, content: str, **kwargs) -> str:
+        """submitして結果のノードIDを待つ"""
+        return await (await self.submit(content, **kwargs))
+
+    async def flush(self):
+        """投入済みの項目がすべて統合されるまで待つ"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        """残りを処理してからワーカーを停止する"""
+        if not self.running:
+            return
+        await self.flush()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def _collect(self) -> List[Tuple[dict, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _encode(self, contents: List[str]) -> np.ndarray:
+        return normalize(self.kg.embedder.encode(contents, batch_size=len(contents)))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            try:
+                # キャンセル済み（呼び出し側が待つのをやめた）項目は取り込まない
+                live = [(item, fut) for item, fut in batch if not fut.cancelled()]
+                if live:
+                    items = [item for item, _ in live]
+                    vecs = await loop.run_in_executor(self.executor, self._encode, [it["content"] for it in items])
+                    node_ids = self.kg._auto_update_encoded(items, vecs, self.threshold)
+                    for (_, fut), node_id in zip(live, node_ids):
+                        if not fut.done():
+                            fut.set_result(node_id)
+                    self.batches += 1
+                    self.items += len(live)
+            except asyncio.CancelledError:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.cancel()
+                raise
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
@@ -0,0 +1,250 @@
+# N-Triples/TSV/CSV（ConceptNet・Wikidataのダンプ形式を含む）からの逐次一括インポート
+# ファイルは行単位で遅延パースし、batch_size件ずつ書き込むため、メモリ使用量はファイルサイズに依存しない。
+# 取り込み先はadd_factsを持つKnowledgeGraph系（KnowledgeGraph/SQLiteKnowledgeGraph）か、
+# MultiLayerKnowledgeGraph（主語・目的語をノード、述語をエッジのrelationとし、新規ノードはまとめてencodeする）。
+
+import asyncio
+import bz2
+import csv
+import gzip
+import re
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+Triple = Tuple[str, str, str]
+
+# --- パーサ ---
+
+_IRI = r"<[^>]*>"
+_BNODE = r"_:\S+"
+_LITERAL = r'"(?:[^"\\]|\\.)*"(?:@[A-Za-z0-9-]+|\^\^<[^>]*>)?'
+_NT_LINE = re.compile(rf"^\s*({_IRI}|{_BNODE})\s+({_IRI})\s+({_IRI}|{_BNODE}|{_LITERAL})\s*\.\s*$")
+_ESCAPE = re.compile(r"\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)")
+_SIMPLE_ESCAPES = {"t": "\t", "n": "\n", "r": "\r", "b": "\b", "f": "\f", '"': '"', "'": "'", "\\": "\\"}
+
+
+def _unescape(match) -> str:
+    code = match.group(1)
+    if code[0] in "uU" and len(code) > 1:
+        return chr(int(code[1:], 16))
+    return _SIMPLE_ESCAPES.get(code, code)
+
+
+def _nt_term(term: str) -> str:
+    """IRIは<>を外し、リテラルはエスケープを解いた字句値のみ（言語タグ・データ型は捨てる）にする"""
+    if term[0] == "<":
+        return term[1:-1]
+    if term[0] == '"':
+        return _ESCAPE.sub(_unescape, term[1:term.rindex('"')])
+    return term
+
+
+def parse_ntriples(lines: Iterable[str], on_error: Optional[Callable[[int], None]] = None) -> Iterator[Triple]:
+    """N-Triplesの行を(s, p, o)に変換する。解釈できない行は読み飛ばし、on_errorに行番号を渡す。"""
+    for lineno, line in enumerate(lines, start=1):
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        m = _NT_LINE.match(line)
+        if m is None:
+            if on_error is not None:
+                on_error(lineno)
+            continue
+        yield _nt_term(m.group(1)), _nt_term(m.group(2)), _nt_term(m.group(3))
+
+
+def parse_delimited(
+    lines: Iterable[str],
+    delimiter: str = "\t",
+    columns: Sequence[int] = (0, 1, 2),
+    header: bool = False,
+    on_error: Optional[Callable[[int], None]] = None,
+) -> Iterator[Triple]:
+    """TSV/CSVの行から(s, p, o)をcolumnsの列番号で取り出す"""
+    s_col, p_col, o_col = columns
+    width = max(columns)
+    reader = csv.reader(lines, delimiter=delimiter)
+    if header:
+        next(reader, None)
+    for row in reader:
+        if len(row) <= width:
+            if on_error is not None and row:
+                on_error(reader.line_num)
+            continue
+        yield row[s_col], row[p_col], row[o_col]
+
+
+# ConceptNetのassertions.csvはタブ区切りで (エッジURI, 関係, 始点, 終点, JSON)。WikidataのダンプはN-Triples。
+FORMATS = {
+    "nt": (parse_ntriples, {}),
+    "wikidata": (parse_ntriples, {}),
+    "tsv": (parse_delimited, {"delimiter": "\t"}),
+    "csv": (parse_delimited, {"delimiter": ","}),
+    "conceptnet": (parse_delimited, {"delimiter": "\t", "columns": (2, 1, 3)}),
+}
+
+
+def detect_format(path: str) -> str:
+    name = path.lower()
+    for suffix in (".gz", ".bz2"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    if "conceptnet" in name:
+        return "conceptnet"
+    for ext, fmt in ((".nt", "nt"), (".tsv", "tsv"), (".csv", "csv")):
+        if name.endswith(ext):
+            return fmt
+    raise ValueError(f"Cannot detect triple format from file name: {path}")
+
+
+def open_text(path: str):
+    """.gz/.bz2は展開しながら読む"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
+
+
+def make_interner(maxsize: int = 1 << 16) -> Callable[[str], str]:
+    """
+    同じ文字列（頻出するIRI・述語）を同一オブジェクトに揃える。
+    LRUで件数を制限するため、語彙が大きくてもメモリは一定
+    （sys.internは使わない。3.12では組み込みの文字列表に入った文字列は解放されないため）。
+    """
+    table: "OrderedDict[str, str]" = OrderedDict()
+
+    def intern(value: str) -> str:
+        cached = table.get(value)
+        if cached is not None:
+            table.move_to_end(value)
+            return cached
+        table[value] = value
+        if len(table) > maxsize:
+            table.popitem(last=False)
+        return value
+
+    return intern
+
+
+def iter_triples(lines: Iterable[str], format: str = "nt", intern_size: int = 1 << 16, on_error=None, **options) -> Iterator[Triple]:
+    parser, defaults = FORMATS[format]
+    intern = make_interner(intern_size)
+    for s, p, o in parser(lines, on_error=on_error, **{**defaults, **options}):
+        yield intern(s), intern(p), intern(o)
+
+
+# --- 取り込み ---
+
+@dataclass
+class ImportStats:
+    triples: int = 0
+    batches: int = 0
+    nodes: int = 0
+    skipped: int = 0
+    seconds: float = 0.0
+    _start: float = field(default_factory=time.perf_counter, repr=False)
+
+    @property
+    def rate(self) -> float:
+        """1秒あたりの取り込み三つ組数"""
+        return self.triples / self.seconds if self.seconds else 0.0
+
+    def tick(self):
+        self.seconds = time.perf_counter() - self._start
+
+
+def term_label(term: str) -> str:
+    """ノードのcontentに使う表示名（IRIは末尾の名前部分、ConceptNetの/c/en/dog/nは語の部分）"""
+    if term.startswith("/c/"):
+        parts = term.split("/")
+        return parts[3].replace("_", " ") if len(parts) > 3 else term
+    if "://" in term:
+        return re.split(r"[/#]", term.rstrip("/#"))[-1] or term
+    return term
+
+
+class _MultiLayerSink:
+    """MultiLayerKnowledgeGraph向けの書き込み先（未登録の主語・目的語をノード化し、述語をrelationとするエッジを張る）"""
+
+    def __init__(self, kg, node_type: str, source: Optional[str], embed_batch_size: int):
+        from myrdal.knowledge.multilayer_knowledge_graph import KnowledgeNode
+
+        self.kg = kg
+        self.node_cls = KnowledgeNode
+        self.node_type = node_type
+        self.source = source
+        self.embed_batch_size = embed_batch_size
+
+    async def add_facts(self, triples: List[Triple]) -> int:
+        new = {}
+        for s, _, o in triples:
+            for term in (s, o):
+                if term not in new and term not in self.kg.nodes:
+                    new[term] = self.node_cls(id=term, type=self.node_type, content=term_label(term), source=self.source)
+        self.kg.add_nodes_bulk(new.values(), batch_size=self.embed_batch_size)
+        self.kg.add_edges_bulk((s, o, p) for s, p, o in triples)
+        return len(new)
+
+
+async def import_triples(
+    target,
+    triples: Iterable[Triple],
+    batch_size: int = 10000,
+    progress: Optional[Callable[[ImportStats], None]] = None,
+    node_type: str = "concept",
+    source: Optional[str] = None,
+    embed_batch_size: int = 256,
+    stats: Optional[ImportStats] = None,
+) -> ImportStats:
+    """
+    三つ組の列をbatch_size件ずつtargetへ書き込む。progressは各バッチの後にImportStatsを受け取る。
+    targetがMultiLayerKnowledgeGraphなら、新規ノードはnode_type/sourceで作成しembed_batch_size件ずつencodeする。
+    statsを渡すとそこへ集計する（import_fileがパース中のskippedを随時反映するため）。
+    """
+    # MultiLayerKnowledgeGraphのモジュールは埋め込みモデルを読み込むため、既に使われている場合だけ判定に使う
+    mlkg_module = sys.modules.get("myrdal.knowledge.multilayer_knowledge_graph")
+    is_mlkg = mlkg_module is not None and isinstance(target, mlkg_module.MultiLayerKnowledgeGraph)
+    sink = _MultiLayerSink(target, node_type, source, embed_batch_size) if is_mlkg else target
+    stats = stats if stats is not None else ImportStats()
+    triples = iter(triples)
+    while True:
+        batch = list(islice(triples, batch_size))
+        if not batch:
+            break
+        added = await sink.add_facts(batch)
+        if is_mlkg:
+            stats.nodes += added
+            # 同期のencode・グラフ更新の合間に他のタスクへ制御を戻す
+            await asyncio.sleep(0)
+        stats.triples += len(batch)
+        stats.batches += 1
+        stats.tick()
+        if progress is not None:
+            progress(stats)
+    stats.tick()
+    return stats
+
+
+async def import_file(target, path: str, format: Optional[str] = None, batch_size: int = 10000, progress=None, intern_size: int = 1 << 16, **options) -> ImportStats:
+    """
+    ファイルを逐次パースしてtargetへ取り込む。formatを省略すると拡張子（とファイル名のconceptnet）から判定する。
+    optionsはパーサ（columns, header等）またはimport_triples（node_type, source, embed_batch_size）への引数。
+    """
+    format = format or detect_format(path)
+    import_keys = {"node_type", "source", "embed_batch_size"}
+    import_options = {k: v for k, v in options.items() if k in import_keys}
+    parse_options = {k: v for k, v in options.items() if k not in import_keys}
+    stats = ImportStats()
+
+    def on_error(_lineno):
+        stats.skipped += 1
+
+    with open_text(path) as f:
+        return await import_triples(
+            target, iter_triples(f, format, intern_size=intern_size, on_error=on_error, **parse_options),
+            batch_size=batch_size, progress=progress, stats=stats, **import_options,
+        )
@@ -0,0 +1,96 @@
+# WorldModelNexusの熟考ループの予算（ステップ数・経過時間・トークン数・モジュール呼び出し数）
+# extra_create_argsで1リクエストごとに指定できる:
+#   wmn.create(messages, extra_create_args={"max_steps": 8, "deadline": 30.0})
+#   wmn.create(messages, extra_create_args={"budget": {"max_prompt_tokens": 20000, "max_module_calls": 10}})
+# いずれかを使い切ったら、WMNはモジュールを呼ばずに最終回答を出させるステップを1回だけ行って終える。
+# max_prompt_tokensは次のステップのプロンプトを送る前に見込みで判定するが、最終回答のステップ自体と
+# 応答が不正だった場合の再試行の分は予算を超えうる。max_completion_tokensは応答を受け取ってからの判定なので、
+# 最後のステップの分だけ超えうる。deadline後の最終回答のステップはWMNのfinal_step_grace秒までで打ち切る。
+
+import time
+from dataclasses import dataclass, fields
+
+BUDGET_KEYS = ("max_steps", "deadline", "max_prompt_tokens", "max_completion_tokens", "max_module_calls")
+
+
+@dataclass
+class DeliberationBudget:
+    """Noneの項目は無制限。deadlineはリクエスト開始からの秒数"""
+
+    max_steps: int | None = None
+    deadline: float | None = None
+    max_prompt_tokens: int | None = None
+    max_completion_tokens: int | None = None
+    max_module_calls: int | None = None
+
+    @classmethod
+    def from_args(cls, extra_create_args=None, defaults=None) -> "DeliberationBudget":
+        """defaults < extra_create_args["budget"] < extra_create_args直下のキー の順に上書きして作る"""
+        args = extra_create_args or {}
+        values = dict(defaults or {})
+        values.update(args.get("budget") or {})
+        values.update({key: args[key] for key in BUDGET_KEYS if key in args})
+        unknown = set(values) - set(BUDGET_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown budget keys: {sorted(unknown)}")
+        return cls(**values)
+
+    def as_dict(self) -> dict:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+
+class BudgetTracker:
+    """1リクエスト分の消費量を数え、予算切れかどうかを判定する"""
+
+    def __init__(self, budget: DeliberationBudget, clock=time.monotonic):
+        self.budget = budget
+        self.clock = clock
+        self.started = clock()
+        self.steps = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.module_calls = 0
+
+    def elapsed(self) -> float:
+        return self.clock() - self.started
+
+    def remaining_time(self) -> float | None:
+        if self.budget.deadline is None:
+            return None
+        return max(0.0, self.budget.deadline - self.elapsed())
+
+    def remaining_module_calls(self) -> int | None:
+        if self.budget.max_module_calls is None:
+            return None
+        return max(0, self.budget.max_module_calls - self.module_calls)
+
+    def add_usage(self, prompt_tokens: int, completion_tokens: int):
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    def exhausted(self, next_prompt_tokens: int = 0) -> str | None:
+        """使い切った予算の説明（まだ残っていればNone）。next_prompt_tokensは次に送るプロンプトの見込みトークン数"""
+        budget = self.budget
+        if budget.max_steps is not None and self.steps >= budget.max_steps:
+            return f"max_steps ({budget.max_steps}) reached"
+        if budget.deadline is not None and self.elapsed() >= budget.deadline:
+            return f"deadline ({budget.deadline}s) passed"
+        if budget.max_prompt_tokens is not None and self.prompt_tokens >= budget.max_prompt_tokens:
+            return f"max_prompt_tokens ({budget.max_prompt_tokens}) used"
+        if budget.max_prompt_tokens is not None and self.prompt_tokens + next_prompt_tokens > budget.max_prompt_tokens:
+            return f"max_prompt_tokens ({budget.max_prompt_tokens}) would be exceeded by the next step"
+        if budget.max_completion_tokens is not None and self.completion_tokens >= budget.max_completion_tokens:
+            return f"max_completion_tokens ({budget.max_completion_tokens}) used"
+        if budget.max_module_calls is not None and self.module_calls >= budget.max_module_calls:
+            return f"max_module_calls ({budget.max_module_calls}) used"
+        return None
+
+    def summary(self) -> dict:
+        return {
+            "steps": self.steps,
+            "elapsed": round(self.elapsed(), 3),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "module_calls": self.module_calls,
+            "limits": self.budget.as_dict(),
+        }
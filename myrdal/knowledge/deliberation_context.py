@@ -0,0 +1,132 @@
+# WorldModelNexusの熟考ループ用の文脈圧縮
+# 毎ステップLLMへ送るメッセージを次の形に保ち、ステップ数に関係なくプロンプト長を一定以下に抑える:
+#   [固定の指示（1回だけ）] + [会話メッセージ] + [スクラッチパッド: 古いステップの要約 + 直近keep_steps件] + [今回のステップ指示]
+# 大きなモジュール結果は先頭だけを残し、全体はハンドル（r1, r2, ...）で保持する。
+# LLMはWMNの疑似モジュールread_result（read()）で、ハンドルの結果を続きから読める。
+
+import json
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from autogen_core.models import SystemMessage
+
+
+def _to_text(value) -> str:
+    if isinstance(value, str):
+        return value
+    try:
+        return json.dumps(value, ensure_ascii=False, default=str)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit] + f"... [{len(text) - limit} more chars]"
+
+
+class DeliberationTranscript:
+    """
+    熟考の経過を保持し、LLMへ送るメッセージ列を組み立てる。
+    - keep_steps: 原文に近い形で残す直近のステップ数（それより古いステップは1行の要約に畳み込む）
+    - max_summary_chars: 要約部分の最大文字数（超えたら最も古い要約行から捨てる）
+    - max_result_chars: 1つのモジュール結果・思考として載せる最大文字数（超えた結果はハンドル参照にする）
+    """
+
+    def __init__(
+        self,
+        messages: List[Any],
+        instructions: str,
+        keep_steps: int = 3,
+        max_summary_chars: int = 2000,
+        max_result_chars: int = 1500,
+    ):
+        self.messages = list(messages)
+        self.instructions = instructions
+        self.keep_steps = keep_steps
+        self.max_summary_chars = max_summary_chars
+        self.max_result_chars = max_result_chars
+        self.recent: deque = deque()
+        self.summary: deque = deque()
+        self._summary_chars = 0
+        self.omitted = 0  # 要約からも捨てたステップ数
+        self.handles: Dict[str, Any] = {}  # ハンドル -> モジュール結果の全体
+
+    def _result_text(self, result) -> str:
+        text = _to_text(result)
+        if len(text) <= self.max_result_chars:
+            return text
+        handle = f"r{len(self.handles) + 1}"
+        self.handles[handle] = result
+        return f"[handle {handle}, {len(text)} chars] " + _clip(text, self.max_result_chars // 2)
+
+    def record(self, step: int, parsed: dict):
+        """1ステップ分のLLM出力（とmodule_result）を記録する"""
+        lines = [f"Step {step}: thought: {_clip(_to_text(parsed.get('thought', '')), self.max_result_chars)}"]
+        module = parsed.get("call_module")
+        if module:
+            if isinstance(module, list):
+                names = [m.get("module") if isinstance(m, dict) else str(m) for m in module]
+                lines.append(f"  called: {', '.join(str(n) for n in names)}")
+            else:
+                lines.append(f"  called: {module}({_clip(_to_text(parsed.get('call_args', {})), 200)})")
+        if "module_result" in parsed:
+            lines.append(f"  result: {self._result_text(parsed['module_result'])}")
+        self.recent.append((step, parsed, "\n".join(lines)))
+        while len(self.recent) > self.keep_steps:
+            self._fold(*self.recent.popleft())
+
+    def _fold(self, step: int, parsed: dict, _full: str):
+        line = f"Step {step}: {_clip(_to_text(parsed.get('thought', '')), 160)}"
+        module = parsed.get("call_module")
+        if module:
+            names = [m.get("module") if isinstance(m, dict) else str(m) for m in module] if isinstance(module, list) else [module]
+            line += f" (called {', '.join(str(n) for n in names)}"
+            if "module_result" in parsed:
+                line += f": {_clip(_to_text(parsed['module_result']), 120)}"
+            line += ")"
+        self.summary.append(line)
+        self._summary_chars += len(line) + 1
+        while self._summary_chars > self.max_summary_chars and self.summary:
+            self._summary_chars -= len(self.summary.popleft()) + 1
+            self.omitted += 1
+
+    def scratchpad(self) -> Optional[str]:
+        if not self.summary and not self.recent:
+            return None
+        parts = ["Deliberation scratchpad (your earlier steps):"]
+        if self.summary or self.omitted:
+            parts.append("Summary of earlier steps:")
+            if self.omitted:
+                parts.append(f"({self.omitted} earliest steps omitted)")
+            parts.extend(self.summary)
+        if self.recent:
+            parts.append("Recent steps:")
+            parts.extend(full for _, _, full in self.recent)
+        return "\n".join(parts)
+
+    def render(self, step_prompt: str, to_llm_message=None) -> list:
+        """今回のステップでLLMへ送るメッセージ列"""
+        convert = to_llm_message or (lambda m: m)
+        rendered = [SystemMessage(content=self.instructions)]
+        rendered.extend(convert(m) for m in self.messages)
+        scratchpad = self.scratchpad()
+        if scratchpad:
+            rendered.append(SystemMessage(content=scratchpad))
+        rendered.append(SystemMessage(content=step_prompt))
+        return rendered
+
+    def resolve(self, handle: str):
+        """ハンドルで参照されたモジュール結果の全体"""
+        return self.handles.get(handle)
+
+    def read(self, handle: str, offset: int = 0) -> dict:
+        """ハンドルの結果の文字列をoffsetから1回分（max_result_charsの半分）だけ返す。続きがなければnext_offsetはNone"""
+        if handle not in self.handles:
+            return {"error": f"unknown handle {handle!r}; known handles: {sorted(self.handles)}"}
+        text = _to_text(self.handles[handle])
+        try:
+            offset = max(0, int(offset or 0))
+        except (TypeError, ValueError):
+            return {"error": f"offset must be an integer, got {offset!r}"}
+        end = min(len(text), offset + max(1, self.max_result_chars // 2))
+        return {"handle": handle, "offset": offset, "text": text[offset:end], "next_offset": end if end < len(text) else None}
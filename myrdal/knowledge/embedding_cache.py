@@ -0,0 +1,195 @@
+# 埋め込みキャッシュ: (モデル名, content hash) -> embedding
+# ディスク側はメモリマップした固定長配列 + 小さな索引ファイル、メモリ側はLRU
+
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+
+def content_key(model_name: str, content: str) -> str:
+    return hashlib.sha1(f"{model_name}\0{content}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    embeddingの永続キャッシュ。
+    - path: キャッシュディレクトリ（Noneならメモリのみ）。モデルごとにサブディレクトリを作る
+    - max_entries: ディスク上の最大件数。超えた分は最も長く使われていないものから上書きする
+    - memory_entries: メモリ上のLRUの最大件数
+    - initial_capacity: データファイルの初期の行数。満杯になるたびに倍に広げる（max_entriesまで）
+    flush()（またはclose()）で索引ファイルを書き出す。
+    """
+
+    INDEX_FILE = "index.json"
+    DATA_FILE = "embeddings.f32"
+
+    def __init__(self, path: Optional[str] = None, model_name: str = "default", max_entries: int = 1_000_000, memory_entries: int = 10_000, initial_capacity: int = 1024):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.initial_capacity = initial_capacity
+        self.memory_entries = memory_entries
+        self.dir = os.path.join(path, re.sub(r"[^\w.-]", "_", model_name)) if path else None
+        self.dim: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._slots: "OrderedDict[str, int]" = OrderedDict()  # ディスク上のkey -> 行（LRU順）
+        self._data: Optional[np.memmap] = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        if self.dir and os.path.exists(os.path.join(self.dir, self.INDEX_FILE)):
+            self._open()
+
+    def _open(self):
+        with open(os.path.join(self.dir, self.INDEX_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        capacity = meta["capacity"]
+        self.max_entries = meta.get("max_entries", capacity)
+        self._slots = OrderedDict((k, slot) for k, slot in meta["entries"])
+        self._data = np.memmap(os.path.join(self.dir, self.DATA_FILE), dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def _create(self, dim: int):
+        self.dim = dim
+        if not self.dir:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+        capacity = max(1, min(self.initial_capacity, self.max_entries))
+        self._data = np.memmap(os.path.join(self.dir, self.DATA_FILE), dtype=np.float32, mode="w+", shape=(capacity, dim))
+        self._dirty = True
+
+    def _grow(self):
+        # データファイルを倍に広げて開き直す（既存の行はそのまま）
+        capacity = min(self.max_entries, self._data.shape[0] * 2)
+        self._data.flush()
+        self._data = None
+        data_path = os.path.join(self.dir, self.DATA_FILE)
+        with open(data_path, "r+b") as f:
+            f.truncate(capacity * self.dim * 4)
+        self._data = np.memmap(data_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def __len__(self):
+        return len(self._slots) if self._data is not None else len(self._memory)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": len(self._slots),
+        }
+
+    def _remember(self, key: str, vec: np.ndarray):
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, content: str) -> Optional[np.ndarray]:
+        key = content_key(self.model_name, content)
+        with self._lock:
+            vec = self._memory.get(key)
+            if vec is not None:
+                self._memory.move_to_end(key)
+                if key in self._slots:
+                    self._slots.move_to_end(key)
+                self.hits += 1
+                return vec
+            slot = self._slots.get(key)
+            if slot is not None:
+                self._slots.move_to_end(key)
+                self._dirty = True
+                vec = np.array(self._data[slot])
+                self._remember(key, vec)
+                self.hits += 1
+                return vec
+            self.misses += 1
+            return None
+
+    def put(self, content: str, vector):
+        key = content_key(self.model_name, content)
+        vec = np.asarray(vector, dtype=np.float32).reshape(-1)
+        with self._lock:
+            if self.dim is None:
+                self._create(vec.shape[0])
+            self._remember(key, vec)
+            if self._data is None:
+                return
+            slot = self._slots.get(key)
+            if slot is None:
+                if len(self._slots) < self.max_entries:
+                    slot = len(self._slots)
+                    if slot >= self._data.shape[0]:
+                        self._grow()
+                else:
+                    # 最も長く使われていないエントリの行を再利用する
+                    _, slot = self._slots.popitem(last=False)
+            self._data[slot] = vec
+            self._slots[key] = slot
+            self._slots.move_to_end(key)
+            self._dirty = True
+
+    def flush(self):
+        """メモリマップと索引ファイルをディスクへ書き出す"""
+        with self._lock:
+            if self._data is None or not self._dirty:
+                return
+            self._data.flush()
+            meta = {
+                "model": self.model_name,
+                "dim": self.dim,
+                "capacity": self._data.shape[0],
+                "max_entries": self.max_entries,
+                "entries": list(self._slots.items()),
+            }
+            tmp = os.path.join(self.dir, self.INDEX_FILE + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp, os.path.join(self.dir, self.INDEX_FILE))
+            self._dirty = False
+
+    def close(self):
+        self.flush()
+
+
+class CachedEmbedder:
+    """
+    SentenceTransformer互換のencodeを持つembedderをキャッシュで包む。
+    キャッシュにない文字列だけをまとめてencodeする。
+    """
+
+    def __init__(self, embedder, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs):
+        single = isinstance(sentences, str)
+        texts: List[str] = [sentences] if single else list(sentences)
+        found = [self.cache.get(t) for t in texts]
+        missing = [i for i, v in enumerate(found) if v is None]
+        if missing:
+            # 同じ文字列は1回だけencodeする
+            unique = list(dict.fromkeys(texts[i] for i in missing))
+            encoded = np.asarray(self.embedder.encode(unique, batch_size=batch_size, **kwargs), dtype=np.float32)
+            by_text = dict(zip(unique, encoded))
+            for text, vec in by_text.items():
+                self.cache.put(text, vec)
+            for i in missing:
+                found[i] = by_text[texts[i]]
+        if single:
+            return found[0]
+        if not found:
+            return np.empty((0, self.cache.dim or 0), dtype=np.float32)
+        return np.stack(found)
+
+    def __getattr__(self, name):
+        # get_sentence_embedding_dimension等は元のembedderへ委譲
+        return getattr(self.embedder, name)
@@ -0,0 +1,231 @@
+# 知識グラフ用ベクトル索引（正規化済みfloat32行列による総当たり検索）
+
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def normalize(vectors) -> np.ndarray:
+    """ベクトル（1次元または2次元）をfloat32でL2正規化する。ゼロベクトルはそのまま返す。"""
+    arr = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(arr, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return arr / norms
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """scoresの上位top_k件のインデックスを降順で返す（argpartition + 部分ソート）。"""
+    n = scores.shape[0]
+    if n == 0 or top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < n:
+        idx = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        idx = np.arange(n)
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+class EmbeddingIndex:
+    """
+    ノードID <-> 行番号の対応表と、正規化済みembeddingを格納する連続した行列。
+    検索は行列ベクトル積1回 + argpartitionで行う。
+    削除は末尾行との入れ替えで行い、行列を常に密に保つ。
+    dtype: 格納形式。"float32"（既定）、"float16"（半分のメモリ）、"int8"（1/4のメモリ、値を127倍して量子化）。
+    float32以外は検索時にチャンク単位でfloat32へ戻して採点する。
+    """
+
+    DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+    CHUNK_ROWS = 65536
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 1024, dtype: str = "float32"):
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
+        self.dim = dim
+        self.dtype = dtype
+        self._initial_capacity = max(1, initial_capacity)
+        self._matrix: Optional[np.ndarray] = None
+        self._size = 0
+        self.id_to_row: Dict[str, int] = {}
+        self.row_to_id: List[str] = []
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, node_id):
+        return node_id in self.id_to_row
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """有効な行のみのfloat32行列（float32格納時はコピーしないビュー）"""
+        if self._matrix is None:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return self._dequantize(self._matrix[:self._size])
+
+    def _quantize(self, mat: np.ndarray) -> np.ndarray:
+        if self.dtype == "int8":
+            return np.clip(np.rint(mat * 127.0), -127, 127).astype(np.int8)
+        return mat.astype(self.DTYPES[self.dtype], copy=False)
+
+    def _dequantize(self, block: np.ndarray) -> np.ndarray:
+        if self.dtype == "int8":
+            return block.astype(np.float32) / 127.0
+        return block.astype(np.float32, copy=False)
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        """全行とクエリ（1次元または(B, dim)）の内積。量子化時は行チャンクごとに復元して計算する。"""
+        if self.dtype == "float32":
+            return self._matrix[:self._size] @ queries.T
+        out = np.empty((self._size,) + queries.shape[:-1], dtype=np.float32)
+        for start in range(0, self._size, self.CHUNK_ROWS):
+            end = min(self._size, start + self.CHUNK_ROWS)
+            out[start:end] = self._dequantize(self._matrix[start:end]) @ queries.T
+        return out
+
+    def _ensure_capacity(self, n: int):
+        if self._matrix is None:
+            capacity = max(self._initial_capacity, n)
+            self._matrix = np.empty((capacity, self.dim), dtype=self.DTYPES[self.dtype])
+            return
+        capacity = self._matrix.shape[0]
+        if n <= capacity:
+            return
+        while capacity < n:
+            capacity *= 2
+        grown = np.empty((capacity, self.dim), dtype=self._matrix.dtype)
+        grown[:self._size] = self._matrix[:self._size]
+        self._matrix = grown
+
+    def _check_dim(self, vec: np.ndarray):
+        if self.dim is None:
+            self.dim = vec.shape[-1]
+        elif vec.shape[-1] != self.dim:
+            raise ValueError(f"Embedding dimension mismatch: expected {self.dim}, got {vec.shape[-1]}")
+
+    def add(self, node_id: str, vector):
+        """ベクトルを追加する。既存IDの場合は上書き（upsert）。"""
+        vec = normalize(vector).reshape(-1)
+        self._check_dim(vec)
+        vec = self._quantize(vec)
+        row = self.id_to_row.get(node_id)
+        if row is not None:
+            self._matrix[row] = vec
+            return
+        self._ensure_capacity(self._size + 1)
+        self._matrix[self._size] = vec
+        self.id_to_row[node_id] = self._size
+        self.row_to_id.append(node_id)
+        self._size += 1
+
+    def add_many(self, node_ids: Iterable[str], vectors):
+        """複数ベクトルをまとめて追加する（新規IDは一括コピー、既存IDは上書き）。"""
+        node_ids = list(node_ids)
+        if not node_ids:
+            return
+        mat = normalize(vectors).reshape(len(node_ids), -1)
+        self._check_dim(mat)
+        mat = self._quantize(mat)
+        new_rows = []
+        for i, node_id in enumerate(node_ids):
+            row = self.id_to_row.get(node_id)
+            if row is not None:
+                self._matrix[row] = mat[i]
+            else:
+                new_rows.append(i)
+        if not new_rows:
+            return
+        # 同一バッチ内の重複IDは後勝ち
+        last = {}
+        for i in new_rows:
+            last[node_ids[i]] = i
+        new_rows = list(last.values())
+        self._ensure_capacity(self._size + len(new_rows))
+        start = self._size
+        self._matrix[start:start + len(new_rows)] = mat[new_rows]
+        for offset, i in enumerate(new_rows):
+            self.id_to_row[node_ids[i]] = start + offset
+            self.row_to_id.append(node_ids[i])
+        self._size += len(new_rows)
+
+    def remove(self, node_id: str) -> bool:
+        """ベクトルを削除する。末尾行を空いた行へ移動する。"""
+        row = self.id_to_row.pop(node_id, None)
+        if row is None:
+            return False
+        last = self._size - 1
+        if row != last:
+            moved_id = self.row_to_id[last]
+            self._matrix[row] = self._matrix[last]
+            self.row_to_id[row] = moved_id
+            self.id_to_row[moved_id] = row
+        self.row_to_id.pop()
+        self._size -= 1
+        return True
+
+    def get(self, node_id: str) -> Optional[np.ndarray]:
+        row = self.id_to_row.get(node_id)
+        if row is None:
+            return None
+        return self._dequantize(self._matrix[row])
+
+    def rows_of(self, node_ids: Iterable[str]) -> np.ndarray:
+        """ID集合を行番号配列に変換する（索引にないIDは無視）"""
+        id_to_row = self.id_to_row
+        return np.fromiter((id_to_row[i] for i in node_ids if i in id_to_row), dtype=np.int64)
+
+    def search(self, query_vec, top_k: int = 5, allowed: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """
+        コサイン類似度の上位top_k件を(node_id, score)で返す。
+        allowed: 検索対象を限定するIDの集合（行のビットマップに変換して採点前に絞り込む）
+        """
+        if self._size == 0:
+            return []
+        q = normalize(query_vec).reshape(-1)
+        if allowed is None:
+            scores = self._scores(q)
+            return [(self.row_to_id[i], float(scores[i])) for i in top_k_indices(scores, top_k)]
+        rows = self.rows_of(allowed)
+        if len(rows) == 0:
+            return []
+        if len(rows) * 4 < self._size:
+            # 選択率が低い場合は対象行のみを集めて採点する
+            scores = self._dequantize(self._matrix[rows]) @ q
+            return [(self.row_to_id[rows[i]], float(scores[i])) for i in top_k_indices(scores, top_k)]
+        mask = np.zeros(self._size, dtype=bool)
+        mask[rows] = True
+        scores = self._scores(q)
+        scores[~mask] = -np.inf
+        idx = top_k_indices(scores, min(top_k, len(rows)))
+        return [(self.row_to_id[i], float(scores[i])) for i in idx]
+
+    def search_batch(self, query_vecs, top_k: int = 5, chunk_size: int = 256) -> List[List[Tuple[str, float]]]:
+        """複数クエリをまとめて検索する（行列積をクエリのチャンク単位で1回ずつ行う）。"""
+        queries = normalize(query_vecs).reshape(-1, self.dim or np.shape(query_vecs)[-1])
+        if self._size == 0:
+            return [[] for _ in range(len(queries))]
+        results = []
+        for start in range(0, len(queries), chunk_size):
+            scores = self._scores(queries[start:start + chunk_size]).T
+            for row in scores:
+                results.append([(self.row_to_id[i], float(row[i])) for i in top_k_indices(row, top_k)])
+        return results
+
+    def params(self) -> dict:
+        """再構築用のコンストラクタ引数"""
+        return {"dim": self.dim, "dtype": self.dtype}
+
+    def state(self) -> dict:
+        """スナップショット保存用の状態（行列は格納形式のまま）"""
+        return {"arrays": {"matrix": self._matrix[:self._size] if self._matrix is not None else np.empty((0, self.dim or 0), dtype=self.DTYPES[self.dtype])},
+                "names": {"ids": list(self.row_to_id)}}
+
+    @classmethod
+    def from_state(cls, state: dict, **params):
+        """state()の内容から索引を復元する。行列はコピーせずそのまま使う（mmapも可）。"""
+        index = cls(**params)
+        matrix = state["arrays"]["matrix"]
+        if len(matrix):
+            index.dim = matrix.shape[1]
+            index._matrix = matrix
+        index.row_to_id = list(state["names"]["ids"])
+        index.id_to_row = {node_id: i for i, node_id in enumerate(index.row_to_id)}
+        index._size = len(index.row_to_id)
+        return index
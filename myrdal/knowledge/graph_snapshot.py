@@ -0,0 +1,264 @@
+# MultiLayerKnowledgeGraphのスナップショット保存/読み込み
+#
+# ディレクトリ構成:
+#   manifest.json          形式バージョン、索引の種類、ベース/セグメントの一覧
+#   base_000001/
+#     nodes/               ノードストアの列（.npy）、content等の文字列列（.bin + .offsets.npy）
+#     index/matrix.npy     embedding行列（読み込み時にmmapする）
+#     graph/               エッジ（src/dst/relationの整数配列）
+#   seg_000002/ ...        追記専用の差分（前回保存以降に追加・更新・削除されたノードと追加エッジ）
+#
+# save(path, incremental=True)は差分セグメントのみを書き足す。save(path)はベースを書き直して差分を畳み込む。
+# ベースは一時ディレクトリに書いてから新しい名前へrenameし、manifestの置き換えで切り替える
+# （既存のベースは上書きしない。読み込み済みのグラフがmmapしている可能性があるため）。
+
+import json
+import os
+import shutil
+import tempfile
+from typing import List, Optional
+
+import numpy as np
+
+from myrdal.knowledge.node_store import Categorical, NodeStore, StringColumn
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+
+
+# --- 状態dictの読み書き ---
+# state: {"arrays": {名前: ndarray}, "strings": {名前: 文字列列}, "names": {名前: 文字列リスト}, "meta": JSON化可能なdict}
+# stringsはアクセス時にデコードする遅延列、namesは読み込み時に全件展開するID列として扱う
+
+def write_state(dirpath: str, state: dict):
+    os.makedirs(dirpath, exist_ok=True)
+    layout = {"arrays": [], "strings": [], "names": [], "meta": state.get("meta", {})}
+    for name, arr in state.get("arrays", {}).items():
+        np.save(os.path.join(dirpath, f"{name}.npy"), np.ascontiguousarray(arr))
+        layout["arrays"].append(name)
+    for name, values in state.get("strings", {}).items():
+        _write_strings(os.path.join(dirpath, name), values)
+        layout["strings"].append(name)
+    for name, values in state.get("names", {}).items():
+        with open(os.path.join(dirpath, f"{name}.names"), "w", encoding="utf-8") as f:
+            f.write("\0".join(values))
+        layout["names"].append(name)
+    with open(os.path.join(dirpath, "state.json"), "w", encoding="utf-8") as f:
+        json.dump(layout, f, ensure_ascii=False)
+
+
+def read_state(dirpath: str, mmap: bool = True) -> dict:
+    with open(os.path.join(dirpath, "state.json"), encoding="utf-8") as f:
+        layout = json.load(f)
+    state = {"arrays": {}, "strings": {}, "names": {}, "meta": layout["meta"]}
+    for name in layout["arrays"]:
+        state["arrays"][name] = _load_array(os.path.join(dirpath, f"{name}.npy"), mmap)
+    for name in layout["strings"]:
+        state["strings"][name] = _read_strings(os.path.join(dirpath, name), mmap)
+    for name in layout["names"]:
+        with open(os.path.join(dirpath, f"{name}.names"), encoding="utf-8") as f:
+            text = f.read()
+        state["names"][name] = text.split("\0") if text else []
+    return state
+
+
+def _load_array(path: str, mmap: bool) -> np.ndarray:
+    if mmap:
+        try:
+            # copy-on-write: 読み込み後の更新はメモリ上にのみ反映される
+            return np.load(path, mmap_mode="c")
+        except ValueError:
+            # 要素数0の配列はmmapできない
+            pass
+    return np.load(path)
+
+
+def _write_strings(prefix: str, values):
+    encoded = [b"" if v is None else v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    with open(prefix + ".bin", "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(prefix + ".offsets.npy", offsets)
+    nulls = np.fromiter((v is None for v in values), dtype=bool, count=len(encoded))
+    if nulls.any():
+        np.save(prefix + ".nulls.npy", nulls)
+
+
+def _read_strings(prefix: str, mmap: bool) -> StringColumn:
+    offsets = np.load(prefix + ".offsets.npy")
+    nulls = np.load(prefix + ".nulls.npy") if os.path.exists(prefix + ".nulls.npy") else None
+    if mmap and os.path.getsize(prefix + ".bin") > 0:
+        data = np.memmap(prefix + ".bin", dtype=np.uint8, mode="r")
+    else:
+        data = np.fromfile(prefix + ".bin", dtype=np.uint8)
+    return StringColumn(data, offsets, nulls)
+
+
+def _edges_state(node_ids: List[str], edges) -> dict:
+    """エッジ列を(src, dst, relation)の整数配列に変換する"""
+    pos = {node_id: i for i, node_id in enumerate(node_ids)}
+    relations = Categorical()
+    src, dst, rel = [], [], []
+    for u, v, r in edges:
+        for node_id in (u, v):
+            if node_id not in pos:
+                pos[node_id] = len(node_ids)
+                node_ids.append(node_id)
+        src.append(pos[u])
+        dst.append(pos[v])
+        rel.append(relations.encode(r))
+    return {
+        "arrays": {
+            "src": np.asarray(src, dtype=np.int64),
+            "dst": np.asarray(dst, dtype=np.int64),
+            "relation": np.asarray(rel, dtype=np.int32),
+        },
+        "names": {"nodes": node_ids},
+        "meta": {"relations": relations.categories},
+    }
+
+
+def _iter_edges(state: dict):
+    nodes = state["names"]["nodes"]
+    relations = state["meta"]["relations"]
+    arrays = state["arrays"]
+    for u, v, r in zip(arrays["src"].tolist(), arrays["dst"].tolist(), arrays["relation"].tolist()):
+        yield nodes[u], nodes[v], (relations[r] if r >= 0 else None)
+
+
+# --- マニフェスト ---
+
+def _read_manifest(path: str) -> Optional[dict]:
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_manifest(path: str, manifest: dict):
+    tmp = os.path.join(path, MANIFEST + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(path, MANIFEST))
+
+
+# --- 保存 ---
+
+def save_snapshot(kg, path: str, incremental: bool = False):
+    """
+    知識グラフをpathへ保存する。
+    incremental=Trueかつ同じpathへ保存済みの場合は、前回以降の差分のみを新しいセグメントとして追記する。
+    """
+    from myrdal.knowledge.ann_index import backend_name
+
+    os.makedirs(path, exist_ok=True)
+    manifest = _read_manifest(path)
+    if incremental and manifest is not None and kg._snapshot_path == os.path.abspath(path):
+        generation = manifest["generation"] + 1
+        seg = f"seg_{generation:06d}"
+        _write_segment(kg, os.path.join(path, seg))
+        manifest["segments"].append(seg)
+        manifest["generation"] = generation
+        _write_manifest(path, manifest)
+    else:
+        generation = (manifest["generation"] if manifest else 0) + 1
+        while os.path.exists(os.path.join(path, f"base_{generation:06d}")):
+            generation += 1
+        base = f"base_{generation:06d}"
+        tmp_dir = tempfile.mkdtemp(prefix=f".{base}.", dir=path)
+        try:
+            write_state(os.path.join(tmp_dir, "nodes"), kg.nodes.state())
+            write_state(os.path.join(tmp_dir, "index"), kg.index.state())
+            write_state(os.path.join(tmp_dir, "graph"), _edges_state(list(kg.graph.nodes), kg.graph.edges(data="relation")))
+            os.replace(tmp_dir, os.path.join(path, base))
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        _write_manifest(path, {
+            "version": FORMAT_VERSION,
+            "model_name": kg.embedding_model_name,
+            "index_backend": backend_name(kg.index),
+            "index_params": kg.index.params(),
+            "base": base,
+            "segments": [],
+            "generation": generation,
+        })
+        # 新しいベースに畳み込まれた古いベース・セグメントを削除する。
+        # mmap中で消せなかったもの（Windows）は次回の保存時に改めて削除する
+        for name in os.listdir(path):
+            if name != base and name.startswith(("base_", "seg_", ".base_")):
+                shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+    kg._snapshot_path = os.path.abspath(path)
+    kg._reset_journal()
+
+
+def _write_segment(kg, seg_dir: str):
+    dirty = [node_id for node_id in kg._dirty_nodes if node_id in kg.nodes]
+    store = NodeStore()
+    embeddings = []
+    for node_id in dirty:
+        store.add(kg.get_node(node_id, with_embedding=False))
+        embeddings.append(kg.index.get(node_id))
+    write_state(os.path.join(seg_dir, "nodes"), store.state())
+    dim = kg.index.dim or 0
+    write_state(os.path.join(seg_dir, "embeddings"), {
+        "arrays": {"matrix": np.asarray(embeddings, dtype=np.float32).reshape(len(dirty), dim)},
+        "names": {"ids": dirty},
+    })
+    write_state(os.path.join(seg_dir, "removed"), {"names": {"ids": sorted(kg._removed_nodes)}})
+    write_state(os.path.join(seg_dir, "graph"), _edges_state([], kg._new_edges))
+
+
+# --- 読み込み ---
+
+def load_snapshot(path: str, mmap: bool = True, **kwargs):
+    """
+    pathのスナップショットを開く。mmap=Trueならembedding行列と文字列列をメモリマップし、必要な部分だけ読み込む。
+    kwargsはMultiLayerKnowledgeGraphのコンストラクタ引数（embedder, embedding_cache等）。
+    """
+    from myrdal.knowledge.ann_index import INDEX_BACKENDS
+    from myrdal.knowledge.multilayer_knowledge_graph import MultiLayerKnowledgeGraph
+
+    manifest = _read_manifest(path)
+    if manifest is None:
+        raise FileNotFoundError(f"No knowledge graph snapshot at {path}")
+    if manifest["version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {manifest['version']}")
+    kwargs.setdefault("embedding_model_name", manifest["model_name"])
+    kg = MultiLayerKnowledgeGraph(index_backend=manifest["index_backend"], index_params=manifest["index_params"], **kwargs)
+    base_dir = os.path.join(path, manifest["base"])
+    index_cls = INDEX_BACKENDS[manifest["index_backend"]]
+    kg.index = index_cls.from_state(read_state(os.path.join(base_dir, "index"), mmap), **manifest["index_params"])
+    kg.nodes = NodeStore.from_state(read_state(os.path.join(base_dir, "nodes"), mmap))
+    # 二次索引・BM25索引は初回の参照時にノードストアから構築する
+    kg._indexes = None
+    kg._lexical = None
+    _bulk_load_graph(kg.graph, read_state(os.path.join(base_dir, "graph"), mmap=False))
+    for seg in manifest["segments"]:
+        _apply_segment(kg, os.path.join(path, seg))
+    kg._snapshot_path = os.path.abspath(path)
+    kg._reset_journal()
+    return kg
+
+
+def _bulk_load_graph(graph, state: dict):
+    """空のMultiDiGraphへノードとエッジを一括投入する（中間リストを作らずジェネレータで渡す）"""
+    graph.add_nodes_from(state["names"]["nodes"])
+    graph.add_edges_from((u, v, {"relation": r}) for u, v, r in _iter_edges(state))
+
+
+def _apply_segment(kg, seg_dir: str):
+    from myrdal.knowledge.multilayer_knowledge_graph import KnowledgeNode
+
+    kg.remove_nodes(read_state(os.path.join(seg_dir, "removed"), mmap=False)["names"]["ids"])
+    store = NodeStore.from_state(read_state(os.path.join(seg_dir, "nodes"), mmap=False))
+    embeddings = read_state(os.path.join(seg_dir, "embeddings"), mmap=False)["arrays"]["matrix"]
+    nodes = []
+    for i, node_id in enumerate(store.row_to_id):
+        node = KnowledgeNode(**store.to_dict(node_id))
+        node.embedding = embeddings[i]
+        nodes.append(node)
+    kg.add_nodes_bulk(nodes)
+    kg.add_edges_bulk(_iter_edges(read_state(os.path.join(seg_dir, "graph"), mmap=False)))
@@ -0,0 +1,116 @@
+# 階層推論（祖先/子孫のk-hop探索）と結果キャッシュ
+
+from collections import OrderedDict, defaultdict
+from typing import Dict, FrozenSet, Iterable, Optional, Set, Tuple
+
+Key = Tuple[str, str, Optional[int]]  # (起点ノード, 方向, 深さ)
+
+
+class HierarchyIndex:
+    """
+    知識グラフ上の「depth階層以内の祖先/子孫」探索。
+    - 探索は訪問済み集合つきの幅優先探索で、共有祖先（菱形のDAG）を二度展開しない
+    - 起点ごとの結果をLRUでキャッシュし、エッジ変更時は影響しうる項目だけを無効化する
+      （エッジu->vの変更で祖先集合が変わりうるのは、起点がvか結果にvを含む項目のみ。子孫側はuについて同様）
+    cache_size=0でキャッシュを無効にする。
+    """
+
+    def __init__(self, graph, cache_size: int = 10000):
+        self.graph = graph
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Key, FrozenSet[str]]" = OrderedDict()
+        # (方向, ノード) -> そのノードを起点または結果に含むキャッシュ項目
+        self._dependents: Dict[Tuple[str, str], Set[Key]] = defaultdict(set)
+        self.hits = 0
+        self.misses = 0
+
+    def _neighbors(self, node_id: str, direction: str):
+        if direction == "up":
+            return self.graph.predecessors(node_id)
+        return self.graph.successors(node_id)
+
+    def _bfs(self, sources: Iterable[str], direction: str, depth: Optional[int]) -> Set[str]:
+        sources = [s for s in sources if s in self.graph]
+        seen = set(sources)
+        result = set()
+        frontier = sources
+        level = 0
+        while frontier and (depth is None or level < depth):
+            next_frontier = []
+            for nid in frontier:
+                for other in self._neighbors(nid, direction):
+                    if other not in seen:
+                        seen.add(other)
+                        next_frontier.append(other)
+            result.update(next_frontier)
+            frontier = next_frontier
+            level += 1
+        return result
+
+    def reachable(self, sources, direction: str = "up", depth: Optional[int] = 1) -> Set[str]:
+        """
+        sources（単一IDまたはIDの列）からdirection方向にdepth階層以内で到達できるノードの集合。
+        depth=Noneなら制限なし（推移閉包）。起点自身は含めない。
+        """
+        if direction not in ("up", "down"):
+            raise ValueError(f"Unknown direction: {direction}")
+        if isinstance(sources, str):
+            sources = [sources]
+        sources = list(dict.fromkeys(sources))
+        if not self.cache_size:
+            return self._bfs(sources, direction, depth)
+        result = set()
+        for source in sources:
+            result |= self._cached(source, direction, depth)
+        return result - set(sources)
+
+    def _cached(self, source: str, direction: str, depth: Optional[int]) -> FrozenSet[str]:
+        key = (source, direction, depth)
+        found = self._cache.get(key)
+        if found is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return found
+        self.misses += 1
+        found = frozenset(self._bfs([source], direction, depth))
+        self._cache[key] = found
+        self._dependents[(direction, source)].add(key)
+        for member in found:
+            self._dependents[(direction, member)].add(key)
+        while len(self._cache) > self.cache_size:
+            self._drop(next(iter(self._cache)))
+        return found
+
+    def _drop(self, key: Key):
+        found = self._cache.pop(key, None)
+        if found is None:
+            return
+        source, direction, _ = key
+        for member in (source, *found):
+            keys = self._dependents.get((direction, member))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._dependents[(direction, member)]
+
+    def _invalidate(self, direction: str, node_id: str):
+        keys = self._dependents.get((direction, node_id))
+        if keys:
+            for key in list(keys):
+                self._drop(key)
+
+    def invalidate_edge(self, from_id: str, to_id: str):
+        """エッジfrom_id->to_idの追加・削除に伴うキャッシュ無効化"""
+        if self._cache:
+            self._invalidate("up", to_id)
+            self._invalidate("down", from_id)
+
+    def invalidate_node(self, node_id: str):
+        """ノード削除（接続する全エッジの削除）に伴うキャッシュ無効化"""
+        if self._cache:
+            self._invalidate("up", node_id)
+            self._invalidate("down", node_id)
+
+    def clear(self):
+        self._cache.clear()
+        self._dependents.clear()
@@ -2,16 +2,36 @@
 
 import networkx as nx
 
+from myrdal.knowledge.triple_index import TripleIndex, join_patterns
+
 class KnowledgeGraph:
     def __init__(self):
         self.graph = nx.MultiDiGraph()
+        # SPO/POS/OSP索引（queryは束縛された項から索引を引き、全エッジを走査しない）
+        self.index = TripleIndex()
     async def add_fact(self, subject, predicate, obj):
         self.graph.add_edge(subject, obj, key=predicate)
+        self.index.add(subject, predicate, obj)
+    async def add_facts(self, triples):
+        """(subject, predicate, obj)の列をまとめて追加する"""
+        triples = [t for t in triples if self.index.add(*t)]
+        # キーを属性dictと取り違えないよう、(u, v, key, 属性)の4要素で明示する
+        self.graph.add_edges_from((s, o, p, {}) for s, p, o in triples)
     async def query(self, subject=None, predicate=None, obj=None):
+        return list(self.index.match(subject, predicate, obj))
+    async def query_patterns(self, patterns, limit=None):
+        """
+        複数パターンの連言検索。patternsは("?x", "is_a", "animal")のような三つ組の列（?で始まる項が変数）。
+        全パターンを同時に満たす変数束縛のdictのリストを返す。一致件数の少ないパターンから順に結合する。
+        """
         results = []
-        for u, v, k in self.graph.edges(keys=True):
-            if (subject is None or u == subject) and (predicate is None or k == predicate) and (obj is None or v == obj):
-                results.append((u, k, v))
+        for binding in join_patterns(self.index, patterns):
+            results.append(binding)
+            if limit is not None and len(results) >= limit:
+                break
         return results
+    async def count(self, subject=None, predicate=None, obj=None):
+        return self.index.count(subject, predicate, obj)
     async def delete_fact(self, subject, predicate, obj):
-        self.graph.remove_edge(subject, obj, key=predicate) 
\ No newline at end of file
+        self.graph.remove_edge(subject, obj, key=predicate)
+        self.index.remove(subject, predicate, obj)
@@ -0,0 +1,93 @@
+# BM25による語彙（キーワード）検索用の転置索引
+
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 英数字は単語単位、かな・漢字は文字bigram単位で分割する
+_WORD = re.compile(r"[0-9a-z]+|[\u3040-\u30ff\u3400-\u9fff]+")
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u9fff]")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for word in _WORD.findall(text.lower()):
+        if _CJK.match(word) and len(word) > 1:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+class BM25Index:
+    """
+    メモリ上の転置索引（語 -> {ID: 出現回数}）によるBM25スコアリング。
+    add/removeで増分更新する。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.doc_terms: Dict[str, Counter] = {}
+        self.doc_len: Dict[str, int] = {}
+        self._total_len = 0
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.doc_terms
+
+    def add(self, doc_id: str, text: str):
+        if doc_id in self.doc_terms:
+            self.remove(doc_id)
+        terms = Counter(tokenize(text or ""))
+        self.doc_terms[doc_id] = terms
+        self.doc_len[doc_id] = sum(terms.values())
+        self._total_len += self.doc_len[doc_id]
+        for term, tf in terms.items():
+            self.postings[term][doc_id] = tf
+
+    def remove(self, doc_id: str) -> bool:
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return False
+        self._total_len -= self.doc_len.pop(doc_id)
+        for term in terms:
+            posting = self.postings[term]
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[term]
+        return True
+
+    def search(self, query: str, top_k: int = 5, allowed: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """BM25スコアの上位top_k件を返す。allowedを指定するとその集合内の文書のみ採点する。"""
+        n = len(self.doc_terms)
+        if n == 0:
+            return []
+        if allowed is not None and not isinstance(allowed, (set, frozenset)):
+            allowed = set(allowed)
+        avgdl = self._total_len / n or 1.0
+        scores: Dict[str, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                dl = self.doc_len[doc_id]
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * dl / avgdl))
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[Tuple[str, float]]], k: int = 60) -> List[Tuple[str, float]]:
+    """複数の順位リストをRRF（Σ 1/(k + 順位)）で統合する"""
+    fused: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking, start=1):
+            fused[doc_id] += 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
@@ -0,0 +1,156 @@
+# WorldModelNexusの知識モジュール呼び出し結果のキャッシュ
+# (モジュール名, 正規化した引数)をキーに結果を保持し、同じ呼び出しの再実行（翻訳・ConceptNet取得・ベイズ推論など）を省く。
+# 同時に来た同一の呼び出しは1回だけ実行し、結果を共有する（single-flight）。
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+
+def canonical_args(args) -> str | None:
+    """引数dictをキーに使える正規形の文字列にする。JSONにできない引数（DataFrameなど）を含む場合はNone（キャッシュしない）"""
+    try:
+        return json.dumps(args or {}, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return None
+
+
+class ModuleResultCache:
+    """
+    知識モジュールの結果キャッシュ。
+    - max_entries: 保持する結果の最大件数（超えたら最も古く使われたものから捨てる）
+    - default_ttl: 結果の有効期間（秒）
+    - policies: "モジュール名" または "モジュール名.method" -> TTL秒。0またはNoneはキャッシュしない。
+      "モジュール名.method"の指定が優先される。
+    キャッシュしない呼び出しはモジュールの状態を変えうる（例: discover_structureは因果グラフを更新する）ため、
+    実行したらそのモジュールのキャッシュを破棄する。破棄をまたいで実行された呼び出しの結果は古い状態に基づくので保存しない。
+    例外になった呼び出しの結果はキャッシュしない。同一の呼び出しを待つ側が全員キャンセルされたら実行も止める。
+    """
+
+    DEFAULT_POLICIES = {"causal_reasoner.discover_structure": 0}
+
+    def __init__(self, max_entries: int = 512, default_ttl: float = 300.0, policies=None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.policies = {**self.DEFAULT_POLICIES, **(policies or {})}
+        self._entries = OrderedDict()  # key -> (期限, 値)
+        self._inflight = {}  # key -> {"task": 実行中のTask, "waiters": 待っている呼び出し数}
+        self._generations = {}  # モジュール名 -> 破棄の回数（実行中にこれが変わった結果は保存しない）
+        self._epoch = 0  # 全体の破棄の回数
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # 実行中の同一呼び出しに相乗りした回数
+        self.bypassed = 0  # キャッシュ対象外として直接実行した回数
+        self.per_module = {}  # モジュール名 -> {"hits": .., "misses": ..}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def ttl_for(self, module_name: str, args) -> float | None:
+        method = (args or {}).get("method") if isinstance(args, dict) else None
+        if method is not None and f"{module_name}.{method}" in self.policies:
+            ttl = self.policies[f"{module_name}.{method}"]
+        else:
+            ttl = self.policies.get(module_name, self.default_ttl)
+        return ttl if ttl and self.max_entries > 0 else None
+
+    def _count(self, module_name: str, field: str):
+        counts = self.per_module.setdefault(module_name, {"hits": 0, "misses": 0})
+        counts[field] += 1
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires, value = entry
+        if time.monotonic() >= expires:
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _generation(self, module_name: str) -> tuple:
+        return self._epoch, self._generations.get(module_name, 0)
+
+    def _put(self, key, ttl: float, value):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def call(self, module_name: str, args: dict, module):
+        """module(**args)の結果を返す。キャッシュにあればそれを、同一の呼び出しが実行中ならその結果を待って返す"""
+        ttl = self.ttl_for(module_name, args)
+        canonical = canonical_args(args) if ttl is not None else None
+        if canonical is None:
+            self.bypassed += 1
+            try:
+                return await module(**(args or {}))
+            finally:
+                if ttl is None:
+                    self.invalidate(module_name)
+        key = (module_name, canonical)
+        found, value = self._get(key)
+        if found:
+            self.hits += 1
+            self._count(module_name, "hits")
+            return value
+        flight = self._inflight.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            self.hits += 1
+            self._count(module_name, "hits")
+        else:
+            self.misses += 1
+            self._count(module_name, "misses")
+            flight = {"task": None, "waiters": 0}
+            flight["task"] = asyncio.ensure_future(self._fill(key, ttl, module, args, flight))
+            # 待ち手が全員キャンセルされた後に例外で終わっても警告を出さない
+            flight["task"].add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = flight
+        # 1人の待ち手のキャンセルで共有の実行を止めないようshieldで待ち、最後の待ち手がいなくなったら止める
+        flight["waiters"] += 1
+        try:
+            return await asyncio.shield(flight["task"])
+        finally:
+            flight["waiters"] -= 1
+            if flight["waiters"] == 0 and not flight["task"].done():
+                flight["task"].cancel()
+
+    async def _fill(self, key, ttl: float, module, args, flight):
+        generation = self._generation(key[0])
+        try:
+            value = await module(**(args or {}))
+            if self._generation(key[0]) == generation:
+                self._put(key, ttl, value)
+            return value
+        finally:
+            if self._inflight.get(key) is flight:
+                del self._inflight[key]
+
+    def invalidate(self, module_name: str | None = None):
+        """module_nameのキャッシュ（Noneなら全体）を破棄する。実行中の呼び出しの結果も保存されなくなる"""
+        if module_name is None:
+            self._epoch += 1
+            self._entries.clear()
+            self._inflight.clear()
+            return
+        self._generations[module_name] = self._generations.get(module_name, 0) + 1
+        for key in [k for k in self._entries if k[0] == module_name]:
+            del self._entries[key]
+        # 以後の同一呼び出しは実行中のもの（破棄前の状態に基づく）に相乗りせず、新たに実行する
+        for key in [k for k in self._inflight if k[0] == module_name]:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+            "size": len(self._entries),
+            "per_module": {name: dict(counts) for name, counts in self.per_module.items()},
+        }
@@ -1,8 +1,25 @@
+import atexit
+import weakref
 import networkx as nx
 from pydantic import BaseModel
-from typing import Optional, Any, Dict, List
+from typing import Optional, Any, Dict, List, Iterable, Union
+from itertools import islice
 from sentence_transformers import SentenceTransformer
 import numpy as np
+from myrdal.knowledge.ann_index import make_index
+from myrdal.knowledge.embedding_index import normalize
+from myrdal.knowledge.embedding_cache import EmbeddingCache, CachedEmbedder
+from myrdal.knowledge.node_store import NodeStore
+from myrdal.knowledge.graph_snapshot import save_snapshot, load_snapshot
+from myrdal.knowledge.secondary_index import SecondaryIndexes
+from myrdal.knowledge.lexical_index import BM25Index, reciprocal_rank_fusion
+from myrdal.knowledge.hierarchy_index import HierarchyIndex
+from myrdal.knowledge.async_ingest import AsyncIngestor
+
+def _flush_cache_at_exit(ref):
+    cache = ref()
+    if cache is not None:
+        cache.flush()
 
 class KnowledgeNode(BaseModel):
     id: str
@@ -15,45 +32,381 @@ class KnowledgeNode(BaseModel):
     embedding: Optional[List[float]] = None
 
 class MultiLayerKnowledgeGraph:
-    def __init__(self, embedding_model_name="all-MiniLM-L6-v2"):
+    def __init__(self, embedding_model_name="all-MiniLM-L6-v2", embedder=None, index_backend="flat", index_params=None, embedding_cache=None, lexical_index=False, hierarchy_cache_size=10000):
+        """
+        index_backend: "flat"=正規化行列による総当たり, "ivf"=IVF-flat近似最近傍（大規模グラフ向け）
+        index_params: 索引への追加パラメータ（例: {"nlist": 1024, "nprobe": 16}、flatなら{"dtype": "int8"}で量子化）
+        embedding_cache: EmbeddingCache、またはキャッシュディレクトリのパス。encode前に参照される
+        lexical_index: TrueならBM25索引を最初から維持する（Falseでもsearch(lexical=True)の初回に構築される）
+        hierarchy_cache_size: hierarchical_reasoningの結果キャッシュの件数上限（0で無効）
+        """
         self.graph = nx.MultiDiGraph()
-        self.embedder = SentenceTransformer(embedding_model_name)
+        self.embedding_model_name = embedding_model_name
+        # パスから作ったキャッシュはグラフが所有し、close()とプロセス終了時に書き出す
+        self._owns_cache = isinstance(embedding_cache, str)
+        if self._owns_cache:
+            embedding_cache = EmbeddingCache(embedding_cache, model_name=embedding_model_name)
+            atexit.register(_flush_cache_at_exit, weakref.ref(embedding_cache))
+        self.embedding_cache = embedding_cache
+        # モデルの読み込みは初回のencodeまで遅延する（スナップショットから素早く開くため）
+        self._embedder = None
+        if embedder is not None:
+            self.embedder = embedder
+        # 全ノードのembeddingを正規化済み行列で保持するベクトル索引
+        self.index = make_index(index_backend, **(index_params or {}))
+        # ノード属性は列指向ストアに保持し、networkxグラフにはIDとエッジのみを置く
+        self.nodes = NodeStore()
+        # type/source/confidence/timestamp/priorityの二次索引（Noneなら初回参照時にノードストアから構築）
+        self._indexes = SecondaryIndexes()
+        # contentのBM25転置索引（Noneなら初回参照時に構築）
+        self._lexical = BM25Index() if lexical_index else None
+        # 祖先/子孫探索とその結果キャッシュ（エッジ変更時に該当部分のみ無効化）
+        self.hierarchy = HierarchyIndex(self.graph, cache_size=hierarchy_cache_size)
+        # auto_update_async用の取り込みワーカー（初回呼び出し時に起動）
+        self.ingestor = AsyncIngestor(self)
+        # 差分保存用のジャーナル（スナップショットへ保存/から読み込み後のみ記録する）
+        self._snapshot_path = None
+        self._reset_journal()
+        # 新規ノードIDの連番（削除後も既存IDを再利用しないよう単調増加させる）
+        self._id_counter = 0
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self.embedder = SentenceTransformer(self.embedding_model_name)
+        return self._embedder
+
+    @embedder.setter
+    def embedder(self, embedder):
+        if self.embedding_cache is not None and not isinstance(embedder, CachedEmbedder):
+            embedder = CachedEmbedder(embedder, self.embedding_cache)
+        self._embedder = embedder
+
+    @property
+    def indexes(self) -> SecondaryIndexes:
+        if self._indexes is None:
+            self._indexes = SecondaryIndexes.from_store(self.nodes)
+        return self._indexes
+
+    @property
+    def lexical(self) -> BM25Index:
+        if self._lexical is None:
+            lexical = BM25Index()
+            for node_id, row in self.nodes.id_to_row.items():
+                lexical.add(node_id, self.nodes.content[row])
+            self._lexical = lexical
+        return self._lexical
+
+    @staticmethod
+    def _index_fields(node: KnowledgeNode) -> dict:
+        return {
+            "type": node.type,
+            "source": node.source,
+            "confidence": node.confidence,
+            "timestamp": node.timestamp,
+            "priority": (node.extra or {}).get("priority"),
+        }
+
+    def _new_id(self, node_type: str) -> str:
+        self._id_counter = max(self._id_counter, len(self.graph))
+        while True:
+            node_id = f"{node_type}_{self._id_counter}"
+            self._id_counter += 1
+            if node_id not in self.graph:
+                return node_id
+
+    def _reset_journal(self):
+        self._dirty_nodes = set()
+        self._removed_nodes = set()
+        self._new_edges = []
+
+    def save(self, path: str, incremental: bool = False):
+        """
+        スナップショットをpathへ保存する。
+        incremental=Trueなら前回の保存以降の差分だけを追記する（頻繁なチェックポイント向け）。
+        埋め込みキャッシュも合わせて書き出す。
+        """
+        save_snapshot(self, path, incremental=incremental)
+        if self.embedding_cache is not None:
+            self.embedding_cache.flush()
+
+    def close(self):
+        """埋め込みキャッシュを書き出す（グラフが作ったキャッシュなら閉じる）"""
+        if self.embedding_cache is None:
+            return
+        if self._owns_cache:
+            self.embedding_cache.close()
+        else:
+            self.embedding_cache.flush()
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, **kwargs):
+        """スナップショットを開く。mmap=Trueならembedding行列等はアクセス時に読み込まれる。"""
+        return load_snapshot(path, mmap=mmap, **kwargs)
 
     def add_node(self, node: KnowledgeNode):
         # contentからembeddingを生成
         if node.embedding is None:
-            node.embedding = self.embedder.encode(node.content).tolist()
-        self.graph.add_node(node.id, **node.dict())
+            node.embedding = self.embedder.encode(node.content)
+        self.nodes.add(node)
+        self.graph.add_node(node.id)
+        self.index.add(node.id, node.embedding)
+        if self._indexes is not None:
+            self._indexes.add(node.id, self._index_fields(node))
+        if self._lexical is not None:
+            self._lexical.add(node.id, node.content)
+        if self._snapshot_path is not None:
+            self._dirty_nodes.add(node.id)
+
+    def add_nodes_bulk(self, nodes: Iterable[KnowledgeNode], batch_size: int = 256):
+        """
+        複数ノードをまとめて追加する。embedding未設定のノードはbatch_size件ずつまとめてencodeする。
+        nodesはジェネレータでもよい（batch_size件ずつ読み進める）。追加したIDのリストを返す。
+        """
+        ids = []
+        nodes = iter(nodes)
+        while True:
+            batch = list(islice(nodes, batch_size))
+            if not batch:
+                return ids
+            missing = [n for n in batch if n.embedding is None]
+            if missing:
+                vecs = self.embedder.encode([n.content for n in missing], batch_size=batch_size)
+                for n, vec in zip(missing, vecs):
+                    n.embedding = vec
+            self.nodes.add_many(batch)
+            self.graph.add_nodes_from(n.id for n in batch)
+            if self._indexes is not None:
+                for n in batch:
+                    self._indexes.add(n.id, self._index_fields(n))
+            if self._lexical is not None:
+                for n in batch:
+                    self._lexical.add(n.id, n.content)
+            self.index.add_many([n.id for n in batch], np.asarray([n.embedding for n in batch], dtype=np.float32))
+            ids.extend(n.id for n in batch)
+            if self._snapshot_path is not None:
+                self._dirty_nodes.update(n.id for n in batch)
+
+    def add_edges_bulk(self, edges: Iterable[tuple]):
+        """(from_id, to_id, relation)の列をまとめて追加する"""
+        edges = list(edges)
+        if self._snapshot_path is not None:
+            self._new_edges.extend(edges)
+        self.graph.add_edges_from((u, v, {"relation": r}) for u, v, r in edges)
+        for u, v, _ in edges:
+            self.hierarchy.invalidate_edge(u, v)
+
+    def auto_update_bulk(
+        self,
+        contents: Iterable[Union[str, dict]],
+        node_type: str = "fact",
+        relation: str = None,
+        parent_id: str = None,
+        batch_size: int = 256,
+        threshold: float = 0.95,
+        **kwargs,
+    ) -> List[str]:
+        """
+        auto_updateの一括版。contentsは文字列、または
+        {"content": ..., "node_type": ..., "parent_id": ..., "relation": ..., その他の属性} のdict。
+        batch_size件ずつまとめてencodeし、既存索引とバッチ内の両方に対する重複判定（類似度>threshold）を
+        ベクトル化して行う。入力順に対応するノードID（既存 or 新規）のリストを返す。
+        """
+        result_ids = []
+        contents = iter(contents)
+        while True:
+            batch = list(islice(contents, batch_size))
+            if not batch:
+                return result_ids
+            items = []
+            for item in batch:
+                if isinstance(item, str):
+                    item = {"content": item}
+                else:
+                    item = dict(item)
+                items.append({
+                    "content": item.pop("content"),
+                    "node_type": item.pop("node_type", node_type),
+                    "parent_id": item.pop("parent_id", parent_id),
+                    "relation": item.pop("relation", relation),
+                    "attrs": {**kwargs, **item},
+                })
+            vecs = normalize(self.embedder.encode([it["content"] for it in items], batch_size=batch_size))
+            result_ids.extend(self._auto_update_encoded(items, vecs, threshold))
+
+    def _auto_update_encoded(self, items: List[dict], vecs: np.ndarray, threshold: float = 0.95) -> List[str]:
+        """encode済みのバッチを統合する（auto_update_bulkと非同期取り込みの共通処理）"""
+        # 既存ノードとの類似度（top-1）
+        existing = self.index.search_batch(vecs, top_k=1) if len(self.index) else [[] for _ in items]
+        # バッチ内の類似度（自分より前の要素のみ対象）
+        intra = vecs @ vecs.T
+        intra[np.triu_indices(len(items))] = -np.inf
+        assigned: List[Optional[str]] = [None] * len(items)
+        new_nodes, edges, updates = [], [], []
+        for i, it in enumerate(items):
+            best_id, best_sim = None, -np.inf
+            if existing[i]:
+                best_id, best_sim = existing[i][0]
+            if i > 0:
+                j = int(np.argmax(intra[i]))
+                if intra[i, j] > best_sim:
+                    best_id, best_sim = assigned[j], float(intra[i, j])
+            if best_id is not None and best_sim > threshold:
+                # ほぼ同一知識とみなして既存ノードを更新
+                assigned[i] = best_id
+                if it["attrs"]:
+                    updates.append((best_id, it["attrs"]))
+                continue
+            node_type_i = it["node_type"] if it["node_type"] in ("fact", "concept", "theory", "belief") else "fact"
+            node = KnowledgeNode(
+                id=self._new_id(node_type_i),
+                type=node_type_i,
+                content=it["content"],
+                **it["attrs"],
+            )
+            node.embedding = vecs[i]
+            new_nodes.append(node)
+            assigned[i] = node.id
+            if it["parent_id"] and it["relation"]:
+                edges.append((it["parent_id"], node.id, it["relation"]))
+        self.add_nodes_bulk(new_nodes, batch_size=max(1, len(new_nodes)))
+        for node_id, attrs in updates:
+            self.update_knowledge(node_id, **attrs)
+        self.add_edges_bulk(edges)
+        return assigned
+
+    def remove_node(self, node_id: str):
+        self.remove_nodes([node_id])
+
+    def remove_nodes(self, node_ids):
+        node_ids = list(node_ids)
+        for nid in node_ids:
+            self.hierarchy.invalidate_node(nid)
+        self.graph.remove_nodes_from(node_ids)
+        for nid in node_ids:
+            self.nodes.remove(nid)
+            self.index.remove(nid)
+            if self._indexes is not None:
+                self._indexes.remove(nid)
+            if self._lexical is not None:
+                self._lexical.remove(nid)
+        if self._snapshot_path is not None:
+            removed = set(node_ids)
+            self._removed_nodes.update(removed)
+            self._dirty_nodes.difference_update(removed)
+            self._new_edges = [e for e in self._new_edges if e[0] not in removed and e[1] not in removed]
+
+    def get_node(self, node_id: str, with_embedding: bool = True) -> KnowledgeNode:
+        """ノードストアからKnowledgeNodeを組み立てて返す（アクセス時にのみ生成する）"""
+        data = self.nodes.to_dict(node_id)
+        if with_embedding:
+            vec = self.index.get(node_id)
+            data["embedding"] = vec.tolist() if vec is not None else None
+        return KnowledgeNode(**data)
+
+    def iter_nodes(self, with_embedding: bool = False):
+        for node_id in self.nodes:
+            yield self.get_node(node_id, with_embedding=with_embedding)
 
     def add_edge(self, from_id: str, to_id: str, relation: str):
         self.graph.add_edge(from_id, to_id, relation=relation)
+        self.hierarchy.invalidate_edge(from_id, to_id)
+        if self._snapshot_path is not None:
+            self._new_edges.append((from_id, to_id, relation))
 
     def add_fact(self, content, **kwargs):
-        node = KnowledgeNode(id=f"fact_{len(self.graph)}", type="fact", content=content, **kwargs)
+        node = KnowledgeNode(id=self._new_id("fact"), type="fact", content=content, **kwargs)
         self.add_node(node)
         return node.id
 
     def add_concept(self, content, **kwargs):
-        node = KnowledgeNode(id=f"concept_{len(self.graph)}", type="concept", content=content, **kwargs)
+        node = KnowledgeNode(id=self._new_id("concept"), type="concept", content=content, **kwargs)
         self.add_node(node)
         return node.id
 
     def add_theory(self, content, **kwargs):
-        node = KnowledgeNode(id=f"theory_{len(self.graph)}", type="theory", content=content, **kwargs)
+        node = KnowledgeNode(id=self._new_id("theory"), type="theory", content=content, **kwargs)
         self.add_node(node)
         return node.id
 
     def add_belief(self, content, **kwargs):
-        node = KnowledgeNode(id=f"belief_{len(self.graph)}", type="belief", content=content, **kwargs)
+        node = KnowledgeNode(id=self._new_id("belief"), type="belief", content=content, **kwargs)
         self.add_node(node)
         return node.id
 
     def query_by_type(self, node_type: str):
-        return [n for n, d in self.graph.nodes(data=True) if d.get("type") == node_type]
+        return list(self.indexes.ids_with("type", node_type))
+
+    def query_by_source(self, source: str):
+        return list(self.indexes.ids_with("source", source))
+
+    def query_by_confidence(self, min_confidence: float = None, max_confidence: float = None):
+        """min_confidence <= confidence <= max_confidence のノード（confidence昇順）"""
+        return self.indexes.ids_in_range("confidence", min_confidence, max_confidence)
+
+    def query_by_time(self, since: str = None, until: str = None):
+        """since <= timestamp <= until のノード（timestamp昇順）"""
+        return self.indexes.ids_in_range("timestamp", since, until)
+
+    def query_by_priority(self, min_priority: int = None, max_priority: int = None):
+        """min_priority <= priority <= max_priority のノード（priority昇順）"""
+        return self.indexes.ids_in_range("priority", min_priority, max_priority)
+
+    def filter_nodes(self, node_type: str = None, source: str = None, min_confidence: float = None, max_confidence: float = None,
+                     since: str = None, until: str = None, min_priority: int = None, max_priority: int = None) -> set:
+        """
+        指定した条件をすべて満たすノードIDの集合。各条件は二次索引から引き、小さい集合から順に積集合をとる。
+        条件が1つもなければ全ノードを返す。
+        """
+        candidates = []
+        if node_type is not None:
+            candidates.append(self.indexes.ids_with("type", node_type))
+        if source is not None:
+            candidates.append(self.indexes.ids_with("source", source))
+        if min_confidence is not None or max_confidence is not None:
+            candidates.append(set(self.query_by_confidence(min_confidence, max_confidence)))
+        if since is not None or until is not None:
+            candidates.append(set(self.query_by_time(since, until)))
+        if min_priority is not None or max_priority is not None:
+            candidates.append(set(self.query_by_priority(min_priority, max_priority)))
+        if not candidates:
+            return set(self.nodes)
+        candidates.sort(key=len)
+        result = set(candidates[0])
+        for other in candidates[1:]:
+            result &= other
+            if not result:
+                break
+        return result
+
+    def set_priority(self, node_id: str, priority: int):
+        self.update_knowledge(node_id, priority=priority)
+
+    def insert_priority(self, node_id: str, after_priority: int):
+        """after_priorityより大きいpriorityを1つずつ繰り下げ、node_idをafter_priority+1に挿入する"""
+        for nid, priority in self.indexes.shift_priorities(after_priority):
+            self.nodes.update(nid, priority=priority)
+            if self._snapshot_path is not None:
+                self._dirty_nodes.add(nid)
+        self.set_priority(node_id, after_priority + 1)
 
     def update_knowledge(self, node_id: str, **updates):
-        for k, v in updates.items():
-            self.graph.nodes[node_id][k] = v
+        # contentのみ変更された場合はembeddingを再計算して索引と整合させる
+        if "content" in updates and updates.get("embedding") is None:
+            updates["embedding"] = self.embedder.encode(updates["content"])
+        self.nodes.update(node_id, **updates)
+        if updates.get("embedding") is not None:
+            self.index.add(node_id, updates["embedding"])
+        if self._indexes is not None:
+            for field in SecondaryIndexes.FIELDS:
+                if field in updates:
+                    self._indexes.set(node_id, field, updates[field])
+            if "extra" in updates and "priority" not in updates:
+                self._indexes.set(node_id, "priority", (updates["extra"] or {}).get("priority"))
+        if self._lexical is not None and "content" in updates:
+            self._lexical.add(node_id, updates["content"])
+        if self._snapshot_path is not None:
+            self._dirty_nodes.add(node_id)
 
     def auto_update(self, new_content: str, node_type: str = "fact", relation: str = None, parent_id: str = None, **kwargs):
         """
@@ -75,6 +428,13 @@ class MultiLayerKnowledgeGraph:
             self.add_edge(parent_id, new_id, relation)
         return new_id
 
+    async def auto_update_async(self, new_content: str, node_type: str = "fact", relation: str = None, parent_id: str = None, **kwargs) -> str:
+        """
+        auto_updateの非同期版。バックグラウンドのワーカーが他の呼び出しとまとめてencode・統合し、
+        その間イベントループを塞がない。最終的なノードID（既存 or 新規）を返す。
+        """
+        return await self.ingestor.ingest(new_content, node_type=node_type, relation=relation, parent_id=parent_id, **kwargs)
+
     def get_parents(self, node_id: str):
         """上位概念・理論など親ノードを取得"""
         return list(self.graph.predecessors(node_id))
@@ -83,36 +443,40 @@ class MultiLayerKnowledgeGraph:
         """下位概念・事実など子ノードを取得"""
         return list(self.graph.successors(node_id))
 
-    def hierarchical_reasoning(self, node_id: str, direction: str = "up", depth: int = 1):
+    def hierarchical_reasoning(self, node_id, direction: str = "up", depth: int = 1):
         """
+        node_id: 起点ノードID、または複数の起点IDのリスト
         direction: "up"=親方向, "down"=子方向
-        depth: 何階層たどるか
-        """
-        visited = set()
-        frontier = [node_id]
-        for _ in range(depth):
-            next_frontier = []
-            for nid in frontier:
-                if direction == "up":
-                    parents = self.get_parents(nid)
-                    next_frontier.extend(parents)
-                else:
-                    children = self.get_children(nid)
-                    next_frontier.extend(children)
-            visited.update(next_frontier)
-            frontier = next_frontier
-        return list(visited)
+        depth: 何階層たどるか（Noneなら制限なし）
+        """
+        return list(self.hierarchy.reachable(node_id, direction=direction, depth=depth))
 
-    def query_by_vector(self, query_text, top_k=5):
+    def query_by_vector(self, query_text, top_k=5, **search_params):
+        # search_params: 索引固有の検索パラメータ（IVFならnprobe）
         query_vec = self.embedder.encode(query_text)
-        sims = []
-        for n, d in self.graph.nodes(data=True):
-            node_vec = d.get("embedding")
-            if node_vec is not None:
-                sim = np.dot(query_vec, node_vec) / (np.linalg.norm(query_vec) * np.linalg.norm(node_vec))
-                sims.append((n, sim))
-        sims.sort(key=lambda x: x[1], reverse=True)
-        return sims[:top_k]
+        return self.index.search(query_vec, top_k=top_k, **search_params)
+
+    def search(self, query_text: str, top_k: int = 5, lexical: bool = False, candidate_k: int = None, rrf_k: int = 60, **filters):
+        """
+        メタデータ条件付きの意味検索。
+        filters: filter_nodesの条件（node_type, source, min_confidence, max_confidence, since, until, min_priority, max_priority）。
+        条件は二次索引から対象IDの集合を求め、ベクトル索引の行ビットマップとして採点前に適用する。
+        lexical=Trueなら、BM25の語彙検索とベクトル検索の順位をreciprocal rank fusionで統合したスコアを返す。
+        """
+        allowed = self.filter_nodes(**filters) if any(v is not None for v in filters.values()) else None
+        if allowed is not None and not allowed:
+            return []
+        if not lexical:
+            return self.query_by_vector(query_text, top_k=top_k, allowed=allowed)
+        # 統合前に各検索から多めに候補をとる
+        candidate_k = candidate_k or max(top_k * 4, 50)
+        vector_hits = self.query_by_vector(query_text, top_k=candidate_k, allowed=allowed)
+        lexical_hits = self.lexical.search(query_text, top_k=candidate_k, allowed=allowed)
+        return reciprocal_rank_fusion([vector_hits, lexical_hits], k=rrf_k)[:top_k]
+
+    def embedding_cache_stats(self) -> dict:
+        """埋め込みキャッシュのヒット/ミス数（キャッシュ未使用時は空dict）"""
+        return self.embedding_cache.stats() if self.embedding_cache is not None else {}
 
     def visualize(self):
         import matplotlib.pyplot as plt
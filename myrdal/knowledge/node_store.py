@@ -0,0 +1,263 @@
+# KnowledgeNode用の列指向ノードストア
+# type/sourceは整数コード化したカテゴリ列、confidenceはfloat64配列、contentは文字列表で保持する。
+# embeddingはベクトル索引（EmbeddingIndex/IVFFlatIndex）側の行列にのみ保持し、二重に持たない。
+
+import sys
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class Categorical:
+    """文字列を整数コードに変換するインターン表（Noneは-1）"""
+
+    def __init__(self):
+        self.categories: List[str] = []
+        self.codes: Dict[str, int] = {}
+
+    def __len__(self):
+        return len(self.categories)
+
+    def encode(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.categories)
+            self.categories.append(sys.intern(value))
+            self.codes[value] = code
+        return code
+
+    def lookup(self, value: Optional[str]) -> Optional[int]:
+        """エンコード済みの値のコード（未知ならNone）"""
+        if value is None:
+            return -1
+        return self.codes.get(value)
+
+    def decode(self, code: int) -> Optional[str]:
+        return None if code < 0 else self.categories[code]
+
+
+class StringColumn:
+    """
+    UTF-8連結バイト列 + オフセット配列で表す文字列列。
+    スナップショットからmmapで開いた場合、各要素はアクセス時に初めてデコードされる。
+    変更・追加分はメモリ上に保持する。
+    """
+
+    def __init__(self, data=None, offsets=None, nulls=None):
+        self._data = data
+        self._offsets = offsets
+        self._nulls = nulls
+        self._base_len = 0 if offsets is None else len(offsets) - 1
+        self._overrides: Dict[int, Optional[str]] = {}
+        self._tail: List[Optional[str]] = []
+
+    def __len__(self):
+        return self._base_len + len(self._tail)
+
+    def __getitem__(self, i: int) -> Optional[str]:
+        if i >= self._base_len:
+            return self._tail[i - self._base_len]
+        if i in self._overrides:
+            return self._overrides[i]
+        if self._nulls is not None and self._nulls[i]:
+            return None
+        return bytes(self._data[self._offsets[i]:self._offsets[i + 1]]).decode("utf-8")
+
+    def __setitem__(self, i: int, value: Optional[str]):
+        if i >= self._base_len:
+            self._tail[i - self._base_len] = value
+        else:
+            self._overrides[i] = value
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, value: Optional[str]):
+        self._tail.append(value)
+
+
+class NodeStore:
+    """
+    ノード属性の列指向ストア。行番号はノード削除後に再利用する。
+    KnowledgeNodeのスキーマ外の属性（priority等）はextraに格納する。
+    """
+
+    FIELDS = ("type", "content", "timestamp", "source", "confidence", "extra")
+
+    def __init__(self, initial_capacity: int = 1024):
+        self.id_to_row: Dict[str, int] = {}
+        self.row_to_id: List[Optional[str]] = []
+        self._free: List[int] = []
+        self.types = Categorical()
+        self.sources = Categorical()
+        capacity = max(1, initial_capacity)
+        self.type_codes = np.full(capacity, -1, dtype=np.int16)
+        self.source_codes = np.full(capacity, -1, dtype=np.int32)
+        self.confidence = np.full(capacity, np.nan, dtype=np.float64)
+        self.content = StringColumn()
+        self.timestamp = StringColumn()
+        self.extra: Dict[int, Dict[str, Any]] = {}
+
+    def __len__(self):
+        return len(self.id_to_row)
+
+    def __contains__(self, node_id):
+        return node_id in self.id_to_row
+
+    def __iter__(self):
+        return iter(self.id_to_row)
+
+    def _ensure_capacity(self, n: int):
+        capacity = self.type_codes.shape[0]
+        if n <= capacity:
+            return
+        capacity = max(1, capacity)
+        while capacity < n:
+            capacity *= 2
+        for name, fill in (("type_codes", -1), ("source_codes", -1), ("confidence", np.nan)):
+            old = getattr(self, name)
+            grown = np.full(capacity, fill, dtype=old.dtype)
+            grown[:old.shape[0]] = old
+            setattr(self, name, grown)
+
+    def _alloc_row(self, node_id: str) -> int:
+        row = self.id_to_row.get(node_id)
+        if row is not None:
+            return row
+        if self._free:
+            row = self._free.pop()
+            self.row_to_id[row] = node_id
+        else:
+            row = len(self.row_to_id)
+            self._ensure_capacity(row + 1)
+            self.row_to_id.append(node_id)
+            self.content.append(None)
+            self.timestamp.append(None)
+        self.id_to_row[node_id] = row
+        return row
+
+    def _set(self, row: int, field: str, value):
+        if field == "type":
+            self.type_codes[row] = self.types.encode(value)
+        elif field == "source":
+            self.source_codes[row] = self.sources.encode(value)
+        elif field == "confidence":
+            self.confidence[row] = np.nan if value is None else value
+        elif field == "content":
+            self.content[row] = value
+        elif field == "timestamp":
+            self.timestamp[row] = value
+        elif field == "extra":
+            if value:
+                self.extra[row] = dict(value)
+            else:
+                self.extra.pop(row, None)
+        else:
+            self.extra.setdefault(row, {})[field] = value
+
+    def add(self, node) -> int:
+        """KnowledgeNodeを格納する（既存IDなら上書き）。embeddingは格納しない。"""
+        row = self._alloc_row(node.id)
+        for field in self.FIELDS:
+            self._set(row, field, getattr(node, field))
+        return row
+
+    def add_many(self, nodes: Iterable) -> List[int]:
+        return [self.add(node) for node in nodes]
+
+    def update(self, node_id: str, **updates):
+        row = self.id_to_row[node_id]
+        for field, value in updates.items():
+            if field in ("id", "embedding"):
+                continue
+            self._set(row, field, value)
+
+    def remove(self, node_id: str) -> bool:
+        row = self.id_to_row.pop(node_id, None)
+        if row is None:
+            return False
+        self.row_to_id[row] = None
+        self.type_codes[row] = -1
+        self.source_codes[row] = -1
+        self.confidence[row] = np.nan
+        self.content[row] = None
+        self.timestamp[row] = None
+        self.extra.pop(row, None)
+        self._free.append(row)
+        return True
+
+    def get_field(self, node_id: str, field: str):
+        row = self.id_to_row[node_id]
+        if field == "id":
+            return node_id
+        if field == "type":
+            return self.types.decode(int(self.type_codes[row]))
+        if field == "source":
+            return self.sources.decode(int(self.source_codes[row]))
+        if field == "confidence":
+            value = self.confidence[row]
+            return None if np.isnan(value) else float(value)
+        if field == "content":
+            return self.content[row]
+        if field == "timestamp":
+            return self.timestamp[row]
+        if field == "extra":
+            return self.extra.get(row)
+        return (self.extra.get(row) or {}).get(field)
+
+    def to_dict(self, node_id: str) -> Dict[str, Any]:
+        data = {"id": node_id}
+        for field in self.FIELDS:
+            data[field] = self.get_field(node_id, field)
+        if data["extra"] is not None:
+            data["extra"] = dict(data["extra"])
+        return data
+
+    def ids_of_type(self, node_type: str) -> List[str]:
+        code = self.types.lookup(node_type)
+        if code is None:
+            return []
+        rows = np.flatnonzero(self.type_codes[:len(self.row_to_id)] == code)
+        return [self.row_to_id[r] for r in rows]
+
+    def state(self) -> dict:
+        """スナップショット保存用の状態（削除済みの行は詰める）"""
+        rows = [self.id_to_row[node_id] for node_id in self.id_to_row]
+        idx = np.asarray(rows, dtype=np.int64)
+        return {
+            "arrays": {
+                "type_codes": self.type_codes[idx],
+                "source_codes": self.source_codes[idx],
+                "confidence": self.confidence[idx],
+            },
+            "strings": {
+                "content": [self.content[r] for r in rows],
+                "timestamp": [self.timestamp[r] for r in rows],
+            },
+            "names": {"ids": list(self.id_to_row)},
+            "meta": {
+                "types": self.types.categories,
+                "sources": self.sources.categories,
+                "extra": {str(i): self.extra[r] for i, r in enumerate(rows) if r in self.extra},
+            },
+        }
+
+    @classmethod
+    def from_state(cls, state: dict):
+        store = cls(initial_capacity=1)
+        arrays, meta = state["arrays"], state["meta"]
+        store.row_to_id = list(state["names"]["ids"])
+        store.id_to_row = {node_id: i for i, node_id in enumerate(store.row_to_id)}
+        store.type_codes = np.array(arrays["type_codes"], dtype=np.int16)
+        store.source_codes = np.array(arrays["source_codes"], dtype=np.int32)
+        store.confidence = np.array(arrays["confidence"], dtype=np.float64)
+        store.content = state["strings"]["content"]
+        store.timestamp = state["strings"]["timestamp"]
+        for name in meta["types"]:
+            store.types.encode(name)
+        for name in meta["sources"]:
+            store.sources.encode(name)
+        store.extra = {int(i): value for i, value in meta["extra"].items()}
+        return store
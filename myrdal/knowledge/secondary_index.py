@@ -0,0 +1,137 @@
+# ノード属性の二次索引
+# type/source: 値 -> IDの集合、confidence/timestamp/priority: (値, ID)のソート済みリスト
+
+import bisect
+from collections import defaultdict
+from operator import itemgetter
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+
+_first = itemgetter(0)
+
+
+class SortedIndex:
+    """(値, ID)をソート順に保持し、範囲検索を二分探索で行う"""
+
+    def __init__(self, items: Iterable[Tuple[Any, str]] = ()):
+        self._items: List[Tuple[Any, str]] = sorted(items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def insert(self, value, node_id: str):
+        bisect.insort(self._items, (value, node_id))
+
+    def discard(self, value, node_id: str):
+        i = bisect.bisect_left(self._items, (value, node_id))
+        if i < len(self._items) and self._items[i] == (value, node_id):
+            del self._items[i]
+
+    def range(self, lo=None, hi=None) -> List[str]:
+        """lo <= 値 <= hi のIDを値の昇順で返す（Noneは上限/下限なし）"""
+        start = 0 if lo is None else bisect.bisect_left(self._items, lo, key=_first)
+        end = len(self._items) if hi is None else bisect.bisect_right(self._items, hi, key=_first)
+        return [node_id for _, node_id in self._items[start:end]]
+
+    def items(self, reverse: bool = False) -> List[Tuple[Any, str]]:
+        return list(reversed(self._items)) if reverse else list(self._items)
+
+    def shift_above(self, threshold, delta) -> List[Tuple[str, Any]]:
+        """値がthresholdより大きい要素すべてにdeltaを加える（順序は変わらない）。変更した(ID, 新しい値)を返す。"""
+        start = bisect.bisect_right(self._items, threshold, key=_first)
+        shifted = [(value + delta, node_id) for value, node_id in self._items[start:]]
+        self._items[start:] = shifted
+        return [(node_id, value) for value, node_id in shifted]
+
+
+class SecondaryIndexes:
+    """
+    ノード属性の二次索引。add/set/removeで常にノードストアと整合させる。
+    """
+
+    CATEGORICAL = ("type", "source")
+    SORTED = ("confidence", "timestamp", "priority")
+    FIELDS = CATEGORICAL + SORTED
+
+    def __init__(self):
+        self.categorical: Dict[str, Dict[Any, Set[str]]] = {f: defaultdict(set) for f in self.CATEGORICAL}
+        self.sorted: Dict[str, SortedIndex] = {f: SortedIndex() for f in self.SORTED}
+        # 現在の索引値（更新時に古い値を取り除くため）
+        self._values: Dict[str, Dict[str, Any]] = {f: {} for f in self.FIELDS}
+
+    def set(self, node_id: str, field: str, value):
+        if field not in self._values:
+            return
+        values = self._values[field]
+        old = values.pop(node_id, None)
+        if old is not None:
+            if field in self.categorical:
+                bucket = self.categorical[field][old]
+                bucket.discard(node_id)
+                if not bucket:
+                    del self.categorical[field][old]
+            else:
+                self.sorted[field].discard(old, node_id)
+        if value is None:
+            return
+        values[node_id] = value
+        if field in self.categorical:
+            self.categorical[field][value].add(node_id)
+        else:
+            self.sorted[field].insert(value, node_id)
+
+    def get(self, node_id: str, field: str):
+        return self._values[field].get(node_id)
+
+    def add(self, node_id: str, fields: Dict[str, Any]):
+        for field in self.FIELDS:
+            self.set(node_id, field, fields.get(field))
+
+    def remove(self, node_id: str):
+        for field in self.FIELDS:
+            self.set(node_id, field, None)
+
+    def ids_with(self, field: str, value) -> Set[str]:
+        return self.categorical[field].get(value, set())
+
+    def ids_in_range(self, field: str, lo=None, hi=None) -> List[str]:
+        return self.sorted[field].range(lo, hi)
+
+    def shift_priorities(self, after_priority: int, delta: int = 1) -> List[Tuple[str, int]]:
+        """priorityがafter_priorityより大きいノードをdeltaずらす。変更した(ID, 新しいpriority)を返す。"""
+        changed = self.sorted["priority"].shift_above(after_priority, delta)
+        values = self._values["priority"]
+        for node_id, value in changed:
+            values[node_id] = value
+        return changed
+
+    @classmethod
+    def from_store(cls, store) -> "SecondaryIndexes":
+        """ノードストアの列から一括構築する（スナップショット読み込み後の初回参照時に使う）"""
+        indexes = cls()
+        n = len(store.row_to_id)
+        rows = np.asarray([store.id_to_row[i] for i in store.id_to_row], dtype=np.int64)
+        ids = np.asarray(list(store.id_to_row), dtype=object)
+        for field, codes, table in (("type", store.type_codes, store.types), ("source", store.source_codes, store.sources)):
+            col = codes[:n][rows] if len(rows) else np.empty(0, dtype=np.int64)
+            for code in np.unique(col):
+                if code < 0:
+                    continue
+                members = ids[col == code].tolist()
+                indexes.categorical[field][table.decode(int(code))] = set(members)
+                indexes._values[field].update(dict.fromkeys(members, table.decode(int(code))))
+        conf = store.confidence[:n][rows] if len(rows) else np.empty(0)
+        mask = ~np.isnan(conf)
+        pairs = list(zip(conf[mask].tolist(), ids[mask].tolist()))
+        indexes.sorted["confidence"] = SortedIndex(pairs)
+        indexes._values["confidence"] = {node_id: value for value, node_id in pairs}
+        stamps = [(store.timestamp[r], node_id) for node_id, r in store.id_to_row.items()]
+        stamps = [(t, node_id) for t, node_id in stamps if t is not None]
+        indexes.sorted["timestamp"] = SortedIndex(stamps)
+        indexes._values["timestamp"] = {node_id: t for t, node_id in stamps}
+        priorities = [(extra["priority"], store.row_to_id[r]) for r, extra in store.extra.items()
+                      if extra.get("priority") is not None and store.row_to_id[r] is not None]
+        indexes.sorted["priority"] = SortedIndex(priorities)
+        indexes._values["priority"] = {node_id: p for p, node_id in priorities}
+        return indexes
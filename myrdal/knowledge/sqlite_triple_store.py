@@ -0,0 +1,152 @@
+# ディスク上のSQLiteファイルに三つ組を保持するKnowledgeGraphの代替バックエンド
+# - triples(s, p, o)を主キー(SPO)とし、POS/OSPの被覆索引で任意の束縛パターンを索引のみで解決する
+# - WALモード、add_factはバッファしてbatch_size件ごとに1トランザクションで書き込む
+# - queryは結果をfetch_size件ずつ読み出す非同期ジェネレータ（awaitすれば従来通りリストを返す）
+
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Iterable, List, Optional, Tuple
+
+Triple = Tuple[Any, Any, Any]
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS triples (s NOT NULL, p NOT NULL, o NOT NULL, PRIMARY KEY (s, p, o)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS triples_pos ON triples (p, o, s)",
+    "CREATE INDEX IF NOT EXISTS triples_osp ON triples (o, s, p)",
+)
+
+
+def _where(subject, predicate, obj) -> Tuple[str, list]:
+    clauses, params = [], []
+    for column, value in (("s", subject), ("p", predicate), ("o", obj)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+class QueryResult:
+    """
+    queryの戻り値。async forで逐次読み出すか、awaitして全件のリストを得る。
+    """
+
+    def __init__(self, store: "SQLiteKnowledgeGraph", sql: str, params: list):
+        self._store = store
+        self._sql = sql
+        self._params = params
+
+    def __aiter__(self) -> AsyncIterator[Triple]:
+        return self._iterate()
+
+    async def _iterate(self):
+        store = self._store
+        await store.flush()
+        cursor = await store._run(store._read.execute, self._sql, self._params)
+        try:
+            while True:
+                rows = await store._run(cursor.fetchmany, store.fetch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield row
+        finally:
+            await store._run(cursor.close)
+
+    async def _collect(self) -> List[Triple]:
+        return [row async for row in self]
+
+    def __await__(self):
+        return self._collect().__await__()
+
+
+class SQLiteKnowledgeGraph:
+    """
+    KnowledgeGraphと同じ非同期インターフェース（add_fact/query/delete_fact）を持つSQLiteバックエンド。
+    接続は専用スレッド1本で扱い、イベントループを塞がない。読み出しは書き込みと別の接続で行う（WALにより並行可能）。
+    """
+
+    def __init__(self, path: str = "knowledge_graph.db", batch_size: int = 1000, fetch_size: int = 500):
+        self.path = path
+        self.batch_size = batch_size
+        self.fetch_size = fetch_size
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._write: Optional[sqlite3.Connection] = None
+        self._read: Optional[sqlite3.Connection] = None
+        self._pending: List[Triple] = []
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self):
+        self._write = sqlite3.connect(self.path, check_same_thread=False)
+        self._write.execute("PRAGMA journal_mode=WAL")
+        self._write.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._write.execute(statement)
+        self._write.commit()
+        self._read = sqlite3.connect(self.path, check_same_thread=False)
+
+    async def open(self):
+        if self._write is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-kg")
+            await self._run(self._connect)
+        return self
+
+    async def close(self):
+        if self._write is None:
+            return
+        await self.flush()
+        await self._run(self._read.close)
+        await self._run(self._write.close)
+        self._write = self._read = None
+        self._executor.shutdown(wait=False)
+        self._executor = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _insert(self, triples: List[Triple]):
+        with self._write:
+            self._write.executemany("INSERT OR IGNORE INTO triples (s, p, o) VALUES (?, ?, ?)", triples)
+
+    async def flush(self):
+        """バッファ中の三つ組を1トランザクションで書き込む"""
+        await self.open()
+        if self._pending:
+            pending, self._pending = self._pending, []
+            await self._run(self._insert, pending)
+
+    async def add_fact(self, subject, predicate, obj):
+        await self.open()
+        self._pending.append((subject, predicate, obj))
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+
+    async def add_facts(self, triples: Iterable[Triple]):
+        """三つ組の列をbatch_size件ずつのトランザクションで書き込む"""
+        for triple in triples:
+            await self.add_fact(*triple)
+        await self.flush()
+
+    def query(self, subject=None, predicate=None, obj=None) -> QueryResult:
+        where, params = _where(subject, predicate, obj)
+        return QueryResult(self, "SELECT s, p, o FROM triples" + where, params)
+
+    async def count(self, subject=None, predicate=None, obj=None) -> int:
+        await self.flush()
+        where, params = _where(subject, predicate, obj)
+        cursor = await self._run(self._read.execute, "SELECT COUNT(*) FROM triples" + where, params)
+        return (await self._run(cursor.fetchone))[0]
+
+    def _delete(self, triple: Triple) -> int:
+        with self._write:
+            return self._write.execute("DELETE FROM triples WHERE s = ? AND p = ? AND o = ?", triple).rowcount
+
+    async def delete_fact(self, subject, predicate, obj):
+        await self.flush()
+        if not await self._run(self._delete, (subject, predicate, obj)):
+            raise KeyError(f"No such fact: ({subject}, {predicate}, {obj})")
@@ -0,0 +1,119 @@
+# WorldModelNexusのトークン計測
+# TokenCounter: ローカルのトークナイザ（tiktoken、なければ文字数からの概算）でメッセージのトークン数を数える
+# UsageLedger: 1リクエスト内の内部LLM呼び出しの使用量をステップ別に集計する
+
+import json
+from collections import OrderedDict
+
+from autogen_core.models import RequestUsage
+
+from myrdal.utils.tokens import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:  # 通常はautogen-ext[openai]の依存として入っている
+    tiktoken = None
+
+
+def _load_encoding(name: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception:
+        # 語彙ファイルを取得できない環境（オフラインなど）では概算に切り替える
+        return None
+
+
+def _content_text(message) -> str:
+    content = message.get("content", "") if isinstance(message, dict) else getattr(message, "content", "")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return " ".join(part if isinstance(part, str) else str(part) for part in content)
+    return str(content)
+
+
+def _tool_text(tool) -> str:
+    return json.dumps(getattr(tool, "schema", tool), ensure_ascii=False, default=str)
+
+
+class TokenCounter:
+    """
+    メッセージ列のトークン数を数える。同じ文字列を何度も数えないよう、結果をcache_size件までLRUで保持する
+    （熟考ループでは固定の指示や会話メッセージが毎ステップ繰り返し送られるため、ほとんどがキャッシュに当たる）。
+    exactがFalseのときは文字数からの概算（estimate_tokens）。
+    """
+
+    MESSAGE_OVERHEAD = 4  # 1メッセージあたりの役割・区切りの分
+    REPLY_OVERHEAD = 3  # 応答の書き出しの分
+
+    def __init__(self, encoding: str = "cl100k_base", cache_size: int = 4096):
+        self.encoding_name = encoding
+        self.cache_size = cache_size
+        self._encoding = _load_encoding(encoding)
+        self._cache = OrderedDict()  # 文字列 -> トークン数
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def exact(self) -> bool:
+        return self._encoding is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        cached = self._cache.get(text)
+        if cached is not None:
+            self._cache.move_to_end(text)
+            self.hits += 1
+            return cached
+        self.misses += 1
+        if self._encoding is not None:
+            tokens = len(self._encoding.encode(text, disallowed_special=()))
+        else:
+            tokens = estimate_tokens(text)
+        if self.cache_size > 0:
+            self._cache[text] = tokens
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def count_messages(self, messages, tools=()) -> int:
+        total = sum(self.MESSAGE_OVERHEAD + self.count(_content_text(m)) for m in messages)
+        total += sum(self.count(_tool_text(tool)) for tool in tools or ())
+        return total + self.REPLY_OVERHEAD if messages else total
+
+
+class UsageLedger:
+    """
+    1リクエスト分の内部LLM呼び出しの使用量。ステップごとに、呼び出し回数（リトライ込み）と
+    トークン数、内部クライアントが使用量を報告せず概算したかどうかを持つ。
+    """
+
+    def __init__(self):
+        self.steps = {}  # ステップ番号 -> {"prompt_tokens", "completion_tokens", "calls", "estimated"}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.calls = 0
+
+    def record(self, step: int, prompt_tokens: int, completion_tokens: int, estimated: bool = False) -> dict:
+        entry = self.steps.setdefault(step, {"prompt_tokens": 0, "completion_tokens": 0, "calls": 0, "estimated": False})
+        entry["prompt_tokens"] += prompt_tokens
+        entry["completion_tokens"] += completion_tokens
+        entry["calls"] += 1
+        entry["estimated"] = entry["estimated"] or estimated
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.calls += 1
+        return entry
+
+    def step(self, step: int) -> dict:
+        return dict(self.steps.get(step, {"prompt_tokens": 0, "completion_tokens": 0, "calls": 0, "estimated": False}))
+
+    def breakdown(self) -> list:
+        """ステップ順の使用量の一覧"""
+        return [{"step": step, **entry} for step, entry in sorted(self.steps.items())]
+
+    def as_usage(self) -> RequestUsage:
+        return RequestUsage(prompt_tokens=self.prompt_tokens, completion_tokens=self.completion_tokens)
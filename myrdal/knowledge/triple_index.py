@@ -0,0 +1,162 @@
+# (主語, 述語, 目的語)の三つ組索引と基本グラフパターン（BGP）の結合
+# SPO: s -> p -> {o}, POS: p -> o -> {s}, OSP: o -> s -> {p} の3通りのハッシュ索引で、
+# どの項が束縛されたパターンも全件走査せずに引ける。
+
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+Triple = Tuple[Any, Any, Any]
+
+
+def is_variable(term) -> bool:
+    """"?x" のように?で始まる文字列を変数とみなす"""
+    return isinstance(term, str) and term.startswith("?")
+
+
+def _nested():
+    return defaultdict(set)
+
+
+class TripleIndex:
+    """SPO/POS/OSP索引。add/removeで3つの索引と各項の出現数を同時に更新する。"""
+
+    def __init__(self):
+        self.spo: Dict[Any, Dict[Any, set]] = defaultdict(_nested)
+        self.pos: Dict[Any, Dict[Any, set]] = defaultdict(_nested)
+        self.osp: Dict[Any, Dict[Any, set]] = defaultdict(_nested)
+        self._counts = (Counter(), Counter(), Counter())  # 主語/述語/目的語ごとの三つ組数
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, triple: Triple):
+        s, p, o = triple
+        return s in self.spo and p in self.spo[s] and o in self.spo[s][p]
+
+    def add(self, s, p, o) -> bool:
+        """三つ組を追加する。既に存在すればFalse。"""
+        if (s, p, o) in self:
+            return False
+        self.spo[s][p].add(o)
+        self.pos[p][o].add(s)
+        self.osp[o][s].add(p)
+        for counter, term in zip(self._counts, (s, p, o)):
+            counter[term] += 1
+        self.size += 1
+        return True
+
+    def remove(self, s, p, o) -> bool:
+        if (s, p, o) not in self:
+            return False
+        for index, a, b, c in ((self.spo, s, p, o), (self.pos, p, o, s), (self.osp, o, s, p)):
+            inner = index[a]
+            inner[b].discard(c)
+            if not inner[b]:
+                del inner[b]
+                if not inner:
+                    del index[a]
+        for counter, term in zip(self._counts, (s, p, o)):
+            counter[term] -= 1
+            if not counter[term]:
+                del counter[term]
+        self.size -= 1
+        return True
+
+    def count(self, s=None, p=None, o=None) -> int:
+        """パターンに一致する三つ組数（Noneは任意）。索引の集合長から定数時間で求める。"""
+        if s is not None and p is not None and o is not None:
+            return int((s, p, o) in self)
+        if s is not None and p is not None:
+            return len(self.spo[s][p]) if s in self.spo and p in self.spo[s] else 0
+        if p is not None and o is not None:
+            return len(self.pos[p][o]) if p in self.pos and o in self.pos[p] else 0
+        if o is not None and s is not None:
+            return len(self.osp[o][s]) if o in self.osp and s in self.osp[o] else 0
+        if s is not None:
+            return self._counts[0].get(s, 0)
+        if p is not None:
+            return self._counts[1].get(p, 0)
+        if o is not None:
+            return self._counts[2].get(o, 0)
+        return self.size
+
+    def match(self, s=None, p=None, o=None) -> Iterator[Triple]:
+        """パターンに一致する三つ組を(s, p, o)で列挙する（Noneは任意）"""
+        if s is not None and p is not None and o is not None:
+            if (s, p, o) in self:
+                yield s, p, o
+        elif s is not None and p is not None:
+            if s in self.spo and p in self.spo[s]:
+                for o2 in self.spo[s][p]:
+                    yield s, p, o2
+        elif p is not None and o is not None:
+            if p in self.pos and o in self.pos[p]:
+                for s2 in self.pos[p][o]:
+                    yield s2, p, o
+        elif o is not None and s is not None:
+            if o in self.osp and s in self.osp[o]:
+                for p2 in self.osp[o][s]:
+                    yield s, p2, o
+        elif s is not None:
+            for p2, objs in self.spo.get(s, {}).items():
+                for o2 in objs:
+                    yield s, p2, o2
+        elif p is not None:
+            for o2, subjs in self.pos.get(p, {}).items():
+                for s2 in subjs:
+                    yield s2, p, o2
+        elif o is not None:
+            for s2, preds in self.osp.get(o, {}).items():
+                for p2 in preds:
+                    yield s2, p2, o
+        else:
+            for s2, inner in self.spo.items():
+                for p2, objs in inner.items():
+                    for o2 in objs:
+                        yield s2, p2, o2
+
+
+def _resolve(pattern: Sequence, binding: Dict[str, Any]) -> Tuple:
+    return tuple(binding.get(t, t) if is_variable(t) else t for t in pattern)
+
+
+def _bound(pattern: Sequence) -> Tuple:
+    return tuple(None if is_variable(t) else t for t in pattern)
+
+
+def _unify(pattern: Sequence, triple: Triple, binding: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    new = None
+    for term, value in zip(pattern, triple):
+        if not is_variable(term):
+            continue
+        current = (new or binding).get(term)
+        if current is None:
+            new = dict(new or binding)
+            new[term] = value
+        elif current != value:
+            # 同じ変数がパターン内に複数回現れて値が食い違う場合
+            return None
+    return new or binding
+
+
+def join_patterns(index: TripleIndex, patterns: Sequence[Sequence], binding: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    基本グラフパターンの結合。patternsは("?x", "is_a", "?y")のような三つ組の列で、全パターンを同時に満たす変数束縛を列挙する。
+    各段階で、現在の束縛を代入したうえで一致件数（index.count）が最小のパターンから展開する。
+    """
+    binding = binding or {}
+    if not patterns:
+        yield dict(binding)
+        return
+    resolved = [_resolve(p, binding) for p in patterns]
+    counts = [index.count(*_bound(p)) for p in resolved]
+    i = min(range(len(resolved)), key=counts.__getitem__)
+    if counts[i] == 0:
+        return
+    pattern = resolved[i]
+    rest = list(patterns[:i]) + list(patterns[i + 1:])
+    for triple in index.match(*_bound(pattern)):
+        extended = _unify(pattern, triple, binding)
+        if extended is not None:
+            yield from join_patterns(index, rest, extended)
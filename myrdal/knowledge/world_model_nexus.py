@@ -1,6 +1,8 @@
 from autogen_core.models import ChatCompletionClient, CreateResult, ModelInfo, RequestUsage, UserMessage, AssistantMessage, SystemMessage
 from typing import Sequence, Mapping, Any, AsyncGenerator
+import asyncio
 import json
+import weakref
 from myrdal.knowledge.abstract_thinking import AbstractThinking
 from myrdal.knowledge.multilingual import MultilingualUnderstanding
 from myrdal.knowledge.explainable_ai import ExplainableAI
@@ -8,9 +10,16 @@ from myrdal.knowledge.social_cognition import SocialCognition
 from myrdal.knowledge.knowledge_integration import KnowledgeIntegration
 from myrdal.reasoning.causal_reasoner import CausalReasoner
 from autogen_agentchat.messages import ThoughtEvent
+from myrdal.knowledge.deliberation_context import DeliberationTranscript
+from myrdal.knowledge.module_cache import ModuleResultCache
+from myrdal.knowledge.deliberation_budget import BudgetTracker, DeliberationBudget
+from myrdal.knowledge.token_accounting import TokenCounter, UsageLedger
 
 class WorldModelNexus(ChatCompletionClient):
-    def __init__(self, chat_client=None, model="myrdal-wmn"):
+    def __init__(self, chat_client=None, model="myrdal-wmn", keep_steps=3, max_summary_chars=2000, max_result_chars=1500,
+                 module_concurrency=4, module_timeout=60.0, module_timeouts=None,
+                 module_cache_size=512, module_cache_ttl=300.0, module_cache_policies=None, default_budget=None,
+                 final_step_grace=5.0, token_limit=128000, tokenizer="cl100k_base"):
         super().__init__()
         # 6つの主要知識モジュールをデフォルトで追加
         self.knowledge_modules = {
@@ -21,6 +30,26 @@ class WorldModelNexus(ChatCompletionClient):
             "causal_reasoner": CausalReasoner(),
         }
         self.client = chat_client  # LLMクライアント
+        # 熟考の文脈圧縮の設定（DeliberationTranscript参照）
+        self.context_options = {"keep_steps": keep_steps, "max_summary_chars": max_summary_chars, "max_result_chars": max_result_chars}
+        # モジュール呼び出しの同時実行数とタイムアウト（秒、Noneで無制限）。module_timeoutsでモジュールごとに上書きできる
+        self.module_concurrency = module_concurrency
+        self.module_timeout = module_timeout
+        self.module_timeouts = dict(module_timeouts or {})
+        # セマフォはイベントループに紐づくため、ループごとに作る（asyncio.runを繰り返しても使える）
+        self._module_semaphores = weakref.WeakKeyDictionary()
+        # モジュール結果のキャッシュ（同じWMNを共有するエージェント間・ターン間でも効く）。module_cache_size=0で無効
+        self.module_cache = ModuleResultCache(module_cache_size, module_cache_ttl, module_cache_policies)
+        # extra_create_argsで指定がないときの予算（DeliberationBudget参照）。既定ではステップ数だけ制限する
+        self.default_budget = {"max_steps": 20, **(default_budget or {})}
+        # deadlineのあるリクエストで、予算切れ後の最終回答のステップに許す猶予（秒）。超えたら直前の思考を回答にする
+        self.final_step_grace = final_step_grace
+        # トークン計測。total_usageは概算込みの累計、actual_usageは内部クライアントが報告した分だけの累計
+        self.token_limit = token_limit
+        self.token_counter = TokenCounter(tokenizer)
+        self._total_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        self._actual_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        self.last_request_usage = None  # 直近のリクエストのUsageLedger
         # 内部状態やキャッシュ、ログ用変数など自由に追加OK
 
     @property
@@ -50,12 +79,13 @@ class WorldModelNexus(ChatCompletionClient):
         extra_create_args: Mapping[str, Any] = {},
         cancellation_token=None,
     ) -> CreateResult:
-        result = await self._run_deliberation_loop(messages, extra_create_args)
+        context = self._request_context(messages, extra_create_args, cancellation_token)
+        result = await self._run_deliberation_loop(context)
         return CreateResult(
             content=result.get("final_answer", ""),
             thought=result.get("thought", ""),
-            usage=RequestUsage(prompt_tokens=0, completion_tokens=0),
-            finish_reason="stop",
+            usage=context["usage"].as_usage(),
+            finish_reason="length" if result.get("budget_exhausted") else "stop",
             cached=False
         )
 
@@ -74,7 +104,8 @@ class WorldModelNexus(ChatCompletionClient):
         """
         step = 1
         final_result = None
-        async for result in self._deliberation_stream(messages, extra_create_args):
+        context = self._request_context(messages, extra_create_args, cancellation_token)
+        async for result in self._deliberation_stream(context):
             # resultが整数値の場合の対策
             if isinstance(result, int):
                 print(f"Warning: result is an integer: {result}")
@@ -95,8 +126,8 @@ class WorldModelNexus(ChatCompletionClient):
             yield CreateResult(
                 content=final_result.get("final_answer", ""),
                 thought=final_result.get("thought", ""),
-                usage=RequestUsage(prompt_tokens=0, completion_tokens=0),
-                finish_reason="stop",
+                usage=context["usage"].as_usage(),
+                finish_reason="length" if final_result.get("budget_exhausted") else "stop",
                 cached=False
             )
 
@@ -104,37 +135,43 @@ class WorldModelNexus(ChatCompletionClient):
         pass
 
     def actual_usage(self) -> RequestUsage:
-        return RequestUsage(prompt_tokens=0, completion_tokens=0)
+        return self._actual_usage
 
-    def count_tokens(self, messages, *args, **kwargs) -> int:
-        return 0
+    def count_tokens(self, messages, *, tools: Sequence = []) -> int:
+        return self.token_counter.count_messages(messages, tools)
 
-    def remaining_tokens(self) -> int:
-        return 10000
+    def remaining_tokens(self, messages, *, tools: Sequence = []) -> int:
+        return max(0, self.token_limit - self.count_tokens(messages, tools=tools))
 
     def total_usage(self) -> RequestUsage:
-        return RequestUsage(prompt_tokens=0, completion_tokens=0)
+        return self._total_usage
 
     # --- ここから下は内部用メソッド ---
-    async def _run_deliberation_loop(self, messages, extra_create_args):
-        context = {"messages": messages, "goal": extra_create_args.get("goal") if extra_create_args else None}
+    def _request_context(self, messages, extra_create_args, cancellation_token=None) -> dict:
+        extra_create_args = extra_create_args or {}
+        return {
+            "messages": messages,
+            "goal": extra_create_args.get("goal"),
+            "budget": BudgetTracker(DeliberationBudget.from_args(extra_create_args, self.default_budget)),
+            "cancellation_token": cancellation_token,
+            "usage": UsageLedger(),
+        }
+
+    async def _run_deliberation_loop(self, context: dict):
         return await self.deliberate(context)
 
-    async def _deliberation_stream(self, messages, extra_create_args):
-        context = {"messages": messages, "goal": extra_create_args.get("goal") if extra_create_args else None}
+    async def _deliberation_stream(self, context: dict):
         async for step in self.deliberate_stream(context):
             print("step:", step)
             yield step
 
     # --- Verifier向け知識管理API ---
+    # priorityは知識グラフ側のソート済み索引で管理する
     def set_priority(self, knowledge_graph, node_id: str, priority: int):
-        knowledge_graph.graph.nodes[node_id]['priority'] = priority
+        knowledge_graph.set_priority(node_id, priority)
 
     def insert_priority(self, knowledge_graph, node_id: str, after_priority: int):
-        for n, d in knowledge_graph.graph.nodes(data=True):
-            if d.get('priority', 0) > after_priority:
-                d['priority'] += 1
-        knowledge_graph.graph.nodes[node_id]['priority'] = after_priority + 1
+        knowledge_graph.insert_priority(node_id, after_priority)
 
     def merge_nodes(self, knowledge_graph, node_ids: list, new_content: str, **kwargs):
         new_id = knowledge_graph.add_fact(new_content, **kwargs)
@@ -143,7 +180,8 @@ class WorldModelNexus(ChatCompletionClient):
         return new_id
 
     def remove_nodes(self, knowledge_graph, node_ids: list):
-        knowledge_graph.graph.remove_nodes_from(node_ids)
+        # ベクトル索引も合わせて更新するためグラフ側のAPIで削除する
+        knowledge_graph.remove_nodes(node_ids)
 
     def update_from_llm_decision(self, knowledge_graph, llm_decision: dict):
         """
@@ -181,154 +219,283 @@ class WorldModelNexus(ChatCompletionClient):
                 return SystemMessage(content=msg["content"])
         raise ValueError(f"Unknown message type: {type(msg)}")
 
-    async def deliberate(self, context: dict) -> dict:
+    # --- 熟考ループ ---
+    MODULE_DESCRIPTIONS = {
+        "abstract_thinking": "for abstraction, analogy, and high-level reasoning.",
+        "multilingual": "for multilingual understanding and translation.",
+        "social_cognition": "for social reasoning and theory of mind.",
+        "knowledge_integration": "for integrating and synthesizing knowledge.",
+        "causal_reasoner": "for causal inference and reasoning.",
+    }
+    RESPONSE_SCHEMA = {
+        "type": "object",
+        "properties": {
+            "thought": {"type": "string"},
+            "call_module": {"type": ["string", "null"]},
+            "call_args": {"type": "object"},
+            "satisfied": {"type": "boolean"},
+            "final_answer": {"type": ["string", "null"]}
+        },
+        "required": ["thought", "satisfied"]
+    }
+    MAX_RETRY = 3
+    # 省略されたモジュール結果の全体を読むための疑似モジュール（DeliberationTranscript.read）
+    RESULT_READER = "read_result"
+
+    def _instructions(self, goal) -> str:
+        # 固定の指示。文脈の先頭に1回だけ置く
+        modules = "".join(
+            f"- {name}: {self.MODULE_DESCRIPTIONS.get(name, 'knowledge module.')}\n" for name in self.knowledge_modules
+        )
+        return (
+            f"You are a metacognitive world model AI.\n"
+            f"Goal: {goal}\n"
+            f"You can use the following knowledge modules:\n"
+            f"{modules}"
+            f"- {self.RESULT_READER}: to read an abbreviated result shown as [handle rN, ...] in the scratchpad, "
+            f"with call_args {{'handle': 'rN', 'offset': <character offset, 0 first>}}; it returns the next part and next_offset.\n"
+            f"At each step, think step by step. Output your thought, which knowledge module to call (if any), call_args, satisfied (true/false), and final_answer if satisfied.\n"
+            f"Output in JSON: {{'thought': ..., 'call_module': ..., 'call_args': ..., 'satisfied': ..., 'final_answer': ...}}"
+        )
+
+    def _step_prompt(self, step: int) -> str:
+        return f"Step {step}: continue the deliberation and output the JSON for this step."
+
+    def _final_prompt(self, step: int, reason: str) -> str:
+        return (
+            f"Step {step}: the deliberation budget is exhausted ({reason}). Do not call any module. "
+            f"Give your best final answer now with what you already know: output the JSON with satisfied=true and final_answer."
+        )
+
+    def _parse(self, content) -> dict:
+        try:
+            parsed = content if isinstance(content, dict) else json.loads(content)
+        except Exception:
+            parsed = None
+        if not isinstance(parsed, dict):
+            parsed = {"thought": content if isinstance(content, str) else str(content), "call_module": None, "call_args": {}, "satisfied": False, "final_answer": None}
+        parsed.setdefault("call_module", None)
+        parsed.setdefault("satisfied", False)
+        return parsed
+
+    async def _complete(self, llm_messages, extra_create_args, stream: bool, cancellation_token=None):
         """
-        熟考・メタ認知推論のメインメソッド。
-        context: {"messages": ..., "goal": ...}
-        knowledge_modulesを活用しながら熟考ループを回し、最終的な推論・知識統合・自己評価を返す。
+        内部LLMを1回呼び出し、(応答本文, usage)を返す（ストリーミング時はチャンクを連結し、最終のCreateResultを優先）。
+        usageは内部クライアントが報告しなかった場合None。
+        """
+        kwargs = {"cancellation_token": cancellation_token} if cancellation_token is not None else {}
+        if not stream:
+            result = await self.client.create(llm_messages, extra_create_args=extra_create_args, **kwargs)
+            return result.content, getattr(result, "usage", None)
+        parts, final, usage = [], None, None
+        async for chunk in self.client.create_stream(llm_messages, extra_create_args=extra_create_args, **kwargs):
+            if isinstance(chunk, CreateResult):
+                final, usage = chunk.content, chunk.usage
+            elif isinstance(chunk, dict):
+                final = chunk
+            elif isinstance(chunk, str):
+                parts.append(chunk)
+        return (final if final is not None else "".join(parts)), usage
+
+    def _account(self, context: dict, step: int, llm_messages, content, usage):
+        """内部LLM呼び出し1回分の使用量を、リクエスト・予算・累計に加える（報告がなければ手元で数えて概算）"""
+        estimated = usage is None or (usage.prompt_tokens == 0 and usage.completion_tokens == 0)
+        if estimated:
+            prompt_tokens = self.count_tokens(llm_messages)
+            text = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False, default=str)
+            completion_tokens = self.token_counter.count(text)
+        else:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+            self._actual_usage = RequestUsage(
+                prompt_tokens=self._actual_usage.prompt_tokens + prompt_tokens,
+                completion_tokens=self._actual_usage.completion_tokens + completion_tokens,
+            )
+        self._total_usage = RequestUsage(
+            prompt_tokens=self._total_usage.prompt_tokens + prompt_tokens,
+            completion_tokens=self._total_usage.completion_tokens + completion_tokens,
+        )
+        context["usage"].record(step, prompt_tokens, completion_tokens, estimated)
+        context["budget"].add_usage(prompt_tokens, completion_tokens)
+
+    async def _model_step(self, llm_messages, stream: bool, context: dict, step: int):
+        extra_create_args = {"response_format": {"type": "json_schema", "schema": self.RESPONSE_SCHEMA}}
+        for _ in range(self.MAX_RETRY):
+            content, usage = await self._complete(llm_messages, extra_create_args, stream, context.get("cancellation_token"))
+            self._account(context, step, llm_messages, content, usage)
+            parsed = self._parse(content)
+            if isinstance(parsed.get("call_args", {}), dict):
+                parsed["usage"] = context["usage"].step(step)
+                return parsed
+            # 今回の再試行にのみ注意書きを加える（文脈には残さない）
+            llm_messages = llm_messages + [SystemMessage(
+                content="call_args must always be an object (dictionary). Please output call_args as a JSON object, not a string or array."
+            )]
+        return None
+
+    def _module_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._module_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._module_semaphores[loop] = asyncio.Semaphore(self.module_concurrency)
+        return semaphore
+
+    async def _invoke_module(self, module_name: str, call_args: dict, remaining_time=None, transcript=None):
+        """
+        モジュールを同時実行数の上限・タイムアウト付きで呼び出す（remaining_timeはリクエストの残り時間）。
+        失敗・タイムアウトは例外にせず{"error": ...}を結果として返す（他のモジュールの結果は活かす）。
+        """
+        if module_name == self.RESULT_READER:
+            if transcript is None:
+                return {"error": "no abbreviated results to read"}
+            return transcript.read(call_args.get("handle"), call_args.get("offset", 0))
+        timeout = self.module_timeouts.get(module_name, self.module_timeout)
+        if remaining_time is not None:
+            timeout = remaining_time if timeout is None else min(timeout, remaining_time)
+        module = self.knowledge_modules[module_name]
+        async with self._module_semaphore():
+            try:
+                return await asyncio.wait_for(self.module_cache.call(module_name, call_args, module), timeout)
+            except asyncio.TimeoutError:
+                return {"error": f"{module_name} timed out after {timeout}s"}
+            except Exception as e:
+                return {"error": f"{module_name} failed: {e!r}"}
+
+    @staticmethod
+    def _check_cancelled(cancellation_token):
+        if cancellation_token is not None and cancellation_token.is_cancelled():
+            raise asyncio.CancelledError("deliberation cancelled")
+
+    @staticmethod
+    async def _cancellable(awaitable, cancellation_token):
+        if cancellation_token is None:
+            return await awaitable
+        return await cancellation_token.link_future(asyncio.ensure_future(awaitable))
+
+    def _callable_module(self, name) -> bool:
+        return name in self.knowledge_modules or name == self.RESULT_READER
+
+    async def _call_modules(self, parsed: dict, budget=None, cancellation_token=None, transcript=None):
+        if not parsed.get("call_module"):
+            return
+        if isinstance(parsed["call_module"], list):
+            calls = [
+                (module_call.get("module"), module_call.get("args", {}) or {})
+                for module_call in parsed["call_module"]
+                if isinstance(module_call, dict) and self._callable_module(module_call.get("module"))
+            ]
+        elif isinstance(parsed["call_module"], str) and self._callable_module(parsed["call_module"]):
+            calls = [(parsed["call_module"], parsed.get("call_args", {}) or {})]
+        else:
+            return
+        allowance = budget.remaining_module_calls() if budget is not None else None
+        if allowance is not None:
+            # 予算を超える分は呼ばない（次のステップで最終回答を促す）。結果の読み出しは数えない
+            kept, skipped = [], []
+            for name, args in calls:
+                if name != self.RESULT_READER:
+                    if allowance == 0:
+                        skipped.append(name)
+                        continue
+                    allowance -= 1
+                kept.append((name, args))
+            if skipped:
+                parsed["skipped_modules"] = skipped
+            calls = kept
+        if not calls:
+            return
+        if budget is not None:
+            budget.module_calls += sum(1 for name, _ in calls if name != self.RESULT_READER)
+        remaining_time = budget.remaining_time() if budget is not None else None
+        # 互いに独立な呼び出しなので並行に実行する（ステップの待ち時間は最も遅いモジュール分になる）
+        results = await self._cancellable(
+            asyncio.gather(*(self._invoke_module(name, args, remaining_time, transcript) for name, args in calls)),
+            cancellation_token,
+        )
+        if isinstance(parsed["call_module"], list):
+            parsed["module_result"] = [{name: result} for (name, _), result in zip(calls, results)]
+        else:
+            parsed["module_result"] = results[0]
+
+    async def _final_step(self, transcript, step: int, reason: str, stream: bool, context: dict) -> dict:
+        """予算切れ時に、モジュールを呼ばずに最終回答を出させる"""
+        remaining_time = context["budget"].remaining_time()
+        try:
+            parsed = await asyncio.wait_for(
+                self._model_step(transcript.render(self._final_prompt(step, reason), self._to_llm_message), stream, context, step),
+                None if remaining_time is None else remaining_time + self.final_step_grace,
+            )
+        except asyncio.TimeoutError:
+            parsed = None
+        if parsed is None:
+            # 最終回答を得られなかったので、直前のステップの思考を回答にする
+            last = transcript.recent[-1][1] if transcript.recent else {}
+            parsed = {"thought": last.get("thought", ""), "call_args": {}, "final_answer": None, "usage": context["usage"].step(step)}
+        parsed["call_module"] = None
+        if not parsed.get("final_answer"):
+            parsed["final_answer"] = parsed.get("thought", "")
+        parsed["satisfied"] = True
+        parsed["budget_exhausted"] = reason
+        context["budget"].steps += 1
+        transcript.record(step, parsed)
+        return parsed
+
+    async def _deliberation_steps(self, context: dict, stream: bool):
+        """
+        deliberate/deliberate_streamの共通ループ。各ステップの結果（module_result込み）をyieldする。
+        LLMへ送る文脈はDeliberationTranscriptで圧縮し、ステップ数に関係なく一定の大きさに保つ。
         """
-        messages = context["messages"]
-        goal = context.get("goal", "")
+        transcript = DeliberationTranscript(context["messages"], self._instructions(context.get("goal", "")), **self.context_options)
+        context["transcript"] = transcript
+        budget = context.setdefault("budget", BudgetTracker(DeliberationBudget.from_args(None, self.default_budget)))
+        self.last_request_usage = context.setdefault("usage", UsageLedger())
+        cancellation_token = context.get("cancellation_token")
         step = 1
-        deliberation_messages = list(messages)
-        MAX_RETRY = 3
         while True:
-            prompt = (
-                f"You are a metacognitive world model AI.\n"
-                f"Goal: {goal}\n"
-                f"You can use the following knowledge modules:\n"
-                f"- abstract_thinking: for abstraction, analogy, and high-level reasoning.\n"
-                f"- multilingual: for multilingual understanding and translation.\n"
-                f"- social_cognition: for social reasoning and theory of mind.\n"
-                f"- knowledge_integration: for integrating and synthesizing knowledge.\n"
-                f"- causal_reasoner: for causal inference and reasoning.\n"
-                f"Step {step}: Think step by step. Output your thought, which knowledge module to call (if any), call_args, satisfied (true/false), and final_answer if satisfied.\n"
-                f"Output in JSON: {{'thought': ..., 'call_module': ..., 'call_args': ..., 'satisfied': ..., 'final_answer': ...}}"
-            )
-            deliberation_messages.append({"role": "system", "content": prompt})
-            deliberation_messages_llm = [self._to_llm_message(m) for m in deliberation_messages]
-            response_schema = {
-                "type": "object",
-                "properties": {
-                    "thought": {"type": "string"},
-                    "call_module": {"type": ["string", "null"]},
-                    "call_args": {"type": "object"},
-                    "satisfied": {"type": "boolean"},
-                    "final_answer": {"type": ["string", "null"]}
-                },
-                "required": ["thought", "satisfied"]
-            }
-            retry_count = 0
-            while retry_count < MAX_RETRY:
-                result = await self.client.create(
-                    deliberation_messages_llm,
-                    extra_create_args={"response_format": {"type": "json_schema", "schema": response_schema}}
+            self._check_cancelled(cancellation_token)
+            llm_messages = transcript.render(self._step_prompt(step), self._to_llm_message)
+            # プロンプトトークンの予算は送る前に手元で数えた分も見込んで判定する
+            reason = budget.exhausted(next_prompt_tokens=self.count_tokens(llm_messages))
+            if reason is not None:
+                yield await self._final_step(transcript, step, reason, stream, context)
+                return
+            try:
+                parsed = await asyncio.wait_for(
+                    self._model_step(llm_messages, stream, context, step), budget.remaining_time(),
                 )
-                try:
-                    parsed = result.content if isinstance(result.content, dict) else json.loads(result.content)
-                except Exception:
-                    parsed = {"thought": result.content, "call_module": None, "call_args": {}, "satisfied": False, "final_answer": None}
-                call_args = parsed.get("call_args", {})
-                if not isinstance(call_args, dict):
-                    # system messageで"call_argsは必ずobject型で返すこと"を追加
-                    deliberation_messages.append({
-                        "role": "system",
-                        "content": "call_args must always be an object (dictionary). Please output call_args as a JSON object, not a string or array."
-                    })
-                    deliberation_messages_llm = [self._to_llm_message(m) for m in deliberation_messages]
-                    retry_count += 1
-                    continue
-                break
-            else:
+            except asyncio.TimeoutError:
+                # 期限切れ。次の周回で最終回答のステップに入る
+                continue
+            budget.steps += 1
+            if parsed is None:
                 # 3回リトライしてもダメならエラー返す
-                return {"error": "call_args was not a dictionary after 3 retries."}
-            if parsed["call_module"]:
-                if isinstance(parsed["call_module"], list):
-                    parsed["module_result"] = []
-                    for module_call in parsed["call_module"]:
-                        module_name = module_call.get("module")
-                        call_args = module_call.get("args", {})
-                        if module_name in self.knowledge_modules:
-                            module = self.knowledge_modules[module_name]
-                            module_result = await module(**call_args)
-                            parsed["module_result"].append({module_name: module_result})
-                elif isinstance(parsed["call_module"], str):
-                    if parsed["call_module"] in self.knowledge_modules:
-                        module = self.knowledge_modules[parsed["call_module"]]
-                        module_result = await module(**parsed.get("call_args", {}))
-                        parsed["module_result"] = module_result
+                yield {"error": "call_args was not a dictionary after 3 retries."}
+                return
+            self._check_cancelled(cancellation_token)
+            await self._call_modules(parsed, budget, cancellation_token, transcript)
+            transcript.record(step, parsed)
+            yield parsed
             if parsed["satisfied"]:
-                return parsed
+                return
             step += 1
 
+    async def deliberate(self, context: dict) -> dict:
+        """
+        熟考・メタ認知推論のメインメソッド。
+        context: {"messages": ..., "goal": ..., "budget": BudgetTracker（省略時はdefault_budget）, "cancellation_token": ...,
+                  "usage": UsageLedger（省略時は新規）}
+        knowledge_modulesを活用しながら熟考ループを回し、最終的な推論・知識統合・自己評価を返す。
+        """
+        result = None
+        async for parsed in self._deliberation_steps(context, stream=False):
+            result = parsed
+        # ステップ別のトークン使用量
+        result["usage_breakdown"] = context["usage"].breakdown()
+        return result
+
     async def deliberate_stream(self, context: dict):
         """
         熟考・メタ認知推論のストリーミング版。
         各ステップの思考・知識統合過程をyieldで返す。
         """
-        messages = context["messages"]
-        goal = context.get("goal", "")
-        step = 1
-        deliberation_messages = list(messages)
-        while True:
-            prompt = (
-                f"You are a metacognitive world model AI.\n"
-                f"Goal: {goal}\n"
-                f"You can use the following knowledge modules:\n"
-                f"- abstract_thinking: for abstraction, analogy, and high-level reasoning.\n"
-                f"- multilingual: for multilingual understanding and translation.\n"
-                f"- social_cognition: for social reasoning and theory of mind.\n"
-                f"- knowledge_integration: for integrating and synthesizing knowledge.\n"
-                f"- causal_reasoner: for causal inference and reasoning.\n"
-                f"Step {step}: Think step by step. Output your thought, which knowledge module to call (if any), call_args, satisfied (true/false), and final_answer if satisfied.\n"
-                f"Output in JSON: {{'thought': ..., 'call_module': ..., 'call_args': ..., 'satisfied': ..., 'final_answer': ...}}"
-            )
-            deliberation_messages.append({"role": "system", "content": prompt})
-            # dict→LLMMessage型に変換
-            deliberation_messages_llm = [self._to_llm_message(m) for m in deliberation_messages]
-            response_schema = {
-                "type": "object",
-                "properties": {
-                    "thought": {"type": "string"},
-                    "call_module": {"type": ["string", "null"]},
-                    "call_args": {"type": "object"},
-                    "satisfied": {"type": "boolean"},
-                    "final_answer": {"type": ["string", "null"]}
-                },
-                "required": ["thought", "satisfied"]
-            }
-            async for chunk in self.client.create_stream(
-                deliberation_messages_llm,
-                extra_create_args={"response_format": {"type": "json_schema", "schema": response_schema}}
-            ):
-                try:
-                    parsed = chunk if isinstance(chunk, dict) else json.loads(chunk)
-                except Exception:
-                    parsed = {"thought": chunk, "call_module": None, "call_args": {}, "satisfied": False, "final_answer": None}
-                    
-                # 整数値のチャンクは無視する
-                if isinstance(parsed, int):
-                    print(f"Warning: parsed is an integer: {parsed}")
-                    continue
-                    
-                yield parsed
-                if parsed is not None and parsed.get("call_module"):
-                    if isinstance(parsed["call_module"], list):
-                        parsed["module_result"] = []
-                        for module_call in parsed["call_module"]:
-                            module_name = module_call.get("module")
-                            call_args = module_call.get("args", {})
-                            if module_name in self.knowledge_modules:
-                                module = self.knowledge_modules[module_name]
-                                module_result = await module(**call_args)
-                                parsed["module_result"].append({module_name: module_result})
-                    elif isinstance(parsed["call_module"], str):
-                        if parsed["call_module"] in self.knowledge_modules:
-                            module = self.knowledge_modules[parsed["call_module"]]
-                            module_result = await module(**parsed.get("call_args", {}))
-                            parsed["module_result"] = module_result
-                if parsed is not None and parsed["satisfied"]:
-                    break
-            step += 1
-            # ここで誤って step が yield されないように注意
-            # このブロックでは何もyieldしない 
\ No newline at end of file
+        async for parsed in self._deliberation_steps(context, stream=True):
+            yield parsed
@@ -72,8 +72,10 @@ import os
 
 # --- Myrdal本体 ---
 class Myrdal:
-    def __init__(self):
+    def __init__(self, knowledge_graph: Optional[MultiLayerKnowledgeGraph] = None):
         self.memory_manager = MemoryManager()
+        # 関連記憶の情報源にする知識グラフ（Noneなら短期・長期記憶のみから選ぶ）
+        self.knowledge_graph = knowledge_graph
         self.agents = {}
         self.is_active = False
         self.current_messages = []
@@ -121,7 +123,7 @@ class Myrdal:
         self.agents = [
             MyrdalAssistantAgent(
                 agent_id="myrdal_assistant",
-                memory=[self.memory_manager.get_short_term("myrdal_assistant")],
+                memory=[self.memory_manager.get_memory_provider("myrdal_assistant", knowledge_graph=self.knowledge_graph)],
                 memory_manager=self.memory_manager,
                 model_client=wmn,
                 mcp_tools=mcp_tools,
@@ -129,7 +131,7 @@ class Myrdal:
             ),
             MyrdalAssistantAgent(
                 agent_id="verifier",
-                memory=[self.memory_manager.get_short_term("verifier")],
+                memory=[self.memory_manager.get_memory_provider("verifier", knowledge_graph=self.knowledge_graph)],
                 memory_manager=self.memory_manager,
                 model_client=wmn,
                 system_message="You are a knowledge verifier. Organize, merge, and validate knowledge. Also, Check the user's request is successfully completed and reply 'The conversation is over.' in a sentence.",
@@ -227,10 +229,11 @@ class Myrdal:
         # 必要に応じてcurrent_messagesや状態を復元
 
     def create_agent(self, agent_id: str, **knowledge_modules):
-        short_term = self.memory_manager.get_short_term(agent_id)
+        # 短期記憶のオブジェクトは書き出し（spill）で入れ替わるため、エージェントにはマネージャ経由で
+        # 毎回取得するプロバイダを渡す（memory省略時の既定）
+        knowledge_modules.setdefault("knowledge_graph", self.knowledge_graph)
         agent = MyrdalAssistantAgent(
             agent_id=agent_id,
-            memory=short_term,
             memory_manager=self.memory_manager,
             **knowledge_modules
         )
@@ -1,21 +1,302 @@
 # 長期記憶（例: ChromaDB, SQLite, ファイル永続化など）
 
+import asyncio
+import atexit
+import json
+import logging
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
 import chromadb
 from chromadb.config import Settings
 
+from .query_cache import QueryCache, filter_key
+
+logger = logging.getLogger(__name__)
+
+def _record(data: dict):
+    # data: {"id": str, "text": str, ...} -> (id, text, metadata)
+    # chromadbは空のmetadata dictを受け付けないため、id/text以外の項目がなければNone
+    metadata = {k: v for k, v in data.items() if k not in ("id", "text")}
+    return data["id"], data["text"], metadata or None
+
+def _flush_at_exit(ref):
+    memory = ref()
+    if memory is not None:
+        memory._flush_sync()
+
 class LongTermMemory:
-    def __init__(self, collection_name="myrdal_long_term"):
-        self.client = chromadb.Client(Settings())
-        self.collection = self.client.get_or_create_collection(collection_name)
+    """
+    write_behind=Trueのとき、storeは待ち行列に積むだけで即座に戻り、
+    batch_size件たまるかflush_interval秒経過した時点でまとめてcollection.addする（埋め込み計算も1回にまとまる）。
+    search/deleteの前、flush()、close()、およびプロセス終了時には未書き込み分を必ず書き込む。
+    chromadbの呼び出し（同期API）はmax_concurrencyスレッドの専用プールで実行し、イベントループを塞がない。
+    同じ(query, n_results, where)の検索が実行中（かつその後に書き込みがない）なら、新たに問い合わせずその結果を共有する。
+    検索結果はcache_size件までcache_ttl秒キャッシュし、store/deleteで進む書き込み世代が変われば無効にする（cache_size=0で無効）。
+    pathを指定するとそのディレクトリに永続化する（Noneなら従来通りプロセス内のみ）。
+    コンストラクタで開き、close()で未書き込み分を書き込んで閉じる。open()で開き直せる。
+    """
+    def __init__(self, collection_name="myrdal_long_term", path=None, write_behind=False, batch_size=64, flush_interval=1.0, max_concurrency=4, cache_size=1024, cache_ttl=60.0):
+        self.collection_name = collection_name
+        self.path = path
+        self.max_concurrency = max_concurrency
+        self.client = None
+        self.collection = None
+        self._executor = None
+        self.write_behind = write_behind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = {}  # id -> (id, text, metadata)
+        self._pending_lock = threading.Lock()
+        self._flush_lock = None
+        self._timer = None
+        self._inflight = {}  # (query, n_results, where, 世代) -> 実行中の検索タスク
+        # store/deleteの開始時と完了時に進める。書き込み前に始まった検索とは結果を共有・キャッシュしない
+        self._generation = 0
+        self.cache = QueryCache(max_entries=cache_size, ttl=cache_ttl)
+        atexit.register(_flush_at_exit, weakref.ref(self))
+        self.open()
+
+    @property
+    def is_open(self) -> bool:
+        return self.collection is not None
+
+    def open(self):
+        """クライアントとコレクションを開く（開いていれば何もしない）"""
+        if self.is_open:
+            return self
+        if self.path is None:
+            self.client = chromadb.Client(Settings())
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            self.client = chromadb.PersistentClient(path=self.path)
+        self.collection = self.client.get_or_create_collection(self.collection_name)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="long-term-memory")
+        return self
+
+    async def __aenter__(self):
+        return self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _add(self, records):
+        for i in range(0, len(records), self.batch_size):
+            chunk = records[i:i + self.batch_size]
+            metadatas = [r[2] for r in chunk]
+            self.collection.add(
+                ids=[r[0] for r in chunk],
+                documents=[r[1] for r in chunk],
+                metadatas=metadatas if any(m is not None for m in metadatas) else None,
+            )
+
+    def _take_pending(self):
+        with self._pending_lock:
+            records, self._pending = list(self._pending.values()), {}
+        return records
+
+    def _restore_pending(self, records):
+        # 書き込みに失敗した分を待ち行列へ戻す（その間に積まれた同じIDの新しい記憶を優先する）
+        with self._pending_lock:
+            self._pending = {**{r[0]: r for r in records}, **self._pending}
+
+    def _flush_sync(self):
+        if not self.is_open:
+            return
+        records = self._take_pending()
+        if records:
+            try:
+                self._add(records)
+            except Exception:
+                self._restore_pending(records)
+                raise
+
     async def store(self, data: dict):
-        # data: {"id": str, "text": str, ...}
-        self.collection.add(
-            documents=[data["text"]],
-            ids=[data["id"]],
-            metadatas=[{k: v for k, v in data.items() if k not in ("id", "text")}]
-        )
-    async def search(self, query: str, n_results=3) -> list:
-        results = self.collection.query(query_texts=[query], n_results=n_results)
-        return results.get("documents", [])
+        if not self.write_behind:
+            await self.store_many([data])
+            return
+        record = _record(data)
+        self._generation += 1
+        with self._pending_lock:
+            self._pending[record[0]] = record
+            pending = len(self._pending)
+        if pending >= self.batch_size:
+            await self.flush()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _run(self, func, *args, **kwargs):
+        if not self.is_open:
+            raise RuntimeError("LongTermMemory is closed")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def store_many(self, items):
+        """複数の記憶をbatch_size件ずつまとめて書き込む（埋め込み計算もまとめて行われる）"""
+        records = [_record(data) for data in items]
+        if records:
+            self._generation += 1
+            await self._run(self._add, records)
+            self._generation += 1
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception:
+            # 記憶は待ち行列に残っており、次のflush（search/close等）で再度書き込む
+            logger.exception("Write-behind flush of long-term memory failed")
+
+    async def flush(self):
+        """待ち行列の記憶をすべて書き込み、完了まで待つ"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            records = self._take_pending()
+            if records:
+                write = asyncio.ensure_future(self._run(self._add, records))
+                try:
+                    await asyncio.shield(write)
+                except asyncio.CancelledError:
+                    # 呼び出し側がキャンセルされても実行スレッドでの書き込みは止まらない。
+                    # 結果に応じて待ち行列へ戻すかを決め、書き込みが終わるまではロックを放さない
+                    write.add_done_callback(lambda done: self._settle_write(done, records))
+                    await asyncio.wait([write])
+                    raise
+                except Exception:
+                    self._restore_pending(records)
+                    raise
+                self._generation += 1
+
+    def _settle_write(self, write, records):
+        if write.cancelled():
+            return
+        if write.exception() is not None:
+            self._restore_pending(records)
+        else:
+            self._generation += 1
+
+    async def close(self):
+        """未書き込み分を書き込んでから閉じる（永続化時はこの時点でディスクに反映済み）"""
+        if not self.is_open:
+            return
+        if self._timer is not None and not self._timer.done():
+            self._timer.cancel()
+        await self.flush()
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        self.collection = None
+        self.client = None
+
+    async def _query(self, queries: list, n_results: int, where=None) -> list:
+        await self.flush()
+        generation = self._generation
+        kwargs = {"where": where} if where else {}
+        results = await self._run(self.collection.query, query_texts=queries, n_results=n_results, **kwargs)
+        documents = results.get("documents", [])
+        for query, docs in zip(queries, documents):
+            self.cache.put((query, n_results, filter_key(where)), generation, docs)
+        return documents
+
+    async def search(self, query: str, n_results=3, where=None) -> list:
+        """whereはchromadbのメタデータフィルタ（例: {"agent": "a"}）"""
+        key = (query, n_results, filter_key(where))
+        cached = self.cache.get(key, self._generation)
+        if cached is not None:
+            return [list(cached)]
+        flight = key + (self._generation,)
+        task = self._inflight.get(flight)
+        if task is None:
+            task = asyncio.ensure_future(self._query([query], n_results, where))
+            self._inflight[flight] = task
+            task.add_done_callback(lambda _: self._inflight.pop(flight, None))
+        # 共有中のタスクは、待っている呼び出し元の1つがキャンセルされても止めない
+        return [list(docs) for docs in await asyncio.shield(task)]
+
+    async def search_many(self, queries: list, n_results=3, where=None) -> list:
+        """
+        複数クエリを1回のquery_textsでまとめて検索する。クエリごとの文書リストを入力順に返す。
+        キャッシュにあるクエリは問い合わせない。
+        """
+        if not queries:
+            return []
+        by_query = {}
+        for query in dict.fromkeys(queries):
+            cached = self.cache.get((query, n_results, filter_key(where)), self._generation)
+            if cached is not None:
+                by_query[query] = cached
+        missing = [q for q in dict.fromkeys(queries) if q not in by_query]
+        if missing:
+            by_query.update(zip(missing, await self._query(missing, n_results, where)))
+        return [list(by_query[q]) for q in queries]
+
+    def cache_stats(self) -> dict:
+        """検索キャッシュのヒット数・ミス数・ヒット率・件数"""
+        return self.cache.stats()
+
     async def delete(self, doc_id: str):
-        self.collection.delete(ids=[doc_id]) 
\ No newline at end of file
+        self._generation += 1
+        with self._pending_lock:
+            self._pending.pop(doc_id, None)
+        await self.flush()
+        await self._run(self.collection.delete, ids=[doc_id])
+        self._generation += 1
+
+    # --- エクスポート/インポート（埋め込みを再計算せずにホスト間で移す） ---
+    # ディレクトリ構成: records.jsonl（id, text, metadata）、embeddings.f32（float32の行列）、meta.json（次元・件数）
+
+    def _export(self, path: str, page_size: int) -> int:
+        os.makedirs(path, exist_ok=True)
+        count, dim = 0, None
+        with open(os.path.join(path, "records.jsonl"), "w", encoding="utf-8") as records, \
+                open(os.path.join(path, "embeddings.f32"), "wb") as embeddings:
+            while True:
+                page = self.collection.get(include=["documents", "metadatas", "embeddings"], limit=page_size, offset=count)
+                if not page["ids"]:
+                    break
+                vecs = np.asarray(page["embeddings"], dtype=np.float32)
+                dim = vecs.shape[1]
+                vecs.tofile(embeddings)
+                for doc_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                    records.write(json.dumps({"id": doc_id, "text": text, "metadata": metadata}, ensure_ascii=False) + "\n")
+                count += len(page["ids"])
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"collection": self.collection_name, "count": count, "dim": dim}, f)
+        return count
+
+    def _import(self, path: str, page_size: int) -> int:
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if not meta["count"]:
+            return 0
+        vecs = np.memmap(os.path.join(path, "embeddings.f32"), dtype=np.float32, mode="r").reshape(meta["count"], meta["dim"])
+        start = 0
+        with open(os.path.join(path, "records.jsonl"), encoding="utf-8") as records:
+            while start < meta["count"]:
+                chunk = [json.loads(records.readline()) for _ in range(min(page_size, meta["count"] - start))]
+                metadatas = [r["metadata"] or None for r in chunk]
+                self.collection.upsert(
+                    ids=[r["id"] for r in chunk],
+                    documents=[r["text"] for r in chunk],
+                    metadatas=metadatas if any(m is not None for m in metadatas) else None,
+                    embeddings=vecs[start:start + len(chunk)].tolist(),
+                )
+                start += len(chunk)
+        return start
+
+    async def export_to(self, path: str, page_size: int = 1000) -> int:
+        """全記憶を埋め込みごとpathへ書き出す。書き出した件数を返す。"""
+        await self.flush()
+        return await self._run(self._export, path, page_size)
+
+    async def import_from(self, path: str, page_size: int = 1000) -> int:
+        """export_toで書き出したディレクトリから取り込む（同じIDは上書き）。埋め込みは再計算しない。"""
+        # 待ち行列の古い記憶が後から取り込んだ値を上書きしないよう、先に書き込んでおく
+        await self.flush()
+        self._generation += 1
+        count = await self._run(self._import, path, page_size)
+        self._generation += 1
+        return count
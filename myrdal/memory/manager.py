@@ -1,13 +1,134 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+
+from autogen_core.memory import MemoryContent
+
 from .short_term import ShortTermMemory
 from .long_term import LongTermMemory
+from .relevant_memory import RelevantMemoryProvider
 
 class MemoryManager:
-    def __init__(self):
-        self.short_term_memories = {}
-        self.long_term_memory = LongTermMemory()
+    """
+    エージェントごとの短期記憶と共有の長期記憶を管理する。
+    短期記憶は最終アクセス時刻順（LRU）に保持し、合計がmax_short_term_bytesを超えるか
+    idle_seconds以上アクセスのないエージェントの短期記憶はspill_dirへ書き出してメモリから外す。
+    書き出した短期記憶はget_short_termで透過的に読み戻す。
+    長期記憶への統合が終わっていない短期記憶は、統合が済むまで書き出さない。
+    """
+    def __init__(self, long_term_path=None, short_term_options=None, max_short_term_bytes=None, idle_seconds=None, spill_dir=None, **long_term_options):
+        # long_term_path: 長期記憶の永続化先ディレクトリ（Noneならプロセス内のみ）
+        # short_term_options: ShortTermMemoryへの追加引数（max_entries, max_tokens, summarizer等）
+        # long_term_options: LongTermMemoryへの追加引数（write_behind, max_concurrency等）
+        self.short_term_memories = OrderedDict()
+        self.short_term_options = short_term_options or {}
+        self.long_term_memory = LongTermMemory(path=long_term_path, **long_term_options)
+        self.max_short_term_bytes = max_short_term_bytes
+        self.idle_seconds = idle_seconds
+        self.spill_dir = spill_dir
+        self._owns_spill_dir = False  # spill_dirを自分で作ったか（closeで消す）
+        self.last_access = {}  # agent_id -> 最終アクセス時刻（time.monotonic）
+        self.spilled = {}  # agent_id -> 書き出し先ファイル
+    def _spill_path(self, agent_id: str) -> str:
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="myrdal_short_term_")
+            self._owns_spill_dir = True
+        os.makedirs(self.spill_dir, exist_ok=True)
+        return os.path.join(self.spill_dir, hashlib.sha1(agent_id.encode("utf-8")).hexdigest() + ".json")
+    def _new_short_term(self, agent_id: str, contents=None) -> ShortTermMemory:
+        # 押し出された短期記憶はこのマネージャの長期記憶へ統合される
+        return ShortTermMemory(
+            name=agent_id, memory_contents=contents, long_term=self.long_term_memory, agent_id=agent_id, **self.short_term_options
+        )
+    def _rehydrate(self, agent_id: str) -> ShortTermMemory:
+        path = self.spilled.pop(agent_id)
+        with open(path, encoding="utf-8") as f:
+            contents = [MemoryContent.model_validate(item) for item in json.load(f)]
+        os.remove(path)
+        return self._new_short_term(agent_id, contents)
+    def spill(self, agent_id: str) -> bool:
+        """
+        エージェントの短期記憶をディスクへ書き出してメモリから外す。
+        長期記憶への統合中（押し出された記憶が未書き込み）ならそれを失わないよう何もせずFalseを返す。
+        """
+        memory = self.short_term_memories.get(agent_id)
+        if memory is None:
+            return False
+        if memory.consolidating:
+            return False
+        del self.short_term_memories[agent_id]
+        self.last_access.pop(agent_id, None)
+        if memory.content:
+            path = self._spill_path(agent_id)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump([c.model_dump(mode="json") for c in memory.content], f, ensure_ascii=False)
+            self.spilled[agent_id] = path
+        return True
+    def enforce_limits(self, keep: str = None):
+        """上限・アイドル時間に従って短期記憶を書き出す（get_short_termのたびに呼ばれる）"""
+        now = time.monotonic()
+        if self.idle_seconds is not None:
+            for agent_id in list(self.short_term_memories):
+                if agent_id != keep and now - self.last_access.get(agent_id, now) >= self.idle_seconds:
+                    self.spill(agent_id)  # 統合中なら次の呼び出しで書き出す
+        if self.max_short_term_bytes is not None:
+            total = self.total_bytes()
+            # 最も長くアクセスされていないエージェントから書き出す（アクセス中のエージェントは残す）
+            for agent_id in list(self.short_term_memories):
+                if total <= self.max_short_term_bytes:
+                    break
+                if agent_id == keep:
+                    continue
+                size = self.short_term_memories[agent_id].total_bytes
+                if self.spill(agent_id):
+                    total -= size
     def get_short_term(self, agent_id: str) -> ShortTermMemory:
-        if agent_id not in self.short_term_memories:
-            self.short_term_memories[agent_id] = ShortTermMemory()
-        return self.short_term_memories[agent_id]
+        """
+        エージェントの短期記憶（書き出し済みなら読み戻す）。書き出すと別のオブジェクトに入れ替わるため、
+        返り値を保持し続けず、エージェントにはget_memory_providerのプロバイダを渡すこと。
+        """
+        memory = self.short_term_memories.get(agent_id)
+        if memory is None:
+            memory = self._rehydrate(agent_id) if agent_id in self.spilled else self._new_short_term(agent_id)
+            self.short_term_memories[agent_id] = memory
+        self.short_term_memories.move_to_end(agent_id)
+        self.last_access[agent_id] = time.monotonic()
+        self.enforce_limits(keep=agent_id)
+        return memory
     def get_long_term(self) -> LongTermMemory:
-        return self.long_term_memory 
\ No newline at end of file
+        return self.long_term_memory
+    def get_memory_provider(self, agent_id: str, knowledge_graph=None, **options) -> RelevantMemoryProvider:
+        """短期・長期記憶と知識グラフから関連する記憶だけを文脈に加えるエージェント用memory"""
+        return RelevantMemoryProvider(self, agent_id, knowledge_graph=knowledge_graph, **options)
+    def total_bytes(self) -> int:
+        """メモリ上の短期記憶のおおよその合計バイト数"""
+        return sum(memory.total_bytes for memory in self.short_term_memories.values())
+    def memory_usage(self) -> dict:
+        """エージェントごとの最終アクセスからの経過秒数・おおよそのバイト数と、その合計"""
+        now = time.monotonic()
+        agents = {
+            agent_id: {
+                "bytes": memory.total_bytes,
+                "entries": len(memory.content),
+                "idle_seconds": now - self.last_access.get(agent_id, now),
+            }
+            for agent_id, memory in self.short_term_memories.items()
+        }
+        return {
+            "agents": agents,
+            "total_bytes": self.total_bytes(),
+            "loaded": len(self.short_term_memories),
+            "spilled": len(self.spilled),
+        }
+    async def close(self):
+        for memory in self.short_term_memories.values():
+            await memory.close()
+        await self.long_term_memory.close()
+        if self._owns_spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir, self._owns_spill_dir = None, False
+            self.spilled = {}
@@ -0,0 +1,64 @@
+# 長期記憶の検索結果キャッシュ（LRU + TTL + 書き込み世代による無効化）
+
+import json
+import time
+from collections import OrderedDict
+
+
+def filter_key(where) -> str:
+    """フィルタdictをキーに使える正規形の文字列にする（キー順に依存しない）"""
+    return "" if not where else json.dumps(where, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class QueryCache:
+    """
+    (query, n_results, filter)をキーとする検索結果のキャッシュ。
+    各項目は格納時の書き込み世代を持ち、現在の世代と異なれば（=その後にstore/deleteがあれば）無効として扱う。
+    max_entriesを超えたら最も古く使われた項目から捨て、ttl秒を過ぎた項目も無効とする。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (世代, 期限, 値)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key, generation: int):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry_generation, expires, value = entry
+            if entry_generation == generation and time.monotonic() < expires:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, generation: int, value):
+        if not self.enabled:
+            return
+        self._entries[key] = (generation, time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+        }
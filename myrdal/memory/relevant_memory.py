@@ -0,0 +1,125 @@
+# エージェント向けの関連記憶プロバイダ
+# 短期記憶（新しい順）・長期記憶（LongTermMemory.search）・知識グラフ（MultiLayerKnowledgeGraph.query_by_vector）の
+# 3つの順位リストをRRFで統合し、現在のメッセージに関連する上位top_k件をトークン予算内で文脈に加える。
+
+import asyncio
+from functools import partial
+
+from autogen_core.memory import Memory, MemoryContent, MemoryMimeType, MemoryQueryResult, UpdateContextResult
+from autogen_core.models import SystemMessage
+
+from myrdal.knowledge.lexical_index import reciprocal_rank_fusion
+from myrdal.utils.tokens import estimate_tokens
+from .short_term import _text
+
+SOURCE_LABELS = {"short_term": "recent", "long_term": "long-term", "knowledge": "knowledge"}
+
+
+class RelevantMemoryProvider(Memory):
+    """
+    MyrdalAssistantAgentのmemoryとして使う。addはエージェントの短期記憶へ書き込み、
+    update_contextでは全履歴ではなく選別した記憶だけを1つのSystemMessageとして加える。
+    - recent_k: 候補にする短期記憶の件数（新しい順）
+    - top_k / token_budget: 文脈に加える件数とおおよそのトークン数の上限
+    短期記憶はmemory_manager.get_short_termで毎回取得するため、書き出し（spill）後も透過的に読み戻される。
+    """
+
+    component_type = "memory"
+
+    def __init__(
+        self,
+        memory_manager,
+        agent_id: str,
+        knowledge_graph=None,
+        top_k: int = 8,
+        token_budget: int = 1000,
+        recent_k: int = 5,
+        long_term_k: int = 5,
+        knowledge_k: int = 5,
+        long_term_filter=None,
+        token_counter=estimate_tokens,
+    ):
+        self.memory_manager = memory_manager
+        self.agent_id = agent_id
+        self.knowledge_graph = knowledge_graph
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.recent_k = recent_k
+        self.long_term_k = long_term_k
+        self.knowledge_k = knowledge_k
+        self.long_term_filter = long_term_filter
+        self.token_counter = token_counter
+
+    @property
+    def short_term(self):
+        return self.memory_manager.get_short_term(self.agent_id)
+
+    async def _candidates(self, query: str) -> dict:
+        """情報源ごとの(テキスト, スコア)の順位リスト"""
+        recent = self.short_term.content[-self.recent_k:] if self.recent_k > 0 else []
+        rankings = {"short_term": [(_text(c), 0.0) for c in reversed(recent)]}
+        if query and self.long_term_k > 0:
+            documents = await self.memory_manager.get_long_term().search(query, n_results=self.long_term_k, where=self.long_term_filter)
+            rankings["long_term"] = [(doc, 0.0) for doc in (documents[0] if documents else [])]
+        if query and self.knowledge_graph is not None and self.knowledge_k > 0 and len(self.knowledge_graph.index):
+            # クエリの埋め込みと索引の検索は同期処理なので、イベントループを塞がないようスレッドで行う
+            rankings["knowledge"] = await asyncio.get_running_loop().run_in_executor(
+                None, partial(self._knowledge_ranking, query)
+            )
+        return rankings
+
+    def _knowledge_ranking(self, query: str) -> list:
+        return [
+            (self.knowledge_graph.nodes.get_field(node_id, "content"), score)
+            for node_id, score in self.knowledge_graph.query_by_vector(query, top_k=self.knowledge_k)
+        ]
+
+    async def select(self, query: str) -> list:
+        """関連度順に選んだ記憶を(テキスト, 情報源)のリストで返す"""
+        rankings = await self._candidates(query)
+        source_of = {}
+        for source, ranking in rankings.items():
+            for text, _ in ranking:
+                source_of.setdefault(text, source)
+        fused = reciprocal_rank_fusion(
+            [[(text, score) for text, score in ranking if text] for ranking in rankings.values()]
+        )
+        selected, used = [], 0
+        for text, _ in fused:
+            if len(selected) >= self.top_k:
+                break
+            tokens = self.token_counter(text)
+            if used + tokens > self.token_budget:
+                continue
+            selected.append((text, source_of[text]))
+            used += tokens
+        return selected
+
+    def _to_contents(self, selected) -> list:
+        return [
+            MemoryContent(content=text, mime_type=MemoryMimeType.TEXT, metadata={"source": source})
+            for text, source in selected
+        ]
+
+    async def update_context(self, model_context) -> UpdateContextResult:
+        messages = await model_context.get_messages()
+        query = next((m.content for m in reversed(messages) if isinstance(getattr(m, "content", None), str)), "")
+        selected = await self.select(query)
+        if not selected:
+            return UpdateContextResult(memories=MemoryQueryResult(results=[]))
+        lines = [f"{i}. [{SOURCE_LABELS[source]}] {text}" for i, (text, source) in enumerate(selected, 1)]
+        await model_context.add_message(SystemMessage(content="\nRelevant memory content:\n" + "\n".join(lines) + "\n"))
+        return UpdateContextResult(memories=MemoryQueryResult(results=self._to_contents(selected)))
+
+    async def query(self, query="", cancellation_token=None, **kwargs) -> MemoryQueryResult:
+        text = _text(query) if isinstance(query, MemoryContent) else query
+        return MemoryQueryResult(results=self._to_contents(await self.select(text)))
+
+    async def add(self, content: MemoryContent, cancellation_token=None) -> None:
+        await self.short_term.add(content, cancellation_token)
+
+    async def clear(self) -> None:
+        await self.short_term.clear()
+
+    async def close(self) -> None:
+        await self.short_term.close()
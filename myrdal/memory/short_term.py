@@ -1,7 +1,182 @@
-from autogen_core.memory import ListMemory
- 
+import asyncio
+import hashlib
+import inspect
+import logging
+from collections import deque
+
+from autogen_core.memory import ListMemory, MemoryContent, MemoryMimeType, MemoryQueryResult, UpdateContextResult
+from autogen_core.models import SystemMessage
+
+from myrdal.utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+def _text(content: MemoryContent) -> str:
+    return content.content if isinstance(content.content, str) else str(content.content)
+
+
+def _log_consolidation_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(
+            "Consolidating evicted short-term memories into long-term memory failed", exc_info=task.exception()
+        )
+
+
 class ShortTermMemory(ListMemory):
     """
-    Myrdal用短期記憶ラッパー。将来的な拡張ポイントを用意。
+    Myrdal用短期記憶。件数（max_entries）とトークン数（max_tokens）の上限を持つリングバッファ。
+    上限を超えて押し出された記憶は非同期に長期記憶へ統合する（重複除去、summarizerがあれば要約してから保存）。
+    update_contextでは全履歴ではなく、直近のバッファと長期記憶から関連度順にrecall_k件を文脈に加える。
     """
-    pass 
\ No newline at end of file
+
+    def __init__(
+        self,
+        name: str | None = None,
+        memory_contents=None,
+        max_entries: int = 50,
+        max_tokens: int | None = None,
+        long_term=None,
+        agent_id: str | None = None,
+        summarizer=None,
+        recall_k: int = 3,
+        token_counter=estimate_tokens,
+    ):
+        super().__init__(name=name, memory_contents=None)
+        self.max_entries = max_entries
+        self.max_tokens = max_tokens
+        self.long_term = long_term
+        self.agent_id = agent_id or self.name
+        self.summarizer = summarizer  # 押し出された記憶の文字列リスト -> 要約文字列（同期/非同期どちらでもよい）
+        self.recall_k = recall_k
+        self.token_counter = token_counter
+        self._contents = deque()
+        self._tokens = deque()
+        self.total_tokens = 0
+        self.total_bytes = 0  # バッファ内容のおおよそのバイト数（MemoryManagerの使用量計算用）
+        self._bytes = deque()
+        self._evicted = []
+        self._consolidation = None
+        for content in memory_contents or []:
+            self._append(content)
+
+    @property
+    def content(self):
+        return list(self._contents)
+
+    @content.setter
+    def content(self, value):
+        self._contents, self._tokens, self.total_tokens = deque(), deque(), 0
+        self._bytes, self.total_bytes = deque(), 0
+        for content in value:
+            self._append(content)
+
+    def _append(self, content: MemoryContent):
+        text = _text(content)
+        tokens = self.token_counter(text)
+        size = len(text.encode("utf-8")) + 200  # MemoryContentオブジェクト自体の分を概算で加える
+        self._contents.append(content)
+        self._tokens.append(tokens)
+        self._bytes.append(size)
+        self.total_tokens += tokens
+        self.total_bytes += size
+        # 最新の1件は上限を超えていても残す
+        while len(self._contents) > 1 and (
+            len(self._contents) > self.max_entries
+            or (self.max_tokens is not None and self.total_tokens > self.max_tokens)
+        ):
+            self._evicted.append(self._contents.popleft())
+            self.total_tokens -= self._tokens.popleft()
+            self.total_bytes -= self._bytes.popleft()
+
+    async def add(self, content: MemoryContent, cancellation_token=None) -> None:
+        self._append(content)
+        if self._evicted and self.long_term is not None:
+            self._start_consolidation()
+
+    def _record_id(self, text: str) -> str:
+        digest = hashlib.sha1(f"{self.agent_id}\0{text}".encode("utf-8")).hexdigest()[:16]
+        return f"stm_{digest}"
+
+    def _start_consolidation(self) -> asyncio.Task:
+        # 統合は常に1つのタスクだけが行う（_evictedの先頭を外すのはそのタスクだけ）
+        if self._consolidation is None or self._consolidation.done():
+            self._consolidation = asyncio.get_running_loop().create_task(self._consolidate())
+            self._consolidation.add_done_callback(_log_consolidation_failure)
+        return self._consolidation
+
+    async def _consolidate(self):
+        # 統合中に新たに押し出された分もまとめて処理する（押し出しは末尾への追加だけ）。
+        # 書き込みに成功するまで_evictedから外さない（失敗したら次の統合で再試行する）
+        while self._evicted:
+            evicted = list(self._evicted)
+            texts = list(dict.fromkeys(t for t in (_text(c).strip() for c in evicted) if t))
+            if not texts:
+                del self._evicted[:len(evicted)]
+                continue
+            if self.summarizer is not None:
+                summary = self.summarizer(texts)
+                if inspect.isawaitable(summary):
+                    summary = await summary
+                texts = [summary]
+            # IDは内容から決まるため、同じ内容の再統合は長期記憶側でも重複しない
+            await self.long_term.store_many(
+                {"id": self._record_id(text), "text": text, "agent": self.agent_id, "source": "short_term"}
+                for text in texts
+            )
+            del self._evicted[:len(evicted)]
+
+    @property
+    def consolidating(self) -> bool:
+        """押し出された記憶のうち、まだ長期記憶へ書き込めていないものがあるか"""
+        if self.long_term is None:
+            return False
+        return bool(self._evicted) or (self._consolidation is not None and not self._consolidation.done())
+
+    async def consolidate(self):
+        """押し出された記憶の長期記憶への統合が完了するまで待つ（失敗したら例外を送出する）"""
+        if self.long_term is None:
+            return
+        if self._consolidation is not None and not self._consolidation.done():
+            # 実行中の統合の失敗はログに出ている。残った分は下でもう一度統合する
+            await asyncio.wait([self._consolidation])
+        if self._evicted:
+            await self._start_consolidation()
+
+    async def _recall(self, query: str) -> list:
+        if self.long_term is None or not query or self.recall_k <= 0:
+            return []
+        documents = await self.long_term.search(query, n_results=self.recall_k, where={"agent": self.agent_id})
+        recent = {_text(c) for c in self._contents}
+        return [doc for doc in (documents[0] if documents else []) if doc not in recent]
+
+    async def update_context(self, model_context) -> UpdateContextResult:
+        if not self._contents:
+            return UpdateContextResult(memories=MemoryQueryResult(results=[]))
+        messages = await model_context.get_messages()
+        last = next((m.content for m in reversed(messages) if isinstance(getattr(m, "content", None), str)), None)
+        recalled = await self._recall(last or _text(self._contents[-1]))
+        parts = []
+        if recalled:
+            parts.append("\nRelevant long-term memory:\n" + "\n".join(f"- {doc}" for doc in recalled) + "\n")
+        memory_strings = [f"{i}. {_text(memory)}" for i, memory in enumerate(self._contents, 1)]
+        parts.append("\nRelevant memory content (in chronological order):\n" + "\n".join(memory_strings) + "\n")
+        await model_context.add_message(SystemMessage(content="".join(parts)))
+        results = [MemoryContent(content=doc, mime_type=MemoryMimeType.TEXT) for doc in recalled] + list(self._contents)
+        return UpdateContextResult(memories=MemoryQueryResult(results=results))
+
+    async def query(self, query="", cancellation_token=None, **kwargs) -> MemoryQueryResult:
+        text = _text(query) if isinstance(query, MemoryContent) else query
+        recalled = await self._recall(text)
+        results = [MemoryContent(content=doc, mime_type=MemoryMimeType.TEXT) for doc in recalled] + list(self._contents)
+        return MemoryQueryResult(results=results)
+
+    async def clear(self) -> None:
+        self.content = []
+
+    async def close(self) -> None:
+        await self.consolidate()
+
+    def _to_config(self):
+        config = super()._to_config()
+        config.memory_contents = list(self._contents)
+        return config
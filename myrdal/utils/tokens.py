@@ -0,0 +1,7 @@
+# トークナイザを使わない軽量なトークン数の概算（記憶・知識の両レイヤーから使う）
+
+
+def estimate_tokens(text: str) -> int:
+    # おおよそのトークン数（英語は約4文字/トークン、日本語は約1文字/トークン）
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return max(1, ascii_chars // 4 + (len(text) - ascii_chars))
@@ -0,0 +1,73 @@
+import gzip
+import subprocess
+import sys
+
+import pytest
+from myrdal.knowledge.bulk_import import import_file, iter_triples, make_interner, term_label
+from myrdal.knowledge.knowledge_graph import KnowledgeGraph
+
+NT = """# comment
+<http://ex.org/cat> <http://ex.org/isA> <http://ex.org/mammal> .
+<http://ex.org/cat> <http://ex.org/name> "Cat \\"Tom\\"\\u00e9"@en .
+_:b0 <http://ex.org/isA> <http://ex.org/mammal> .
+this line is broken
+"""
+
+
+def test_parse_ntriples_and_labels():
+    triples = list(iter_triples(NT.splitlines(), "nt"))
+    assert triples[1] == ("http://ex.org/cat", "http://ex.org/name", 'Cat "Tom"é')
+    assert triples[2][0] == "_:b0"
+    # 同じIRIは同一オブジェクトに揃う
+    assert triples[0][1] is triples[2][1]
+    assert term_label("http://ex.org/mammal") == "mammal"
+    assert term_label("/c/en/ice_cream/n") == "ice cream"
+
+
+def test_interner_is_bounded():
+    intern = make_interner(maxsize=2)
+    first = "".join(["ex:", "a"])
+    assert intern(first) is first
+    assert intern("".join(["ex:", "a"])) is first
+    for term in ("ex:b", "ex:c"):
+        intern(term)
+    # 追い出された文字列は保持されない
+    assert intern("".join(["ex:", "a"])) is not first
+
+
+def test_import_into_knowledge_graph_does_not_load_embedding_model():
+    code = (
+        "import asyncio, sys\n"
+        "from myrdal.knowledge.bulk_import import import_triples\n"
+        "from myrdal.knowledge.knowledge_graph import KnowledgeGraph\n"
+        "asyncio.run(import_triples(KnowledgeGraph(), [('a', 'b', 'c')]))\n"
+        "assert 'myrdal.knowledge.multilayer_knowledge_graph' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+@pytest.mark.asyncio
+async def test_import_file_formats(tmp_path):
+    nt = tmp_path / "data.nt.gz"
+    with gzip.open(nt, "wt", encoding="utf-8") as f:
+        f.write(NT)
+    kg = KnowledgeGraph()
+    seen = []
+    stats = await import_file(kg, str(nt), batch_size=2, progress=lambda s: seen.append((s.triples, s.skipped)))
+    assert (stats.triples, stats.skipped, stats.batches) == (3, 1, 2)
+    # 壊れた行はパースした時点でskippedに反映される
+    assert seen == [(2, 0), (3, 1)]
+    assert len(await kg.query(predicate="http://ex.org/isA")) == 2
+
+    cn = tmp_path / "conceptnet-assertions.csv"
+    cn.write_text("/a/1\t/r/IsA\t/c/en/dog\t/c/en/animal\t{}\n/a/2\t/r/IsA\t/c/en/cat\t/c/en/animal\t{}\n", encoding="utf-8")
+    kg = KnowledgeGraph()
+    stats = await import_file(kg, str(cn))
+    assert stats.triples == 2
+    assert sorted(s for s, _, _ in await kg.query(predicate="/r/IsA", obj="/c/en/animal")) == ["/c/en/cat", "/c/en/dog"]
+
+    csv_path = tmp_path / "facts.csv"
+    csv_path.write_text("s,p,o\nsun,is_a,star\n", encoding="utf-8")
+    kg = KnowledgeGraph()
+    await import_file(kg, str(csv_path), header=True)
+    assert await kg.query() == [("sun", "is_a", "star")]
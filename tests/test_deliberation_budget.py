@@ -0,0 +1,38 @@
+import pytest
+from myrdal.knowledge.deliberation_budget import BudgetTracker, DeliberationBudget
+
+
+def test_budget_from_args_overrides_defaults():
+    budget = DeliberationBudget.from_args(
+        {"budget": {"max_steps": 5, "max_module_calls": 2}, "max_steps": 3, "goal": "ignored"},
+        defaults={"max_steps": 20, "deadline": 10.0},
+    )
+    assert budget == DeliberationBudget(max_steps=3, deadline=10.0, max_module_calls=2)
+    assert DeliberationBudget.from_args(None, {"max_steps": 20}).max_steps == 20
+    with pytest.raises(ValueError):
+        DeliberationBudget.from_args({"budget": {"max_stepz": 1}})
+
+
+def test_tracker_reports_first_exhausted_budget():
+    now = [0.0]
+    tracker = BudgetTracker(
+        DeliberationBudget(max_steps=3, deadline=5.0, max_prompt_tokens=100, max_module_calls=2),
+        clock=lambda: now[0],
+    )
+    assert tracker.exhausted() is None
+    tracker.module_calls = 1
+    assert tracker.remaining_module_calls() == 1
+    tracker.add_usage(60, 5)
+    assert tracker.exhausted(next_prompt_tokens=40) is None
+    assert tracker.exhausted(next_prompt_tokens=41).startswith("max_prompt_tokens")
+    tracker.add_usage(40, 0)
+    assert tracker.exhausted().startswith("max_prompt_tokens")
+    tracker.prompt_tokens = 0
+    now[0] = 4.0
+    assert tracker.remaining_time() == 1.0
+    now[0] = 6.0
+    assert tracker.exhausted().startswith("deadline")
+    assert tracker.remaining_time() == 0.0
+    tracker.steps = 3
+    assert tracker.exhausted().startswith("max_steps")
+    assert tracker.summary()["limits"]["max_module_calls"] == 2
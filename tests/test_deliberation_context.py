@@ -0,0 +1,43 @@
+from autogen_core.models import SystemMessage, UserMessage
+from myrdal.knowledge.deliberation_context import DeliberationTranscript
+
+
+def prompt_size(messages):
+    return sum(len(str(m.content)) for m in messages)
+
+
+def test_transcript_prompt_stays_bounded():
+    transcript = DeliberationTranscript(
+        [UserMessage(content="question", source="user")], "static instructions",
+        keep_steps=2, max_summary_chars=500, max_result_chars=300,
+    )
+    sizes = []
+    for step in range(1, 60):
+        transcript.record(step, {
+            "thought": f"step {step} " * 50,
+            "call_module": "causal_reasoner",
+            "call_args": {"data": "x"},
+            "module_result": {"graph": "edge " * 1000},
+            "satisfied": False,
+        })
+        rendered = transcript.render(f"Step {step + 1}")
+        sizes.append(prompt_size(rendered))
+    # 固定の指示は先頭に1回だけ
+    assert [m.content for m in rendered].count("static instructions") == 1
+    assert isinstance(rendered[0], SystemMessage) and rendered[-1].content == "Step 60"
+    assert max(sizes[10:]) <= max(sizes[:10]) + 200
+    # 大きな結果はハンドルで全体を参照できる
+    assert transcript.resolve("r1") == {"graph": "edge " * 1000}
+    assert "[handle r59" in rendered[-2].content
+    assert transcript.omitted > 0
+
+
+def test_transcript_reads_abbreviated_results_in_parts():
+    transcript = DeliberationTranscript([], "instructions", max_result_chars=100)
+    transcript.record(1, {"thought": "t", "call_module": "m", "module_result": "x" * 120})
+    first = transcript.read("r1")
+    assert first == {"handle": "r1", "offset": 0, "text": "x" * 50, "next_offset": 50}
+    rest = [transcript.read("r1", offset) for offset in (50, 100)]
+    assert "".join(part["text"] for part in [first, *rest]) == "x" * 120
+    assert rest[-1]["next_offset"] is None
+    assert "unknown handle" in transcript.read("r9")["error"]
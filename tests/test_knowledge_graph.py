@@ -0,0 +1,43 @@
+import pytest
+from myrdal.knowledge.knowledge_graph import KnowledgeGraph
+
+
+async def make_graph():
+    kg = KnowledgeGraph()
+    for s, p, o in [
+        ("cat", "is_a", "mammal"), ("dog", "is_a", "mammal"), ("mammal", "is_a", "animal"),
+        ("cat", "eats", "fish"), ("dog", "eats", "meat"), ("fish", "is_a", "animal"),
+    ]:
+        await kg.add_fact(s, p, o)
+    return kg
+
+
+@pytest.mark.asyncio
+async def test_query_uses_bound_terms():
+    kg = await make_graph()
+    assert sorted(await kg.query(predicate="is_a", obj="mammal")) == [("cat", "is_a", "mammal"), ("dog", "is_a", "mammal")]
+    assert await kg.query(subject="cat", obj="fish") == [("cat", "eats", "fish")]
+    assert len(await kg.query()) == 6
+    assert await kg.count(subject="cat") == 2
+    await kg.delete_fact("cat", "eats", "fish")
+    assert await kg.query(subject="cat", predicate="eats") == []
+    assert await kg.count() == 5
+
+
+@pytest.mark.asyncio
+async def test_query_patterns_joins_bindings():
+    kg = await make_graph()
+    rows = await kg.query_patterns([("?x", "is_a", "?c"), ("?c", "is_a", "animal"), ("?x", "eats", "?food")])
+    assert sorted((r["?x"], r["?food"]) for r in rows) == [("cat", "fish"), ("dog", "meat")]
+    rows = await kg.query_patterns([("?x", "eats", "?f"), ("?f", "is_a", "animal")])
+    assert rows == [{"?x": "cat", "?f": "fish"}]
+    assert await kg.query_patterns([("?x", "is_a", "plant")]) == []
+
+
+@pytest.mark.asyncio
+async def test_add_facts_keys_edges_by_predicate():
+    kg = KnowledgeGraph()
+    await kg.add_facts([("a", "", "b"), ("a", "rel", "b")])
+    assert sorted(kg.graph["a"]["b"]) == ["", "rel"]
+    await kg.delete_fact("a", "", "b")
+    assert list(kg.graph["a"]["b"]) == ["rel"]
@@ -10,4 +10,371 @@ def test_memory_manager_get_agent_memory():
     assert isinstance(mem2, ListMemory)
     assert mem1 is not mem2
     # agent1のメモリは同じインスタンスが返る
-    assert mm.get_agent_memory("agent1") is mem1 
\ No newline at end of file
+    assert mm.get_agent_memory("agent1") is mem1 
+
+@pytest.mark.asyncio
+async def test_long_term_write_behind_batches_and_flushes():
+    from myrdal.memory.long_term import LongTermMemory
+
+    ltm = LongTermMemory(collection_name="test_write_behind", write_behind=True, batch_size=4, flush_interval=60)
+    for i in range(3):
+        await ltm.store({"id": f"m{i}", "text": f"memory {i}", "agent": "a"})
+    assert ltm.collection.count() == 0
+    await ltm.store({"id": "m3", "text": "memory 3"})
+    assert ltm.collection.count() == 4
+    await ltm.store({"id": "m4", "text": "memory 4"})
+    await ltm.store_many([{"id": f"b{i}", "text": f"bulk {i}"} for i in range(10)])
+    assert ltm.collection.count() == 14
+    collection = ltm.collection
+    await ltm.close()
+    assert collection.count() == 15
+
+
+@pytest.mark.asyncio
+async def test_long_term_failed_flush_keeps_pending(caplog):
+    import asyncio
+    from myrdal.memory.long_term import LongTermMemory
+
+    ltm = LongTermMemory(collection_name="test_failed_flush", write_behind=True, batch_size=10, flush_interval=0.01)
+    add = ltm.collection.add
+
+    def failing_add(**kwargs):
+        raise RuntimeError("disk full")
+
+    ltm.collection.add = failing_add
+    await ltm.store({"id": "x", "text": "kept memory"})
+    await ltm.store({"id": "y", "text": "another memory", "agent": "a"})
+    # タイマーによる書き込みの失敗はログに出し、記憶は待ち行列に残す
+    await asyncio.sleep(0.05)
+    assert "Write-behind flush" in caplog.text
+    with pytest.raises(RuntimeError):
+        await ltm.flush()
+    assert sorted(ltm._pending) == ["x", "y"]
+    ltm.collection.add = add
+    collection = ltm.collection
+    await ltm.close()
+    assert collection.count() == 2
+
+
+@pytest.mark.asyncio
+async def test_long_term_cancelled_flush_does_not_write_twice():
+    import asyncio
+    import threading
+    from myrdal.memory.long_term import LongTermMemory
+
+    ltm = LongTermMemory(collection_name="test_cancelled_flush", write_behind=True, flush_interval=60)
+    add = ltm.collection.add
+    release, calls = threading.Event(), []
+
+    def slow_add(**kwargs):
+        calls.append(kwargs["ids"])
+        release.wait(5)
+        return add(**kwargs)
+
+    ltm.collection.add = slow_add
+    await ltm.store({"id": "x", "text": "written once"})
+    flush = asyncio.ensure_future(ltm.flush())
+    await asyncio.sleep(0.05)
+    flush.cancel()
+    await asyncio.sleep(0.01)
+    release.set()
+    with pytest.raises(asyncio.CancelledError):
+        await flush
+    # 書き込みは実行スレッドで完了しているので待ち行列には戻さない
+    assert ltm._pending == {}
+    await ltm.flush()
+    assert calls == [["x"]]
+    collection = ltm.collection
+    await ltm.close()
+    assert collection.count() == 1
+
+
+@pytest.mark.asyncio
+async def test_long_term_search_coalesces_and_batches():
+    import asyncio
+    from myrdal.memory.long_term import LongTermMemory
+
+    ltm = LongTermMemory(collection_name="test_search_many", max_concurrency=2)
+    await ltm.store_many([{"id": "a", "text": "apple pie"}, {"id": "b", "text": "banana bread"}])
+    calls = []
+    query = ltm.collection.query
+    ltm.collection.query = lambda **kw: calls.append(kw) or query(**kw)
+    results = await asyncio.gather(*(ltm.search("apple", n_results=1) for _ in range(5)))
+    assert all(r == [["apple pie"]] for r in results)
+    assert len(calls) == 1
+    batched = await ltm.search_many(["banana", "apple", "banana"], n_results=1)
+    assert batched == [["banana bread"], ["apple pie"], ["banana bread"]]
+    await ltm.close()
+
+
+@pytest.mark.asyncio
+async def test_long_term_persistence_and_export(tmp_path):
+    mm = MemoryManager(long_term_path=str(tmp_path / "ltm"))
+    ltm = mm.get_long_term()
+    await ltm.store_many([{"id": "a", "text": "apple pie", "kind": "food"}, {"id": "b", "text": "banana bread", "kind": "food"}])
+    await mm.close()
+    assert not ltm.is_open
+    ltm.open()
+    assert ltm.collection.count() == 2
+    assert await ltm.export_to(str(tmp_path / "export")) == 2
+    await ltm.close()
+
+    from myrdal.memory.long_term import LongTermMemory
+    async with LongTermMemory(collection_name="imported", path=str(tmp_path / "other")) as other:
+        assert await other.import_from(str(tmp_path / "export"), page_size=1) == 2
+        got = other.collection.get(ids=["a"], include=["documents", "metadatas"])
+        assert got["documents"] == ["apple pie"] and got["metadatas"] == [{"kind": "food"}]
+        assert await other.search("banana", n_results=1) == [["banana bread"]]
+
+    # 取り込み前に待ち行列の記憶を書き込むので、同じIDは取り込んだ値になる
+    async with LongTermMemory(collection_name="imported_over_pending", write_behind=True, flush_interval=60) as pending:
+        await pending.store({"id": "a", "text": "stale apple"})
+        await pending.import_from(str(tmp_path / "export"))
+        assert pending._pending == {}
+        assert pending.collection.get(ids=["a"])["documents"] == ["apple pie"]
+
+
+@pytest.mark.asyncio
+async def test_long_term_search_cache_invalidated_on_write():
+    from myrdal.memory.long_term import LongTermMemory
+
+    ltm = LongTermMemory(collection_name="test_cache")
+    await ltm.store({"id": "a", "text": "apple pie", "kind": "food"})
+    assert await ltm.search("apple", n_results=1) == [["apple pie"]]
+    assert await ltm.search("apple", n_results=1) == [["apple pie"]]
+    assert await ltm.search("apple", n_results=1, where={"kind": "food"}) == [["apple pie"]]
+    assert ltm.cache_stats()["hits"] == 1
+    await ltm.store({"id": "b", "text": "apple apple", "kind": "food"})
+    assert await ltm.search("apple apple", n_results=1) == [["apple apple"]]
+    await ltm.delete("b")
+    assert await ltm.search("apple apple", n_results=1) == [["apple pie"]]
+    stats = ltm.cache_stats()
+    assert stats["hits"] == 1 and 0 < stats["hit_rate"] < 1
+    await ltm.close()
+
+
+@pytest.mark.asyncio
+async def test_short_term_budget_and_consolidation():
+    from autogen_core.memory import MemoryContent, MemoryMimeType
+    from autogen_core.model_context import UnboundedChatCompletionContext
+    from autogen_core.models import UserMessage
+
+    mm = MemoryManager(collection_name="test_short_term_budget", short_term_options={"max_entries": 3, "recall_k": 2})
+    stm = mm.get_short_term("agent1")
+    for text in ["likes green tea", "likes green tea", "lives in Kyoto", "works on robots", "plays chess"]:
+        await stm.add(MemoryContent(content=text, mime_type=MemoryMimeType.TEXT))
+    assert [c.content for c in stm.content] == ["lives in Kyoto", "works on robots", "plays chess"]
+    await stm.consolidate()
+    # 押し出された2件（同一内容）は1件にまとめて長期記憶へ
+    assert mm.get_long_term().collection.count() == 1
+
+    context = UnboundedChatCompletionContext()
+    await context.add_message(UserMessage(content="what tea do I like", source="user"))
+    result = await stm.update_context(context)
+    assert result.memories.results[0].content == "likes green tea"
+    assert len(result.memories.results) == 4
+    await mm.close()
+
+
+@pytest.mark.asyncio
+async def test_short_term_token_budget_with_summarizer():
+    from autogen_core.memory import MemoryContent, MemoryMimeType
+
+    mm = MemoryManager(
+        collection_name="test_short_term_summarizer",
+        short_term_options={"max_tokens": 10, "summarizer": lambda texts: " / ".join(texts)},
+    )
+    stm = mm.get_short_term("agent2")
+    for i in range(6):
+        await stm.add(MemoryContent(content=f"note number {i} " * 2, mime_type=MemoryMimeType.TEXT))
+    assert stm.total_tokens <= 10
+    collection = mm.get_long_term().collection
+    await mm.close()
+    docs = collection.get(include=["documents"])["documents"]
+    assert len(docs) >= 1 and "note number 0" in docs[0]
+
+
+@pytest.mark.asyncio
+async def test_short_term_failed_consolidation_keeps_evicted(caplog):
+    import asyncio
+    from autogen_core.memory import MemoryContent, MemoryMimeType
+
+    mm = MemoryManager(collection_name="test_failed_consolidation", short_term_options={"max_entries": 1})
+    stm = mm.get_short_term("agent3")
+    ltm = mm.get_long_term()
+    store_many = ltm.store_many
+
+    async def failing_store_many(records):
+        raise RuntimeError("disk full")
+
+    ltm.store_many = failing_store_many
+    for text in ("first", "second"):
+        await stm.add(MemoryContent(content=text, mime_type=MemoryMimeType.TEXT))
+    await asyncio.sleep(0.01)
+    # 裏での統合の失敗はログに出し、押し出された記憶は次の統合まで保持する
+    assert "Consolidating evicted" in caplog.text
+    assert [c.content for c in stm._evicted] == ["first"]
+    ltm.store_many = store_many
+    await stm.consolidate()
+    assert stm._evicted == []
+    collection = ltm.collection
+    await mm.close()
+    assert collection.get(include=["documents"])["documents"] == ["first"]
+
+
+@pytest.mark.asyncio
+async def test_short_term_consolidation_has_a_single_owner():
+    import asyncio
+    from autogen_core.memory import MemoryContent, MemoryMimeType
+
+    mm = MemoryManager(collection_name="test_single_consolidation", short_term_options={"max_entries": 1})
+    stm = mm.get_short_term("agent4")
+    ltm = mm.get_long_term()
+    store_many = ltm.store_many
+    release = asyncio.Event()
+    attempts = []
+
+    async def flaky_store_many(records):
+        records = list(records)
+        attempts.append([r["text"] for r in records])
+        if len(attempts) == 1:
+            raise RuntimeError("disk full")
+        await release.wait()
+        return await store_many(records)
+
+    ltm.store_many = flaky_store_many
+    for text in ("first", "second"):
+        await stm.add(MemoryContent(content=text, mime_type=MemoryMimeType.TEXT))
+    await asyncio.sleep(0.01)
+    # 再試行の統合の書き込み中に押し出された記憶も、別の統合を始めずに同じタスクが書き込む
+    waiting = asyncio.ensure_future(stm.consolidate())
+    await asyncio.sleep(0.01)
+    for text in ("third", "fourth"):
+        await stm.add(MemoryContent(content=text, mime_type=MemoryMimeType.TEXT))
+    release.set()
+    await waiting
+    assert stm._evicted == [] and attempts == [["first"], ["first"], ["second", "third"]]
+    collection = ltm.collection
+    await mm.close()
+    assert sorted(collection.get(include=["documents"])["documents"]) == ["first", "second", "third"]
+
+
+@pytest.mark.asyncio
+async def test_memory_manager_spills_and_rehydrates(tmp_path):
+    from autogen_core.memory import MemoryContent, MemoryMimeType
+
+    mm = MemoryManager(collection_name="test_spill", max_short_term_bytes=1500, spill_dir=str(tmp_path))
+    for agent in ("a", "b", "c"):
+        stm = mm.get_short_term(agent)
+        for i in range(2):
+            await stm.add(MemoryContent(content=f"{agent} says {i} " * 20, mime_type=MemoryMimeType.TEXT))
+    mm.get_short_term("c")
+    usage = mm.memory_usage()
+    assert usage["total_bytes"] <= mm.max_short_term_bytes
+    assert "a" not in mm.short_term_memories and usage["spilled"] >= 1
+    a = mm.get_short_term("a")
+    assert [c.content for c in a.content] == [f"a says {i} " * 20 for i in range(2)]
+    assert "a" not in mm.spilled
+    await mm.close()
+
+
+@pytest.mark.asyncio
+async def test_agent_memory_provider_writes_survive_a_spill(tmp_path):
+    from autogen_core.memory import MemoryContent, MemoryMimeType
+
+    mm = MemoryManager(collection_name="test_spill_provider", spill_dir=str(tmp_path))
+    provider = mm.get_memory_provider("a")
+    await provider.add(MemoryContent(content="before spill", mime_type=MemoryMimeType.TEXT))
+    mm.spill("a")
+    # 書き出し後の書き込みは読み戻した短期記憶に入る
+    await provider.add(MemoryContent(content="after spill", mime_type=MemoryMimeType.TEXT))
+    assert "a" not in mm.spilled
+    mm.spill("a")
+    assert [c.content for c in mm.get_short_term("a").content] == ["before spill", "after spill"]
+    await mm.close()
+
+
+@pytest.mark.asyncio
+async def test_memory_manager_does_not_spill_while_consolidating():
+    import asyncio
+    import os
+    from autogen_core.memory import MemoryContent, MemoryMimeType
+
+    mm = MemoryManager(collection_name="test_spill_consolidating", short_term_options={"max_entries": 1}, idle_seconds=0)
+    ltm = mm.get_long_term()
+    release = asyncio.Event()
+    store_many = ltm.store_many
+
+    async def slow_store_many(records):
+        await release.wait()
+        return await store_many(records)
+
+    ltm.store_many = slow_store_many
+    stm = mm.get_short_term("a")
+    for text in ("first", "second"):
+        await stm.add(MemoryContent(content=text, mime_type=MemoryMimeType.TEXT))
+    # 統合が終わるまでは書き出さない
+    mm.get_short_term("b")
+    assert "a" in mm.short_term_memories and "a" not in mm.spilled
+    release.set()
+    await stm.consolidate()
+    mm.get_short_term("b")
+    assert "a" in mm.spilled
+    spill_dir = mm.spill_dir
+    assert os.path.isdir(spill_dir)
+    collection = ltm.collection
+    await mm.close()
+    # 自分で作った書き出し先はcloseで消す
+    assert not os.path.exists(spill_dir)
+    assert collection.get(include=["documents"])["documents"] == ["first"]
+
+
+@pytest.mark.asyncio
+async def test_memory_provider_selects_relevant_items_within_budget():
+    from autogen_core.memory import MemoryContent, MemoryMimeType
+    from autogen_core.model_context import UnboundedChatCompletionContext
+    from autogen_core.models import UserMessage
+
+    mm = MemoryManager(collection_name="test_memory_provider")
+    await mm.get_long_term().store_many([
+        {"id": "l1", "text": "the user is allergic to peanuts"},
+        {"id": "l2", "text": "the office moved to Osaka"},
+    ])
+    provider = mm.get_memory_provider("agent1", top_k=3, token_budget=30, recent_k=2)
+    for i in range(10):
+        await provider.add(MemoryContent(content=f"small talk {i}", mime_type=MemoryMimeType.TEXT))
+
+    context = UnboundedChatCompletionContext()
+    await context.add_message(UserMessage(content="is the user allergic to peanuts", source="user"))
+    result = await provider.update_context(context)
+    texts = [m.content for m in result.memories.results]
+    assert len(texts) <= 3
+    assert "the user is allergic to peanuts" in texts
+    assert "small talk 9" in texts and "small talk 0" not in texts
+    system = (await context.get_messages())[-1].content
+    assert "[long-term] the user is allergic to peanuts" in system
+    await mm.close()
+
+
+@pytest.mark.asyncio
+async def test_memory_provider_queries_knowledge_graph_off_the_event_loop():
+    import threading
+
+    class FakeNodes:
+        def get_field(self, node_id, field):
+            return f"fact {node_id}"
+
+    class FakeGraph:
+        index = [0, 1]
+        nodes = FakeNodes()
+        thread = None
+
+        def query_by_vector(self, query, top_k=5):
+            FakeGraph.thread = threading.current_thread()
+            return [(1, 0.9), (0, 0.5)]
+
+    mm = MemoryManager(collection_name="test_memory_provider_graph")
+    provider = mm.get_memory_provider("agent1", knowledge_graph=FakeGraph(), long_term_k=0, recent_k=0)
+    assert await provider.select("anything") == [("fact 1", "knowledge"), ("fact 0", "knowledge")]
+    assert FakeGraph.thread is not threading.main_thread()
+    await mm.close()
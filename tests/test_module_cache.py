@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+from myrdal.knowledge.module_cache import ModuleResultCache, canonical_args
+
+
+class CountingModule:
+    def __init__(self, delay=0.0):
+        self.calls = 0
+        self.delay = delay
+
+    async def __call__(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {"n": self.calls, "args": kwargs}
+
+
+def test_canonical_args_ignores_key_order():
+    assert canonical_args({"a": 1, "b": [1, 2]}) == canonical_args({"b": [1, 2], "a": 1})
+    assert canonical_args({"data": object()}) is None
+
+
+@pytest.mark.asyncio
+async def test_repeated_call_hits_cache_and_lru_bounds_size():
+    cache = ModuleResultCache(max_entries=2)
+    module = CountingModule()
+    first = await cache.call("multilingual", {"method": "translate", "text": "hi"}, module)
+    assert await cache.call("multilingual", {"text": "hi", "method": "translate"}, module) == first
+    assert module.calls == 1
+    for text in ("a", "b"):
+        await cache.call("multilingual", {"method": "translate", "text": text}, module)
+    assert len(cache) == 2
+    await cache.call("multilingual", {"method": "translate", "text": "hi"}, module)
+    assert module.calls == 4
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 4)
+    assert stats["per_module"]["multilingual"] == {"hits": 1, "misses": 4}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_calls_run_once():
+    cache = ModuleResultCache()
+    module = CountingModule(delay=0.05)
+    results = await asyncio.gather(*(cache.call("abstract_thinking", {"query": "q"}, module) for _ in range(5)))
+    assert module.calls == 1
+    assert all(r == results[0] for r in results)
+    assert cache.stats()["coalesced"] == 4
+
+
+@pytest.mark.asyncio
+async def test_uncacheable_call_runs_every_time_and_invalidates_module():
+    cache = ModuleResultCache(policies={"social_cognition": 0})
+    causal = CountingModule()
+    await cache.call("causal_reasoner", {"method": "infer", "query": {"x": 1}}, causal)
+    await cache.call("causal_reasoner", {"method": "discover_structure"}, causal)
+    await cache.call("causal_reasoner", {"method": "discover_structure"}, causal)
+    # 構造が変わったので推論結果は再計算される
+    await cache.call("causal_reasoner", {"method": "infer", "query": {"x": 1}}, causal)
+    assert causal.calls == 4
+    social = CountingModule()
+    for _ in range(2):
+        await cache.call("social_cognition", {"method": "estimate_emotion"}, social)
+    assert social.calls == 2
+    assert cache.stats()["bypassed"] == 4
+
+
+@pytest.mark.asyncio
+async def test_ttl_expiry_and_errors_are_not_cached():
+    cache = ModuleResultCache(policies={"multilingual": 0.05})
+    module = CountingModule()
+    await cache.call("multilingual", {"text": "x"}, module)
+    await asyncio.sleep(0.06)
+    await cache.call("multilingual", {"text": "x"}, module)
+    assert module.calls == 2
+
+    async def failing(**kwargs):
+        failing.calls += 1
+        raise RuntimeError("boom")
+    failing.calls = 0
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await cache.call("knowledge_integration", {"q": 1}, failing)
+    assert failing.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_shared_call_is_cancelled_with_its_last_waiter():
+    cache = ModuleResultCache()
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def slow(**kwargs):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    first = asyncio.ensure_future(cache.call("abstract_thinking", {"q": 1}, slow))
+    second = asyncio.ensure_future(cache.call("abstract_thinking", {"q": 1}, slow))
+    await started.wait()
+    # 待ち手が残っている間は実行を続ける
+    first.cancel()
+    await asyncio.sleep(0.01)
+    assert not cancelled.is_set()
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(second, 0.01)
+    await asyncio.wait_for(cancelled.wait(), 1.0)
+    assert len(cache) == 0 and not cache._inflight
+
+
+@pytest.mark.asyncio
+async def test_result_computed_across_an_invalidation_is_not_stored():
+    cache = ModuleResultCache()
+    causal = CountingModule(delay=0.05)
+    infer = asyncio.ensure_future(cache.call("causal_reasoner", {"method": "infer"}, causal))
+    await asyncio.sleep(0.01)
+    # 推論の実行中に構造が更新された
+    await cache.call("causal_reasoner", {"method": "discover_structure"}, CountingModule())
+    await infer
+    assert len(cache) == 0
+    await cache.call("causal_reasoner", {"method": "infer"}, causal)
+    assert causal.calls == 2
@@ -0,0 +1,350 @@
+import numpy as np
+from myrdal.knowledge.multilayer_knowledge_graph import MultiLayerKnowledgeGraph
+from myrdal.knowledge.embedding_index import EmbeddingIndex
+
+
+class DummyEmbedder:
+    """単語ハッシュによる決定的な埋め込み（モデルのダウンロード不要）"""
+    dim = 16
+
+    def _one(self, text):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            vec[sum(map(ord, word)) % self.dim] += 1.0
+        return vec
+
+    def encode(self, text, batch_size=32, **kwargs):
+        if isinstance(text, str):
+            return self._one(text)
+        return np.stack([self._one(t) for t in text]).reshape(-1, self.dim)
+
+
+def make_graph():
+    return MultiLayerKnowledgeGraph(embedder=DummyEmbedder())
+
+
+def test_embedding_index_matches_bruteforce():
+    rng = np.random.default_rng(0)
+    vecs = rng.normal(size=(50, 8)).astype(np.float32)
+    index = EmbeddingIndex()
+    for i, v in enumerate(vecs):
+        index.add(f"n{i}", v)
+    index.remove("n3")
+    index.remove("n49")
+    q = rng.normal(size=8)
+    alive = [i for i in range(50) if i not in (3, 49)]
+    sims = {f"n{i}": vecs[i] @ q / (np.linalg.norm(vecs[i]) * np.linalg.norm(q)) for i in alive}
+    expected = sorted(sims, key=sims.get, reverse=True)[:5]
+    assert [nid for nid, _ in index.search(q, top_k=5)] == expected
+    assert "n3" not in index and len(index) == 48
+
+
+def test_query_by_vector_and_removal():
+    kg = make_graph()
+    a = kg.add_fact("the cat sat on the mat")
+    b = kg.add_fact("quantum field theory")
+    assert kg.query_by_vector("cat mat", top_k=1)[0][0] == a
+    kg.remove_nodes([a])
+    assert kg.query_by_vector("cat mat", top_k=1)[0][0] == b
+    assert a not in kg.index
+
+
+def test_auto_update_merges_near_duplicates():
+    kg = make_graph()
+    first = kg.auto_update("water boils at 100 degrees")
+    again = kg.auto_update("water boils at 100 degrees", confidence=0.9)
+    assert first == again
+    assert kg.get_node(first).confidence == 0.9
+
+
+def clustered_vectors(n, dim=32, n_clusters=64, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim))
+    labels = rng.integers(0, n_clusters, size=n)
+    return (centers[labels] + 0.3 * rng.normal(size=(n, dim))).astype(np.float32), rng
+
+
+def test_ivf_recall_against_bruteforce():
+    from myrdal.knowledge.ann_index import IVFFlatIndex
+    vecs, rng = clustered_vectors(5000)
+    flat, ivf = EmbeddingIndex(), IVFFlatIndex(nlist=64, nprobe=8, train_threshold=1000)
+    ids = [f"n{i}" for i in range(len(vecs))]
+    flat.add_many(ids, vecs)
+    ivf.add_many(ids[:2000], vecs[:2000])
+    for i in range(2000, len(vecs)):
+        ivf.add(ids[i], vecs[i])
+    assert ivf.is_trained
+    hits = total = 0
+    for q in vecs[rng.choice(len(vecs), 50)] + 0.1 * rng.normal(size=(50, vecs.shape[1])):
+        expected = {nid for nid, _ in flat.search(q, top_k=10)}
+        hits += len(expected & {nid for nid, _ in ivf.search(q, top_k=10)})
+        total += 10
+        # 全リストを探索すれば総当たりと一致する
+        assert {nid for nid, _ in ivf.search(q, top_k=10, nprobe=64)} == expected
+    assert hits / total >= 0.9
+
+
+def test_ivf_tombstone_delete_and_upsert():
+    from myrdal.knowledge.ann_index import IVFFlatIndex
+    vecs, _ = clustered_vectors(3000, n_clusters=16)
+    ivf = IVFFlatIndex(nlist=16, nprobe=16, train_threshold=500)
+    ivf.add_many([f"n{i}" for i in range(len(vecs))], vecs)
+    for i in range(0, 1200):
+        ivf.remove(f"n{i}")
+    assert len(ivf) == 1800
+    assert all(int(nid[1:]) >= 1200 for nid, _ in ivf.search(vecs[0], top_k=20))
+    ivf.add("n1500", vecs[0])
+    assert ivf.search(vecs[0], top_k=1)[0][0] == "n1500"
+    assert len(ivf) == 1800
+
+
+def test_graph_with_ivf_backend():
+    kg = MultiLayerKnowledgeGraph(embedder=DummyEmbedder(), index_backend="ivf", index_params={"train_threshold": 8})
+    ids = [kg.add_fact(f"topic{i} detail{i}") for i in range(20)]
+    assert kg.query_by_vector("topic3 detail3", top_k=1, nprobe=64)[0][0] == ids[3]
+
+
+def test_auto_update_bulk_batches_and_deduplicates():
+    kg = make_graph()
+    existing = kg.add_fact("paris is the capital of france")
+    calls = []
+    encode = kg.embedder.encode
+    kg.embedder.encode = lambda texts, **kw: calls.append(len(texts)) or encode(texts, **kw)
+    contents = (c for c in [
+        "paris is the capital of france",
+        "tokyo is the capital of japan",
+        {"content": "tokyo is the capital of japan", "confidence": 0.8},
+        {"content": "mount fuji is in japan", "parent_id": existing, "relation": "related"},
+    ])
+    ids = kg.auto_update_bulk(contents, batch_size=3)
+    assert calls == [3, 1]
+    assert ids[0] == existing
+    assert ids[1] == ids[2] != existing
+    assert kg.get_node(ids[1]).confidence == 0.8
+    assert kg.get_children(existing) == [ids[3]]
+    assert len(kg.graph) == len(kg.index) == 3
+
+
+def test_new_ids_are_not_reused_after_removal():
+    kg = make_graph()
+    first, second = kg.add_fact("alpha one"), kg.add_fact("beta two")
+    kg.remove_node(first)
+    third = kg.add_fact("gamma three")
+    new_ids = kg.auto_update_bulk(["delta four", "epsilon five"], threshold=1.01)
+    assert len({second, third, *new_ids}) == 4
+    assert kg.get_node(second).content == "beta two"
+    assert len(kg.graph) == len(kg.index) == 4
+
+
+def test_embedding_cache_persists_and_counts(tmp_path):
+    from myrdal.knowledge.embedding_cache import EmbeddingCache
+    cache = EmbeddingCache(str(tmp_path), model_name="dummy", max_entries=2, memory_entries=1)
+    kg = MultiLayerKnowledgeGraph(embedder=DummyEmbedder(), embedding_cache=cache)
+    kg.add_fact("alpha beta")
+    kg.add_fact("alpha beta")
+    assert kg.embedding_cache_stats()["hits"] == 1
+    cache.put("gamma", np.ones(DummyEmbedder.dim))
+    cache.put("delta", np.ones(DummyEmbedder.dim))  # "alpha beta"が追い出される
+    cache.close()
+    reopened = EmbeddingCache(str(tmp_path), model_name="dummy")
+    assert reopened.get("alpha beta") is None
+    assert np.allclose(reopened.get("gamma"), 1.0)
+    assert reopened.stats()["misses"] == 1
+
+
+def test_graph_owned_embedding_cache_survives_restart(tmp_path):
+    from myrdal.knowledge.embedding_cache import EmbeddingCache
+    cache_dir = str(tmp_path / "cache")
+    kg = MultiLayerKnowledgeGraph(embedder=DummyEmbedder(), embedding_cache=cache_dir, embedding_model_name="dummy")
+    kg.add_fact("alpha beta")
+    kg.save(str(tmp_path / "snap"))
+    assert EmbeddingCache(cache_dir, model_name="dummy").get("alpha beta") is not None
+    kg.add_fact("gamma delta")
+    kg.close()
+    restarted = MultiLayerKnowledgeGraph(embedder=DummyEmbedder(), embedding_cache=cache_dir, embedding_model_name="dummy")
+    restarted.add_fact("gamma delta")
+    assert restarted.embedding_cache_stats()["hits"] == 1
+
+
+def test_embedding_cache_grows_lazily(tmp_path):
+    from myrdal.knowledge.embedding_cache import EmbeddingCache
+    cache = EmbeddingCache(str(tmp_path), model_name="dummy", initial_capacity=2)
+    for i in range(5):
+        cache.put(f"text {i}", np.full(DummyEmbedder.dim, i, dtype=np.float32))
+    assert cache._data.shape[0] == 8
+    cache.close()
+    reopened = EmbeddingCache(str(tmp_path), model_name="dummy")
+    assert reopened.max_entries == 1_000_000
+    assert all(np.allclose(reopened.get(f"text {i}"), i) for i in range(5))
+
+
+def test_node_store_materializes_lazily():
+    kg = make_graph()
+    a = kg.add_concept("gravity", source="physics", confidence=0.5)
+    b = kg.add_fact("apples fall", source="physics")
+    kg.update_knowledge(a, priority=2, confidence=0.75)
+    assert kg.graph.nodes[a] == {}
+    node = kg.get_node(a)
+    assert (node.type, node.source, node.confidence, node.extra) == ("concept", "physics", 0.75, {"priority": 2})
+    assert len(node.embedding) == DummyEmbedder.dim
+    assert kg.query_by_type("fact") == [b]
+    kg.remove_nodes([a])
+    c = kg.add_theory("relativity")
+    assert kg.nodes.id_to_row[c] == 0  # 削除した行を再利用する
+    assert kg.query_by_type("concept") == []
+
+
+def test_quantized_flat_index_ranking():
+    rng = np.random.default_rng(1)
+    vecs = rng.normal(size=(200, 32)).astype(np.float32)
+    ids = [f"n{i}" for i in range(200)]
+    exact = EmbeddingIndex()
+    exact.add_many(ids, vecs)
+    for dtype in ("float16", "int8"):
+        index = EmbeddingIndex(dtype=dtype)
+        index.add_many(ids, vecs)
+        assert index.vectors.dtype == np.float32
+        for q in vecs[:10]:
+            assert index.search(q, top_k=1)[0][0] == exact.search(q, top_k=1)[0][0]
+
+
+def test_snapshot_roundtrip_with_incremental_segments(tmp_path):
+    kg = make_graph()
+    a = kg.add_concept("animals", source="zoo")
+    b = kg.auto_update("cats are animals", parent_id=a, relation="is_a", confidence=0.7)
+    c = kg.add_fact("rocks are minerals")
+    kg.save(str(tmp_path))
+
+    loaded = MultiLayerKnowledgeGraph.load(str(tmp_path), embedder=DummyEmbedder())
+    assert isinstance(loaded.index.vectors, np.memmap)
+    assert loaded.get_node(b).confidence == 0.7
+    assert loaded.get_children(a) == [b]
+    # 差分のみ追記
+    d = loaded.auto_update("dogs are animals", parent_id=a, relation="is_a")
+    loaded.update_knowledge(a, priority=1)
+    loaded.remove_nodes([c])
+    loaded.save(str(tmp_path), incremental=True)
+    assert len(list(tmp_path.glob("seg_*"))) == 1
+
+    again = MultiLayerKnowledgeGraph.load(str(tmp_path), embedder=DummyEmbedder())
+    assert sorted(again.get_children(a)) == sorted([b, d])
+    assert again.get_node(a).extra == {"priority": 1}
+    assert c not in again.nodes and c not in again.graph
+    assert again.query_by_vector("dogs are animals", top_k=1)[0][0] == d
+    # フル保存で差分を畳み込む（既存のディレクトリは上書きせず、新しい名前のベースへ切り替える）
+    again.add_edge(a, b, "related")
+    (tmp_path / "base_000003").mkdir()
+    again.save(str(tmp_path))
+    assert list(tmp_path.glob("seg_*")) == []
+    assert [p.name for p in tmp_path.glob("base_*")] == ["base_000004"]
+    assert again.get_node(b).confidence == 0.7
+    final = MultiLayerKnowledgeGraph.load(str(tmp_path), mmap=False, embedder=DummyEmbedder())
+    assert final.get_node(d).content == "dogs are animals"
+    assert sorted(r for _, _, r in final.graph.edges(a, data="relation")) == ["is_a", "is_a", "related"]
+
+
+def test_secondary_indexes_follow_updates_and_removals():
+    kg = make_graph()
+    a = kg.add_fact("alpha", source="wiki", confidence=0.9, timestamp="2024-01-01")
+    b = kg.add_fact("beta", source="wiki", confidence=0.4, timestamp="2024-06-01")
+    c = kg.add_concept("gamma", source="paper", confidence=0.8, timestamp="2025-01-01")
+    assert set(kg.query_by_source("wiki")) == {a, b}
+    assert kg.query_by_confidence(min_confidence=0.7) == [c, a]
+    assert kg.query_by_time(since="2024-03-01", until="2024-12-31") == [b]
+    kg.update_knowledge(b, confidence=0.95, source="paper")
+    assert kg.filter_nodes(source="paper", min_confidence=0.7) == {b, c}
+    kg.remove_nodes([c])
+    assert kg.filter_nodes(source="paper") == {b}
+    assert kg.query_by_type("concept") == []
+    # priorityの挿入は後続を繰り下げる
+    kg.set_priority(a, 1)
+    kg.set_priority(b, 2)
+    d = kg.add_fact("delta")
+    kg.insert_priority(d, after_priority=1)
+    assert kg.query_by_priority() == [a, d, b]
+    assert kg.get_node(b).extra == {"priority": 3}
+
+
+def test_secondary_indexes_rebuilt_after_load(tmp_path):
+    kg = make_graph()
+    a = kg.add_fact("alpha", source="wiki", confidence=0.9)
+    kg.set_priority(a, 5)
+    kg.save(str(tmp_path))
+    loaded = MultiLayerKnowledgeGraph.load(str(tmp_path), embedder=DummyEmbedder())
+    assert loaded.filter_nodes(node_type="fact", source="wiki", min_priority=5) == {a}
+
+
+def test_filtered_and_hybrid_search():
+    kg = make_graph()
+    a = kg.add_fact("solar panels convert sunlight", source="energy", confidence=0.9)
+    b = kg.add_fact("solar panels convert sunlight cheaply", source="blog", confidence=0.3)
+    c = kg.add_fact("wind turbines convert wind", source="energy", confidence=0.8)
+    hits = kg.search("solar panels", top_k=3, source="energy", min_confidence=0.7)
+    assert [nid for nid, _ in hits][0] == a
+    assert b not in {nid for nid, _ in hits}
+    assert kg.search("solar", source="unknown") == []
+    hybrid = kg.search("turbines", top_k=2, lexical=True)
+    assert hybrid[0][0] == c
+    kg.remove_nodes([c])
+    assert c not in {nid for nid, _ in kg.search("turbines", lexical=True)}
+
+
+def test_ivf_filtered_search_falls_back_to_exact():
+    from myrdal.knowledge.ann_index import IVFFlatIndex
+    vecs, _ = clustered_vectors(2000, n_clusters=16)
+    ivf = IVFFlatIndex(nlist=16, nprobe=1, train_threshold=500)
+    ids = [f"n{i}" for i in range(len(vecs))]
+    ivf.add_many(ids, vecs)
+    allowed = set(ids[1500:])
+    hits = ivf.search(vecs[0], top_k=5, allowed=allowed)
+    assert len(hits) == 5 and all(nid in allowed for nid, _ in hits)
+
+
+def test_hierarchical_reasoning_dedups_and_invalidates():
+    kg = make_graph()
+    root = kg.add_theory("root")
+    left, right = kg.add_concept("left"), kg.add_concept("right")
+    leaf = kg.add_fact("leaf")
+    # 菱形: root -> left/right -> leaf
+    kg.add_edges_bulk([(root, left, "has"), (root, right, "has"), (left, leaf, "has"), (right, leaf, "has")])
+    assert sorted(kg.hierarchical_reasoning(leaf, "up", depth=2)) == sorted([left, right, root])
+    assert kg.hierarchy.hits == 0
+    kg.hierarchical_reasoning(leaf, "up", depth=2)
+    assert kg.hierarchy.hits == 1
+    top = kg.add_theory("top")
+    kg.add_edge(top, root, "has")
+    assert top in kg.hierarchical_reasoning(leaf, "up", depth=None)
+    assert set(kg.hierarchical_reasoning([left, right], "down", depth=1)) == {leaf}
+    kg.remove_nodes([left, right])
+    assert kg.hierarchical_reasoning(leaf, "up", depth=None) == []
+
+
+def test_auto_update_async_batches_and_dedups():
+    import asyncio
+
+    kg = make_graph()
+    parent = kg.add_theory("parent")
+
+    async def run():
+        ids = await asyncio.gather(*(kg.auto_update_async(f"item {i % 5}", parent_id=parent, relation="has") for i in range(20)))
+        await kg.ingestor.close()
+        return ids
+
+    ids = asyncio.run(run())
+    assert len(set(ids)) == 5
+    assert ids[:5] == ids[5:10]
+    assert kg.ingestor.batches < 20
+    assert set(kg.get_children(parent)) == set(ids)
+
+
+def test_bulk_import_into_multilayer_graph():
+    import asyncio
+    from myrdal.knowledge.bulk_import import import_triples
+
+    kg = make_graph()
+    triples = [("/c/en/dog", "/r/IsA", "/c/en/animal"), ("/c/en/cat", "/r/IsA", "/c/en/animal")]
+    stats = asyncio.run(import_triples(kg, iter(triples), batch_size=1, source="conceptnet"))
+    assert (stats.triples, stats.nodes) == (2, 3)
+    assert kg.get_node("/c/en/dog").content == "dog"
+    assert set(kg.get_parents("/c/en/animal")) == {"/c/en/dog", "/c/en/cat"}
+    assert set(kg.query_by_source("conceptnet")) == {"/c/en/dog", "/c/en/cat", "/c/en/animal"}
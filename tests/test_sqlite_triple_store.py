@@ -0,0 +1,21 @@
+import pytest
+from myrdal.knowledge.sqlite_triple_store import SQLiteKnowledgeGraph
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store_roundtrip(tmp_path):
+    path = str(tmp_path / "kg.db")
+    async with SQLiteKnowledgeGraph(path, batch_size=3, fetch_size=2) as kg:
+        await kg.add_facts((f"s{i}", "p", f"o{i % 4}") for i in range(10))
+        await kg.add_fact("s0", "q", "o0")
+        assert await kg.count() == 11
+        streamed = [t async for t in kg.query(predicate="p", obj="o1")]
+        assert sorted(streamed) == [("s1", "p", "o1"), ("s5", "p", "o1"), ("s9", "p", "o1")]
+        assert await kg.query(subject="s0") == [("s0", "p", "o0"), ("s0", "q", "o0")]
+        await kg.delete_fact("s0", "q", "o0")
+        with pytest.raises(KeyError):
+            await kg.delete_fact("s0", "q", "o0")
+    # 再度開いても内容が残っている
+    async with SQLiteKnowledgeGraph(path) as kg:
+        assert await kg.count(subject="s0") == 1
+        assert len(await kg.query()) == 10
@@ -0,0 +1,36 @@
+from autogen_core.models import RequestUsage, SystemMessage, UserMessage
+from myrdal.knowledge.token_accounting import TokenCounter, UsageLedger
+
+
+def test_token_counter_caches_repeated_text():
+    counter = TokenCounter()
+    messages = [SystemMessage(content="static instructions " * 20), UserMessage(content="question", source="user")]
+    first = counter.count_messages(messages)
+    assert first > counter.count("static instructions " * 20) > 0
+    misses = counter.misses
+    assert counter.count_messages(messages) == first
+    assert counter.misses == misses and counter.hits >= 2
+    # dict形式のメッセージやツール定義も数えられる
+    assert counter.count_messages([{"role": "user", "content": "question"}]) == counter.count_messages(messages[1:])
+    assert counter.count_messages(messages, tools=[{"name": "f", "parameters": {}}]) > first
+    assert counter.count_messages([]) == 0
+
+
+def test_token_counter_cache_is_bounded():
+    counter = TokenCounter(cache_size=2)
+    for text in ("a", "b", "c"):
+        counter.count(text)
+    assert len(counter._cache) == 2
+
+
+def test_usage_ledger_breaks_down_by_step():
+    ledger = UsageLedger()
+    ledger.record(1, 100, 10)
+    ledger.record(1, 120, 12)  # リトライ
+    ledger.record(2, 150, 20, estimated=True)
+    assert ledger.as_usage() == RequestUsage(prompt_tokens=370, completion_tokens=42)
+    assert ledger.breakdown() == [
+        {"step": 1, "prompt_tokens": 220, "completion_tokens": 22, "calls": 2, "estimated": False},
+        {"step": 2, "prompt_tokens": 150, "completion_tokens": 20, "calls": 1, "estimated": True},
+    ]
+    assert ledger.step(3)["calls"] == 0
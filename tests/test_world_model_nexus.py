@@ -0,0 +1,259 @@
+import asyncio
+import json
+import time
+
+import pytest
+from autogen_core import CancellationToken
+from autogen_core.models import CreateResult, RequestUsage, UserMessage
+from myrdal.knowledge import world_model_nexus
+from myrdal.knowledge.world_model_nexus import WorldModelNexus
+
+MESSAGES = [UserMessage(content="hello", source="user")]
+
+
+class FakeModule:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    async def __call__(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("boom")
+        return {"slept": self.delay, "args": kwargs}
+
+
+def reply(thought="", call_module=None, final_answer=None, usage=(100, 10), delay=0.0):
+    """内部LLMの1ステップ分の応答。usage=Noneなら使用量を報告しない。delay秒かけて返す"""
+    return {
+        "delay": delay,
+        "response": {
+            "thought": thought,
+            "call_module": call_module,
+            "call_args": {},
+            "satisfied": final_answer is not None,
+            "final_answer": final_answer,
+        },
+        "usage": usage,
+    }
+
+
+class FakeClient:
+    """repliesを順に返す内部LLM（使い切ったら最後の応答を繰り返す）。予算切れの指示にはfinalを返す"""
+
+    def __init__(self, *replies, final=None):
+        self.replies = list(replies)
+        self.final = final
+        self.requests = []
+
+    async def create(self, messages, extra_create_args=None, **kwargs):
+        self.requests.append(messages)
+        step = self.replies[min(len(self.requests), len(self.replies)) - 1]
+        if self.final is not None and "budget is exhausted" in messages[-1].content:
+            step = self.final
+        await asyncio.sleep(step["delay"])
+        usage = step["usage"] or (0, 0)
+        return CreateResult(
+            content=json.dumps(step["response"]),
+            usage=RequestUsage(prompt_tokens=usage[0], completion_tokens=usage[1]),
+            finish_reason="stop",
+            cached=False,
+        )
+
+    async def create_stream(self, messages, extra_create_args=None, **kwargs):
+        yield await self.create(messages, extra_create_args, **kwargs)
+
+
+@pytest.fixture
+def make_wmn(monkeypatch):
+    # 本物の知識モジュールはモデルの読み込みや外部APIを伴うため、差し替えてから作る
+    for name in ("AbstractThinking", "MultilingualUnderstanding", "SocialCognition", "KnowledgeIntegration", "CausalReasoner"):
+        monkeypatch.setattr(world_model_nexus, name, lambda: None)
+
+    def make(client, modules, **options):
+        wmn = WorldModelNexus(chat_client=client, **options)
+        wmn.knowledge_modules = modules
+        return wmn
+
+    return make
+
+
+@pytest.mark.asyncio
+async def test_listed_modules_run_concurrently_and_keep_partial_results(make_wmn):
+    calls = [{"module": name, "args": {}} for name in ("a", "b", "slow", "broken")]
+    modules = {"a": FakeModule(0.3), "b": FakeModule(0.3), "slow": FakeModule(5.0), "broken": FakeModule(fail=True)}
+    wmn = make_wmn(FakeClient(reply("look it up", calls, "done")), modules, module_timeouts={"slow": 0.4})
+    started = time.perf_counter()
+    result = await wmn.deliberate({"messages": MESSAGES})
+    # 逐次なら1秒かかる。並行なので最も遅いモジュール（タイムアウトの0.4秒）分で済む
+    assert time.perf_counter() - started < 0.7
+    a, b, slow, broken = result["module_result"]
+    assert a == {"a": {"slept": 0.3, "args": {}}} and b == {"b": {"slept": 0.3, "args": {}}}
+    assert "timed out" in slow["slow"]["error"]
+    assert "boom" in broken["broken"]["error"]
+
+
+def test_module_runner_survives_a_new_event_loop(make_wmn):
+    modules = {"a": FakeModule(0.05), "b": FakeModule(0.05)}
+    client = FakeClient(reply("", [{"module": "a"}, {"module": "b"}], "done"))
+    # 同時実行数1で待ちを発生させ、セマフォがループに紐づく状況にする
+    wmn = make_wmn(client, modules, module_concurrency=1, module_cache_size=0)
+    for _ in range(2):
+        result = asyncio.run(wmn.deliberate({"messages": MESSAGES}))
+        assert [list(r) for r in result["module_result"]] == [["a"], ["b"]]
+    assert modules["a"].calls == modules["b"].calls == 2
+
+
+@pytest.mark.asyncio
+async def test_timed_out_module_does_not_keep_running(make_wmn):
+    cancelled = asyncio.Event()
+
+    async def slow(**kwargs):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    wmn = make_wmn(FakeClient(reply("", "slow", "done")), {"slow": slow}, module_timeout=0.05)
+    result = await wmn.deliberate({"messages": MESSAGES})
+    assert "timed out" in result["module_result"]["error"]
+    await asyncio.wait_for(cancelled.wait(), 1.0)
+
+
+@pytest.mark.asyncio
+async def test_model_can_read_an_abbreviated_result_by_handle(make_wmn):
+    full = "fact " * 200
+
+    async def large(**kwargs):
+        return full
+
+    client = FakeClient(
+        reply("fetch", "large"),
+        reply("read", [{"module": "read_result", "args": {"handle": "r1", "offset": 10}}]),
+        reply("done", final_answer="ok"),
+    )
+    wmn = make_wmn(client, {"large": large}, max_result_chars=200, module_cache_size=0)
+    context = wmn._request_context(MESSAGES, {})
+    steps = [step async for step in wmn.deliberate_stream(context)]
+    assert "[handle r1" in client.requests[1][-2].content
+    assert "read_result" in client.requests[0][0].content
+    part = steps[1]["module_result"][0]["read_result"]
+    assert part["text"] == full[10:110] and part["next_offset"] == 110
+    assert steps[-1]["final_answer"] == "ok"
+    # 結果の読み出しはモジュール呼び出しの予算に数えない
+    assert context["budget"].module_calls == 1
+
+
+def endless(usage=(100, 10), delay=0.0, final_delay=0.0):
+    """毎ステップ2つのモジュールを呼び、自分からは終えない内部LLM"""
+    return FakeClient(
+        reply("more", [{"module": "a", "args": {"delay": delay}}, {"module": "a", "args": {"i": 2}}], usage=usage),
+        final=reply("wrap up", final_answer="FINAL", usage=usage, delay=final_delay),
+    )
+
+
+class SleepyModule(FakeModule):
+    async def __call__(self, delay=0.0, **kwargs):
+        self.delay = delay
+        return await super().__call__(**kwargs)
+
+
+@pytest.mark.asyncio
+async def test_max_steps_forces_a_final_step(make_wmn):
+    client = endless()
+    wmn = make_wmn(client, {"a": SleepyModule()}, module_cache_size=0)
+    result = await wmn.create(MESSAGES, extra_create_args={"max_steps": 3})
+    assert (result.content, result.finish_reason) == ("FINAL", "length")
+    assert len(client.requests) == 4
+
+
+@pytest.mark.asyncio
+async def test_module_calls_are_clipped_to_the_remaining_allowance(make_wmn):
+    module = SleepyModule()
+    wmn = make_wmn(endless(), {"a": module}, module_cache_size=0)
+    context = wmn._request_context(MESSAGES, {"budget": {"max_module_calls": 3}})
+    steps = [step async for step in wmn.deliberate_stream(context)]
+    assert module.calls == 3
+    assert len(steps[0]["module_result"]) == 2
+    assert len(steps[1]["module_result"]) == 1 and steps[1]["skipped_modules"] == ["a"]
+    assert steps[-1]["final_answer"] == "FINAL" and steps[-1]["budget_exhausted"].startswith("max_module_calls")
+
+
+@pytest.mark.asyncio
+async def test_deadline_bounds_module_calls_and_forces_a_final_step(make_wmn):
+    wmn = make_wmn(endless(delay=5.0), {"a": SleepyModule()}, module_cache_size=0)
+    started = time.perf_counter()
+    result = await wmn.create(MESSAGES, extra_create_args={"deadline": 0.3})
+    # モジュールのタイムアウトは残り時間に切り詰められる
+    assert time.perf_counter() - started < 1.0
+    assert (result.content, result.finish_reason) == ("FINAL", "length")
+
+    # 最終回答のステップが止まっても、猶予を過ぎたら直前の思考を回答にして終える
+    wmn = make_wmn(endless(delay=5.0, final_delay=10.0), {"a": SleepyModule()}, module_cache_size=0, final_step_grace=0.2)
+    started = time.perf_counter()
+    result = await wmn.create(MESSAGES, extra_create_args={"deadline": 0.3})
+    assert time.perf_counter() - started < 1.0
+    assert (result.content, result.finish_reason) == ("more", "length")
+
+
+@pytest.mark.asyncio
+async def test_prompt_token_budget_is_checked_before_sending(make_wmn):
+    # 使用量を報告しない内部LLMなので、手元で数えたトークン数で予算を判定する
+    wmn = make_wmn(endless(usage=None), {"a": SleepyModule()}, module_cache_size=0)
+    unlimited = await wmn.deliberate(wmn._request_context(MESSAGES, {"max_steps": 2}))
+    first, second = (entry["prompt_tokens"] for entry in unlimited["usage_breakdown"][:2])
+    client = endless(usage=None)
+    wmn = make_wmn(client, {"a": SleepyModule()}, module_cache_size=0)
+    context = wmn._request_context(MESSAGES, {"max_prompt_tokens": first + second - 1})
+    result = await wmn.deliberate(context)
+    # 2ステップ目は送ると予算を超えるので、送らずに最終回答のステップに入る
+    assert len(client.requests) == 2
+    assert result["budget_exhausted"].startswith("max_prompt_tokens")
+    assert context["usage"].step(1)["prompt_tokens"] == first
+
+
+@pytest.mark.asyncio
+async def test_cancellation_between_steps_stops_the_deliberation(make_wmn):
+    client = endless()
+    wmn = make_wmn(client, {"a": SleepyModule()}, module_cache_size=0)
+    token = CancellationToken()
+    context = wmn._request_context(MESSAGES, {}, token)
+    with pytest.raises(asyncio.CancelledError):
+        async for step in wmn.deliberate_stream(context):
+            token.cancel()
+    assert len(client.requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_usage_sums_inner_calls_and_actual_usage_skips_estimates(make_wmn):
+    client = FakeClient(
+        reply("reported", [{"module": "a"}], usage=(100, 10)),
+        reply("unreported", [{"module": "a", "args": {"i": 2}}], usage=None),
+        final=reply("wrap up", final_answer="FINAL", usage=(50, 5)),
+    )
+    wmn = make_wmn(client, {"a": FakeModule()})
+    result = await wmn.create(MESSAGES, extra_create_args={"max_steps": 2})
+    breakdown = wmn.last_request_usage.breakdown()
+    assert [(entry["step"], entry["estimated"]) for entry in breakdown] == [(1, False), (2, True), (3, False)]
+    estimated = breakdown[1]
+    assert estimated["prompt_tokens"] > 0 and estimated["completion_tokens"] > 0
+    assert result.usage == RequestUsage(
+        prompt_tokens=150 + estimated["prompt_tokens"], completion_tokens=15 + estimated["completion_tokens"]
+    )
+    assert wmn.total_usage() == result.usage
+    # 内部クライアントが報告した分だけ
+    assert wmn.actual_usage() == RequestUsage(prompt_tokens=150, completion_tokens=15)
+
+
+@pytest.mark.asyncio
+async def test_deliberate_reports_usage_breakdown(make_wmn):
+    wmn = make_wmn(endless(), {"a": SleepyModule()}, module_cache_size=0)
+    result = await wmn.deliberate(wmn._request_context(MESSAGES, {"max_steps": 2}))
+    assert result["usage_breakdown"] == [
+        {"step": step, "prompt_tokens": 100, "completion_tokens": 10, "calls": 1, "estimated": False} for step in (1, 2, 3)
+    ]
+    # 各ステップの結果には、そのステップの使用量が付く
+    assert result["usage"] == {"prompt_tokens": 100, "completion_tokens": 10, "calls": 1, "estimated": False}